@@ -1,73 +1,976 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import StreamingResponse, Response, FileResponse
+from fastapi.responses import ORJSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo import monitoring
+from bson import ObjectId
+from bson.errors import InvalidId
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, TYPE_CHECKING
 import uuid
-from datetime import datetime, timezone
-import requests
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
 import aiofiles
-import base64
+import asyncio
+import binascii
+import gzip
+import hashlib
 import json
-# replace this import
-# from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
+import re
+import sys
+import math
+import random
+import bisect
+import contextvars
+import threading
+from contextlib import contextmanager
+import httpx
+import numpy as np
+import orjson
+from PIL import Image
 
-from openai import AsyncOpenAI
-import base64, requests, uuid, logging
+try:
+    import brotli
+except ImportError:
+    # Optional; without it responses are compressed with gzip only
+    brotli = None
 
-async def get_ai_analysis(image_url: str, analysis_type: str = "general") -> str:
-    """Get AI analysis of NASA image"""
+if TYPE_CHECKING:
+    # The SDK takes longer to import than the rest of the app, so it is loaded on first LLM call
+    from openai import AsyncOpenAI
+
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Metrics, exported in Prometheus text format at /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# Tag log lines with a per-request trace id (taken from X-Request-ID when the caller sends one)
+LOG_TRACE_IDS = os.environ.get('LOG_TRACE_IDS', 'true').lower() == 'true'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metric:
+    """A labelled counter or histogram; updates may come from Mongo driver threads, hence the lock"""
+
+    kind = ""
+
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple, **extra) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            lines.extend(self._samples(key, value))
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key: tuple, value) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {value}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _samples(self, key: tuple, value) -> List[str]:
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{self._labels(key, le=le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+REQUEST_SECONDS = Histogram("zoomage_http_request_duration_seconds", "Request latency by route, including streamed bodies", ("method", "route"))
+REQUESTS = Counter("zoomage_http_requests_total", "Requests by route and status code", ("method", "route", "status"))
+STAGE_SECONDS = Histogram("zoomage_stage_duration_seconds", "Latency of each request stage", ("stage",))
+UPSTREAM_ERRORS = Counter("zoomage_upstream_errors_total", "Failed upstream calls by stage and error", ("stage", "error"))
+DOWNLOADED_BYTES = Counter("zoomage_downloaded_bytes_total", "Bytes downloaded from upstreams", ("source",))
+LLM_TOKENS = Counter("zoomage_llm_tokens_total", "Tokens reported by the model API", ("stage", "kind"))
+MONGO_SECONDS = Histogram("zoomage_mongo_command_duration_seconds", "Mongo command latency", ("command",))
+MONGO_FAILURES = Counter("zoomage_mongo_command_failures_total", "Failed Mongo commands", ("command",))
+UPSTREAM_RETRIES = Counter("zoomage_upstream_retries_total", "Upstream requests retried after a 429, 5xx or connection error", ("upstream",))
+UPSTREAM_REJECTIONS = Counter("zoomage_upstream_rejections_total", "Upstream requests refused locally", ("upstream", "reason"))
+UPSTREAM_QUEUE_WAIT = Histogram("zoomage_upstream_queue_wait_seconds", "Time spent waiting for a rate-limit token", ("upstream",))
+UPSTREAM_QUEUE_DEPTH = Gauge("zoomage_upstream_queue_depth", "Requests waiting for a rate-limit token", ("upstream",))
+UPSTREAM_CIRCUIT_STATE = Gauge("zoomage_upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ("upstream",))
+STALE_RESPONSES = Counter("zoomage_stale_responses_total", "Expired cache entries served because an upstream failed", ("cache",))
+METRICS = [
+    REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, UPSTREAM_ERRORS, DOWNLOADED_BYTES, LLM_TOKENS, MONGO_SECONDS, MONGO_FAILURES,
+    UPSTREAM_RETRIES, UPSTREAM_REJECTIONS, UPSTREAM_QUEUE_WAIT, UPSTREAM_QUEUE_DEPTH, UPSTREAM_CIRCUIT_STATE, STALE_RESPONSES,
+]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+def is_llm_api_error(error: BaseException) -> bool:
+    # No SDK error can exist before the SDK is imported, so this never imports it
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIError)
+
+def error_kind(error: Exception) -> str:
+    """Status code for HTTP errors from httpx or the OpenAI SDK, otherwise the exception type"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return str(error.response.status_code)
+    if is_llm_api_error(error) and hasattr(error, "status_code"):
+        return str(error.status_code)
+    return type(error).__name__
+
+@contextmanager
+def timed(stage: str, upstream: bool = False):
+    """Record how long a block takes under `stage`; failures of upstream calls are counted too"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
     try:
-        client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+        yield
+    except Exception as e:
+        if upstream:
+            UPSTREAM_ERRORS.inc(stage=stage, error=error_kind(e))
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+def record_llm_usage(stage: str, usage):
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens or 0, stage=stage, kind="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, stage=stage, kind="completion")
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the driver sends, so Mongo latency is visible without wrapping each call"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_FAILURES.inc(command=event.command_name)
+
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+class RequestMetricsMiddleware:
+    """Times each request by route template and sets its trace id for log lines and the X-Trace-Id header
+
+    Written as plain ASGI rather than BaseHTTPMiddleware so streamed responses pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        trace_id = ""
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                trace_id = value.decode("latin-1")[:64]
+        trace_id = trace_id or uuid.uuid4().hex[:16]
+        token = trace_id_var.set(trace_id)
+        status = 500
+        
+        async def send_with_trace_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace_id.encode("latin-1"))]
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            if METRICS_ENABLED:
+                # Label by route template so ids in paths don't multiply the series
+                path = getattr(scope.get("route"), "path", None) or "unmatched"
+                REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=path)
+                REQUESTS.inc(method=scope["method"], route=path, status=status)
+            trace_id_var.reset(token)
+
+# MongoDB connection, opened by the startup hook so importing this module does no I/O;
+# tools that set db before startup (like the benchmarks) keep their own database
+client: Optional[AsyncIOMotorClient] = None
+db = None
+
+def connect_db():
+    global client, db
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[MongoCommandMetrics()] if METRICS_ENABLED else [])
+    db = client[os.environ['DB_NAME']]
+
+# Outbound HTTP configuration
+NASA_API_URL = os.environ.get('NASA_API_URL', 'https://images-api.nasa.gov').rstrip('/')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', '30'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE = int(os.environ.get('HTTP_MAX_KEEPALIVE', '20'))
+HTTP_PER_HOST_LIMIT = int(os.environ.get('HTTP_PER_HOST_LIMIT', '10'))
+# Per-host overrides, e.g. "images-api.nasa.gov=8,api.openai.com=16"
+HTTP_HOST_LIMITS = {
+    host.strip(): int(limit)
+    for host, _, limit in (
+        item.partition('=') for item in os.environ.get('HTTP_HOST_LIMITS', '').split(',') if item.strip()
+    )
+}
+
+# Upstream admission control: each upstream gets a token bucket (requests per second, 0 = unlimited),
+# jittered exponential retries on 429/5xx and connection errors, and a circuit breaker
+NASA_ASSETS_URL = os.environ.get('NASA_ASSETS_URL', 'https://images-assets.nasa.gov').rstrip('/')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+NASA_RATE_LIMIT = float(os.environ.get('NASA_RATE_LIMIT', '5'))
+NASA_RATE_BURST = int(os.environ.get('NASA_RATE_BURST', '20'))
+LLM_RATE_LIMIT = float(os.environ.get('LLM_RATE_LIMIT', '10'))
+LLM_RATE_BURST = int(os.environ.get('LLM_RATE_BURST', '20'))
+UPSTREAM_MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', '3'))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get('UPSTREAM_RETRY_BASE_DELAY', '0.25'))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get('UPSTREAM_RETRY_MAX_DELAY', '8'))
+# A request that would wait longer than this for a rate-limit token fails fast instead
+UPSTREAM_MAX_QUEUE_WAIT = float(os.environ.get('UPSTREAM_MAX_QUEUE_WAIT', '5'))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', '30'))
+# Expired search, manifest, discovery and analysis cache entries are kept this long and served when their upstream fails
+CACHE_STALE_TTL = float(os.environ.get('CACHE_STALE_TTL', str(24 * 3600)))
+
+# NASA search paging: client pages are served from fixed-size upstream pages, fetched in parallel
+NASA_PAGE_SIZE = int(os.environ.get('NASA_PAGE_SIZE', '20'))
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', '100'))
+SEARCH_PREFETCH = os.environ.get('SEARCH_PREFETCH', 'true').lower() == 'true'
+
+# Asset renditions from each result's collection.json manifest (sizes: thumb, small, medium, large, orig)
+ASSET_RESOLVE = os.environ.get('ASSET_RESOLVE', 'true').lower() == 'true'
+ASSET_MANIFEST_CONCURRENCY = int(os.environ.get('ASSET_MANIFEST_CONCURRENCY', '8'))
+MANIFEST_CACHE_SIZE = int(os.environ.get('MANIFEST_CACHE_SIZE', '10000'))
+MANIFEST_CACHE_TTL = float(os.environ.get('MANIFEST_CACHE_TTL', str(7 * 24 * 3600)))
+ANALYSIS_RENDITION = os.environ.get('ANALYSIS_RENDITION', 'large')  # what gets downloaded for analysis
+
+# Response cache configuration
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '3600'))
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '1024'))
+SEARCH_CACHE_PERSIST = os.environ.get('SEARCH_CACHE_PERSIST', 'false').lower() == 'true'
+ANALYSIS_CACHE_TTL = float(os.environ.get('ANALYSIS_CACHE_TTL', str(7 * 24 * 3600)))
+
+# Image download limits
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', str(50 * 1024 * 1024)))
+IMAGE_CHUNK_SIZE = int(os.environ.get('IMAGE_CHUNK_SIZE', str(64 * 1024)))
+
+# Background analysis jobs
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '4'))
+ANALYSIS_QUEUE_MAX = int(os.environ.get('ANALYSIS_QUEUE_MAX', '100'))
+ANALYSIS_JOB_LEASE = float(os.environ.get('ANALYSIS_JOB_LEASE', '300'))
+ANALYSIS_JOB_POLL_INTERVAL = float(os.environ.get('ANALYSIS_JOB_POLL_INTERVAL', '2'))
+ANALYSIS_JOB_TTL = float(os.environ.get('ANALYSIS_JOB_TTL', str(24 * 3600)))
+
+# Batch analysis fan-out
+BATCH_ANALYSIS_CONCURRENCY = int(os.environ.get('BATCH_ANALYSIS_CONCURRENCY', '4'))
+BATCH_ANALYSIS_MAX_ITEMS = int(os.environ.get('BATCH_ANALYSIS_MAX_ITEMS', '200'))
+
+# Bulk label import/export
+LABEL_IMPORT_BATCH_SIZE = int(os.environ.get('LABEL_IMPORT_BATCH_SIZE', '1000'))
+LABEL_IMPORT_MAX_ERRORS = int(os.environ.get('LABEL_IMPORT_MAX_ERRORS', '100'))
+LABEL_IMPORT_MAX_COCO_BYTES = int(os.environ.get('LABEL_IMPORT_MAX_COCO_BYTES', str(200 * 1024 * 1024)))
+LABEL_IMPORT_MAX_LINE_BYTES = int(os.environ.get('LABEL_IMPORT_MAX_LINE_BYTES', str(1024 * 1024)))
+LABEL_EXPORT_CHUNK_LINES = int(os.environ.get('LABEL_EXPORT_CHUNK_LINES', '500'))
+
+# Local search over stored images
+LOCAL_SEARCH_MAX_RESULTS = int(os.environ.get('LOCAL_SEARCH_MAX_RESULTS', '100'))
+# Facets count keywords over at most this many top-ranked matches, so broad queries stay fast
+LOCAL_SEARCH_FACET_SAMPLE = int(os.environ.get('LOCAL_SEARCH_FACET_SAMPLE', '1000'))
+LOCAL_SEARCH_FACET_LIMIT = int(os.environ.get('LOCAL_SEARCH_FACET_LIMIT', '20'))
+
+# Embeddings for similarity search. "hash" is a local feature-hashing model that needs
+# no network; "openai" calls the embeddings API with EMBEDDING_MODEL.
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'hash').lower()
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-3-small')
+EMBEDDING_DIM = int(os.environ.get('EMBEDDING_DIM', '256'))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '100'))
+VECTOR_INDEX_TTL = float(os.environ.get('VECTOR_INDEX_TTL', '300'))
+# Corpora at least this large also get an IVF index; 0 (the default) always scans exactly.
+# nprobe 64 keeps recall@10 near 0.95, but only beats the exact scan from ~100k vectors
+VECTOR_IVF_MIN_SIZE = int(os.environ.get('VECTOR_IVF_MIN_SIZE', '0'))
+VECTOR_IVF_NPROBE = int(os.environ.get('VECTOR_IVF_NPROBE', '64'))
+
+# Map-reduce pattern discovery (token counts are estimated at ~4 characters per token)
+DISCOVERY_CHUNK_TOKENS = int(os.environ.get('DISCOVERY_CHUNK_TOKENS', '3000'))
+DISCOVERY_CONCURRENCY = int(os.environ.get('DISCOVERY_CONCURRENCY', '4'))
+DISCOVERY_REDUCE_FANIN = int(os.environ.get('DISCOVERY_REDUCE_FANIN', '8'))
+DISCOVERY_CACHE_SIZE = int(os.environ.get('DISCOVERY_CACHE_SIZE', '4096'))
+DISCOVERY_SUMMARY_TTL = float(os.environ.get('DISCOVERY_SUMMARY_TTL', str(30 * 24 * 3600)))
+
+# In-memory spatial indexes over label boxes, one per recently queried image
+LABEL_INDEX_CACHE_SIZE = int(os.environ.get('LABEL_INDEX_CACHE_SIZE', '256'))
+LABEL_INDEX_TTL = float(os.environ.get('LABEL_INDEX_TTL', '300'))
+LABEL_REGION_MAX_RESULTS = int(os.environ.get('LABEL_REGION_MAX_RESULTS', '10000'))
+
+# Image preprocessing before vision model submission (IMAGE_MAX_EDGE=0 sends originals)
+IMAGE_MAX_EDGE = int(os.environ.get('IMAGE_MAX_EDGE', '1024'))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG').upper()  # JPEG or WEBP
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', str(os.cpu_count() or 1)))
+IMAGE_CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_DOWNLOAD_DIR = IMAGE_CACHE_DIR / 'downloads'
+
+# Downloaded images shared by the /raw proxy and analysis, evicted least-recently-used past the size bound
+IMAGE_STORE_DIR = IMAGE_CACHE_DIR / 'store'
+IMAGE_STORE_MAX_BYTES = int(os.environ.get('IMAGE_STORE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+IMAGE_BROWSER_MAX_AGE = int(os.environ.get('IMAGE_BROWSER_MAX_AGE', '86400'))
+
+class _ReleasingByteStream(httpx.AsyncByteStream):
+    """Response body wrapper that frees a per-host slot once the body is closed"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, semaphore: asyncio.Semaphore):
+        self._stream = stream
+        self._semaphore = semaphore
+        self._released = False
 
-        prompts = {
-            "general": "Analyze this NASA space image...",
-            "features": "Identify and describe specific features...",
-            "patterns": "Look for patterns, structures, or anomalies...",
-            "anomalies": "Examine this NASA image for unusual features..."
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._semaphore.release()
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """Pooled transport that caps in-flight requests per upstream host"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, default_limit: int, host_limits: Dict[str, int]):
+        self._transport = transport
+        self._default_limit = default_limit
+        self._host_limits = host_limits
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._host_limits.get(host, self._default_limit))
+            self._semaphores[host] = semaphore
+        return semaphore
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        semaphore = self._semaphore(request.url.host)
+        await semaphore.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            semaphore.release()
+            raise
+        response.stream = _ReleasingByteStream(response.stream, semaphore)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+class UpstreamUnavailable(Exception):
+    """An upstream call refused locally because its circuit is open or its rate-limit queue is too long"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(f"{upstream} is unavailable ({reason}), retry in {retry_after:.1f}s")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+def find_upstream_unavailable(error: Optional[BaseException]) -> Optional[UpstreamUnavailable]:
+    """The UpstreamUnavailable behind an error, if any; the OpenAI SDK wraps transport errors in its own"""
+    for _ in range(10):
+        if error is None or isinstance(error, UpstreamUnavailable):
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+class TokenBucket:
+    """Token-bucket rate limiter; callers reserve future tokens, so queued requests go out in order"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.waiting = 0
+
+    def reserve(self) -> float:
+        """Take a token and return how long to wait before it may be used"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        self.tokens += 1
+
+class CircuitBreaker:
+    """Opens after consecutive failures and fails calls fast until a single probe succeeds after the reset timeout"""
+
+    STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+
+    def _set_state(self, state: str):
+        self.state = state
+        UPSTREAM_CIRCUIT_STATE.set(self.STATES[state], upstream=self.name)
+
+    def before_call(self) -> Optional[float]:
+        """None if a call may go ahead, otherwise the seconds until one might"""
+        if self.state == "open":
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                return remaining
+            self._set_state("half_open")
+        if self.state == "half_open":
+            if self.probing:
+                return self.reset_timeout
+            self.probing = True
+        return None
+
+    def release_probe(self):
+        """Give up a probe that ended without an outcome, e.g. when it was cancelled"""
+        self.probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != "closed":
+            self._set_state("closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+            self.opens += 1
+            self.opened_at = time.monotonic()
+            self._set_state("open")
+
+    def reset(self):
+        """Close the circuit and forget past failures"""
+        self.failures = 0
+        self.probing = False
+        self._set_state("closed")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class UpstreamGuard:
+    """Admission control for one upstream: token-bucket rate limit, jittered retries and a circuit breaker"""
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.breaker = CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.max_retries = UPSTREAM_MAX_RETRIES
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self.queue_wait = 0.0
+
+    def _refuse(self, reason: str, retry_after: float):
+        self.rejected += 1
+        UPSTREAM_REJECTIONS.inc(upstream=self.name, reason=reason)
+        raise UpstreamUnavailable(self.name, reason, retry_after)
+
+    def reset(self):
+        """Close the breaker and refill the bucket, e.g. after a simulated outage"""
+        self.breaker.reset()
+        if self.bucket is not None:
+            self.bucket.tokens = float(self.bucket.burst)
+            self.bucket.updated = time.monotonic()
+
+    async def _admit(self):
+        retry_after = self.breaker.before_call()
+        if retry_after is not None:
+            self._refuse("circuit_open", retry_after)
+        if self.bucket is None:
+            return
+
+        wait = self.bucket.reserve()
+        if wait > UPSTREAM_MAX_QUEUE_WAIT:
+            self.bucket.refund()
+            self.breaker.release_probe()
+            self._refuse("rate_limited", wait)
+        if wait > 0:
+            self.bucket.waiting += 1
+            UPSTREAM_QUEUE_DEPTH.set(self.bucket.waiting, upstream=self.name)
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.bucket.refund()
+                self.breaker.release_probe()
+                raise
+            finally:
+                self.bucket.waiting -= 1
+                UPSTREAM_QUEUE_DEPTH.set(self.bucket.waiting, upstream=self.name)
+        self.queue_wait += wait
+        UPSTREAM_QUEUE_WAIT.observe(wait, upstream=self.name)
+
+    @staticmethod
+    def backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+        """Full-jitter exponential backoff, stretched to the upstream's Retry-After when it sends one"""
+        delay = random.uniform(0, min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), UPSTREAM_RETRY_MAX_DELAY))
+        return delay
+
+    async def send(self, request: httpx.Request, send) -> httpx.Response:
+        self.requests += 1
+        attempt = 0
+        while True:
+            await self._admit()
+            try:
+                response = await send(request)
+            except httpx.TransportError as e:
+                failure, response = e, None
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                failure = None
+
+            self.breaker.record_failure()
+            if attempt >= self.max_retries:
+                if response is not None:
+                    return response
+                raise failure
+            delay = self.backoff(attempt, response)
+            if response is not None:
+                await response.aclose()
+            attempt += 1
+            self.retries += 1
+            UPSTREAM_RETRIES.inc(upstream=self.name)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "circuit_opens": self.breaker.opens,
+            "rate_limit": self.bucket.rate if self.bucket else None,
+            "tokens": round(self.bucket.tokens, 2) if self.bucket else None,
+            "queued": self.bucket.waiting if self.bucket else 0,
+            "requests": self.requests,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "mean_queue_wait_ms": round(self.queue_wait / self.requests * 1000, 2) if self.requests else 0.0,
         }
-        prompt = prompts.get(analysis_type, prompts["general"])
-
-        # fetch and encode image
-        image_response = requests.get(image_url, timeout=30)
-        image_response.raise_for_status()
-        image_base64 = base64.b64encode(image_response.content).decode("utf-8")
-
-        # call OpenAI
-        completion = await client.chat.completions.create(
-            model="gpt-4o-mini",  # or gpt-4o
-            messages=[
-                {"role": "system", "content": "You are an expert space imagery analyst."},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
-                    ]
-                }
-            ]
+
+def upstream_origin(url) -> tuple:
+    url = httpx.URL(url)
+    return url.host, url.port or (443 if url.scheme == "https" else 80)
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """Sends requests for guarded upstreams through their UpstreamGuard; other hosts pass straight through
+
+    Sits outside HostLimitedTransport, so requests sleeping on a rate limit or a retry
+    backoff do not hold a per-host connection slot.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, guards: Dict[str, UpstreamGuard]):
+        self._transport = transport
+        self._guards = {upstream_origin(url): guard for url, guard in guards.items()}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        guard = self._guards.get(upstream_origin(request.url))
+        if guard is None:
+            return await self._transport.handle_async_request(request)
+        return await guard.send(request, self._transport.handle_async_request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+upstream_guards = {
+    "nasa": UpstreamGuard("nasa", NASA_RATE_LIMIT, NASA_RATE_BURST),
+    # The asset CDN takes no API key, so it is retried and circuit-broken but not rate limited
+    "nasa_assets": UpstreamGuard("nasa_assets", 0, 0),
+    "llm": UpstreamGuard("llm", LLM_RATE_LIMIT, LLM_RATE_BURST),
+}
+
+# Shared clients, created on startup (the LLM client on first use) and closed on shutdown
+http_client: Optional[httpx.AsyncClient] = None
+llm_client: Optional["AsyncOpenAI"] = None
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled keep-alive client used for every outbound call"""
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    )
+    transport = HostLimitedTransport(
+        httpx.AsyncHTTPTransport(limits=limits),
+        default_limit=HTTP_PER_HOST_LIMIT,
+        host_limits=HTTP_HOST_LIMITS,
+    )
+    transport = ResilientTransport(transport, guards={
+        NASA_API_URL: upstream_guards["nasa"],
+        NASA_ASSETS_URL: upstream_guards["nasa_assets"],
+        OPENAI_BASE_URL: upstream_guards["llm"],
+    })
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        follow_redirects=True,
+    )
+
+def get_llm_client() -> "AsyncOpenAI":
+    """Return the OpenAI client, routed through the shared HTTP pool"""
+    global llm_client
+    if llm_client is None:
+        from openai import AsyncOpenAI
+        
+        # Retries happen in the shared transport's UpstreamGuard, so the SDK's own are turned off
+        llm_client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], http_client=http_client, max_retries=0)
+    return llm_client
+
+class AsyncTTLCache:
+    """Size-bounded LRU cache with per-entry TTL, request coalescing and optional Mongo persistence
+
+    Expired entries are kept for another stale_ttl seconds and returned by get_or_load
+    when the loader fails, so an upstream outage degrades to slightly old data.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, persist: bool = False, stale_ttl: float = 0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._inflight: Dict[Any, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.persistent_hits = 0
+        self.stale_hits = 0
+
+    @property
+    def collection(self):
+        return db[f"{self.name}_cache"]
+
+    def get(self, key):
+        """Return (found, value) for a fresh entry, refreshing its LRU position"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            if expires_at + self.stale_ttl <= now:
+                del self._entries[key]
+                self.expirations += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def get_stale(self, key):
+        """Return (found, value) for an entry that is fresh or still within its stale window"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] + self.stale_ttl <= time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def _load_persisted(self, key):
+        """Return (found, value, seconds of freshness left); stale documents come back with remaining <= 0"""
+        try:
+            doc = await self.collection.find_one({"_id": json.dumps(key)})
+        except Exception as e:
+            logging.error(f"Error reading {self.name} cache: {e}")
+            return False, None, 0.0
+        if not doc:
+            return False, None, 0.0
+        # Mongo's TTL monitor purges at expires_at; documents written before stale windows have no fresh_until
+        fresh_until = doc.get("fresh_until", doc["expires_at"])
+        if fresh_until.tzinfo is None:
+            fresh_until = fresh_until.replace(tzinfo=timezone.utc)
+        return True, doc["value"], (fresh_until - datetime.now(timezone.utc)).total_seconds()
+
+    async def _store_persisted(self, key, value):
+        fresh_until = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        try:
+            await self.collection.replace_one(
+                {"_id": json.dumps(key)},
+                {"value": value, "fresh_until": fresh_until, "expires_at": fresh_until + timedelta(seconds=self.stale_ttl)},
+                upsert=True
+            )
+        except Exception as e:
+            logging.error(f"Error writing {self.name} cache: {e}")
+
+    async def create_indexes(self):
+        if self.persist:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader() at most once across concurrent callers"""
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+        
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+        
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            found, value, remaining = (await self._load_persisted(key)) if self.persist else (False, None, 0.0)
+            if found and remaining > 0:
+                self.persistent_hits += 1
+                self.set(key, value, ttl=remaining)
+            else:
+                persisted = (found, value)
+                try:
+                    value = await loader()
+                except Exception as e:
+                    found, value = self.get_stale(key)
+                    if not found and self.stale_ttl > 0:
+                        found, value = persisted
+                    if not found:
+                        raise
+                    self.stale_hits += 1
+                    STALE_RESPONSES.inc(cache=self.name)
+                    logging.warning(f"Serving stale {self.name} cache entry: {e}")
+                else:
+                    self.set(key, value)
+                    if self.persist:
+                        await self._store_persisted(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            # Failures are handed to coalesced waiters but never cached
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "persist": self.persist,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "persistent_hits": self.persistent_hits,
+            "stale_hits": self.stale_hits,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+class AnalysisCache:
+    """Content-addressed store of AI analyses keyed by (image hash, analysis type, model)
+
+    Documents are fresh until fresh_until and purged stale_ttl later; in between they are
+    only served by lookup_stale, when a new analysis cannot be made.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.url_hits = 0
+        self.content_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fresh_filter() -> Dict:
+        # Documents written before stale windows have no fresh_until and are purged while still fresh
+        return {"$or": [
+            {"fresh_until": {"$gt": datetime.now(timezone.utc)}},
+            {"fresh_until": {"$exists": False}}
+        ]}
+
+    @property
+    def collection(self):
+        return db.analysis_cache
+
+    @staticmethod
+    def cache_key(image_hash: str, analysis_type: str, model: str) -> str:
+        return hashlib.sha256(f"{image_hash}:{analysis_type}:{model}".encode()).hexdigest()
+
+    async def create_indexes(self):
+        await self.collection.create_index([("image_urls", 1), ("analysis_type", 1), ("model", 1)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def lookup_url(self, image_url: str, analysis_type: str, model: str) -> Optional[str]:
+        """Find a fresh analysis for an image URL seen before, without downloading it"""
+        doc = await self.collection.find_one({
+            "image_urls": image_url,
+            "analysis_type": analysis_type,
+            "model": model,
+            **self.fresh_filter()
+        }, {"analysis": 1})
+        if doc:
+            self.url_hits += 1
+            return doc["analysis"]
+        return None
+
+    async def lookup_stale(self, image_url: str, analysis_type: str, model: str) -> Optional[str]:
+        """Find the newest analysis for an image URL, however old, for when the model or image is unreachable"""
+        doc = await self.collection.find_one(
+            {"image_urls": image_url, "analysis_type": analysis_type, "model": model},
+            {"analysis": 1},
+            sort=[("created_at", -1)]
         )
-        return completion.choices[0].message.content
-    except Exception as e:
-        logging.error(f"AI analysis failed: {e}")
-        return f"AI analysis unavailable: {str(e)}"
+        if doc:
+            self.stale_hits += 1
+            STALE_RESPONSES.inc(cache="analysis")
+            return doc["analysis"]
+        return None
 
+    async def lookup_content(self, image_hash: str, image_url: str, analysis_type: str, model: str) -> Optional[str]:
+        """Find a fresh analysis for identical image bytes, remembering the new URL alias"""
+        doc = await self.collection.find_one_and_update(
+            {"_id": self.cache_key(image_hash, analysis_type, model), **self.fresh_filter()},
+            {"$addToSet": {"image_urls": image_url}},
+            projection={"analysis": 1}
+        )
+        if doc:
+            self.content_hits += 1
+            return doc["analysis"]
+        self.misses += 1
+        return None
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+    async def store(self, image_hash: str, image_url: str, analysis_type: str, model: str, analysis: str):
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"_id": self.cache_key(image_hash, analysis_type, model)},
+            {
+                "$set": {
+                    "image_hash": image_hash,
+                    "analysis_type": analysis_type,
+                    "model": model,
+                    "analysis": analysis,
+                    "created_at": now,
+                    "fresh_until": now + timedelta(seconds=self.ttl),
+                    "expires_at": now + timedelta(seconds=self.ttl + self.stale_ttl)
+                },
+                "$addToSet": {"image_urls": image_url}
+            },
+            upsert=True
+        )
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.url_hits + self.content_hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "url_hits": self.url_hits,
+            "content_hits": self.content_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.url_hits + self.content_hits) / lookups, 4) if lookups else 0.0,
+        }
 
-# Create the main app without a prefix
-app = FastAPI()
-from fastapi.middleware.cors import CORSMiddleware
+search_cache = AsyncTTLCache("search", maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, persist=SEARCH_CACHE_PERSIST, stale_ttl=CACHE_STALE_TTL)
+analysis_cache = AnalysisCache(ttl=ANALYSIS_CACHE_TTL, stale_ttl=CACHE_STALE_TTL)
+# NASA assets never change once published, so manifests are cached for a long time
+manifest_cache = AsyncTTLCache("manifest", maxsize=MANIFEST_CACHE_SIZE, ttl=MANIFEST_CACHE_TTL, persist=SEARCH_CACHE_PERSIST, stale_ttl=CACHE_STALE_TTL)
+# Chunk and reduce summaries are keyed by their input text, so unchanged chunks are never re-summarized
+discovery_cache = AsyncTTLCache("discovery", maxsize=DISCOVERY_CACHE_SIZE, ttl=DISCOVERY_SUMMARY_TTL, persist=True, stale_ttl=CACHE_STALE_TTL)
+# Other replicas' label writes are not seen here, so the TTL bounds how stale an index gets
+label_index_cache = AsyncTTLCache("label_index", maxsize=LABEL_INDEX_CACHE_SIZE, ttl=LABEL_INDEX_TTL)
+
+# Create the main app without a prefix; orjson renders whatever routes return
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -76,25 +979,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/api/search")
-def search_images(query: str, media_type: str):
-    # your search code here
-    return [{"url": "https://example.com/image.jpg", "title": "Example", "nasa_id": "EX123"}]
+@app.exception_handler(RequestValidationError)
+async def request_validation_error(request: Request, exc: RequestValidationError):
+    # orjson writes a rejected inf or nan input as null, where the default handler fails with a 500
+    return ORJSONResponse(status_code=422, content={"detail": jsonable_encoder(exc.errors())})
 
-@app.post("/api/analyze")
-def analyze_image(image_url: str, analysis_type: str):
-    # your AI analysis code here
-    return {"analysis": "This is a demo analysis."}
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Models
 class ImageLabel(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    x: float
-    y: float
-    width: float = 0.0
-    height: float = 0.0
+    # Finite only: an inf or nan coordinate can't be placed on the region grid
+    x: float = Field(allow_inf_nan=False)
+    y: float = Field(allow_inf_nan=False)
+    width: float = Field(0.0, allow_inf_nan=False)
+    height: float = Field(0.0, allow_inf_nan=False)
     label: str
     description: Optional[str] = None
     category: Optional[str] = None
@@ -110,118 +1010,2156 @@ class NASAImage(BaseModel):
     thumbnail_url: Optional[str] = None
     date_created: Optional[str] = None
     media_type: str = "image"
-    labels: List[ImageLabel] = []
+    renditions: Dict[str, str] = {}  # size class (thumb/small/medium/large/orig) -> URL
+    manifest_url: Optional[str] = None  # the asset's collection.json
+    labels: List[ImageLabel] = []  # filled from image_labels on the detail route only
+    label_count: int = 0
     ai_analysis: Optional[str] = None
     keywords: List[str] = []
 
 class SearchRequest(BaseModel):
     query: str
     media_type: str = "image"
+    page: int = Field(1, ge=1)
+    page_size: int = Field(20, ge=1, le=SEARCH_MAX_PAGE_SIZE)
 
 class AIAnalysisRequest(BaseModel):
     image_url: str
     analysis_type: str = "general"  # general, features, patterns, anomalies
+    force_refresh: bool = False  # bypass the analysis cache
+
+class BatchAnalysisRequest(BaseModel):
+    image_ids: List[str] = []
+    image_urls: List[str] = []
+    analysis_types: List[str] = ["general"]
+    force_refresh: bool = False
+    concurrency: Optional[int] = None  # capped at BATCH_ANALYSIS_CONCURRENCY
+
+class AnalysisJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "queued"  # queued, running, completed, failed
+    image_url: str
+    analysis_type: str = "general"
+    force_refresh: bool = False
+    result: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class RegionLabel(ImageLabel):
+    image_id: str
 
 class LabelRequest(BaseModel):
     image_id: str
     label: ImageLabel
 
 # NASA API Functions
-async def search_nasa_images(query: str, media_type: str = "image") -> List[Dict]:
-    """Search NASA's Image and Video Library"""
-    try:
-        nasa_api_key = os.environ.get('NASA_API_KEY', 'DEMO_KEY')
-        url = "https://images-api.nasa.gov/search"
-        params = {
-            "q": query,
-            "media_type": media_type,
-            "page_size": 20
+async def fetch_nasa_search(query: str, media_type: str = "image", page: int = 1) -> Dict[str, Any]:
+    """Fetch one upstream page of results from NASA's Image and Video Library"""
+    url = f"{NASA_API_URL}/search"
+    params = {
+        "q": query,
+        "media_type": media_type,
+        "page": page,
+        "page_size": NASA_PAGE_SIZE
+    }
+    
+    with timed("nasa_search", upstream=True):
+        response = await http_client.get(url, params=params)
+        response.raise_for_status()
+    DOWNLOADED_BYTES.inc(len(response.content), source="nasa_search")
+    
+    data = response.json()
+    images = []
+    
+    for item in data.get("collection", {}).get("items", []):
+        try:
+            nasa_data = item.get("data", [{}])[0]
+            links = item.get("links", [])
+    
+            # Get the largest image URL
+            image_url = None
+            thumbnail_url = None
+            for link in links:
+                if link.get("render") == "image":
+                    if "thumb" in link.get("href", ""):
+                        thumbnail_url = link["href"]
+                    else:
+                        image_url = link["href"]
+    
+            if not image_url and thumbnail_url:
+                image_url = thumbnail_url
+    
+            if image_url:
+                images.append({
+                    "manifest_url": item.get("href"),
+                    "renditions": parse_renditions([image_url, thumbnail_url]),
+                    "nasa_id": nasa_data.get("nasa_id", ""),
+                    "title": nasa_data.get("title", ""),
+                    "description": nasa_data.get("description", ""),
+                    "url": image_url,
+                    "thumbnail_url": thumbnail_url,
+                    "date_created": nasa_data.get("date_created", ""),
+                    "media_type": nasa_data.get("media_type", "image"),
+                    "keywords": nasa_data.get("keywords", [])
+                })
+        except Exception as e:
+            logging.error(f"Error processing NASA item: {e}")
+            continue
+    
+    total_hits = data.get("collection", {}).get("metadata", {}).get("total_hits", len(images))
+    return {"items": images, "total_hits": total_hits}
+
+RENDITION_SIZES = ["thumb", "small", "medium", "large", "orig"]
+RENDITION_PATTERN = re.compile(r"~(thumb|small|medium|large|orig)\.(\w+)$", re.IGNORECASE)
+# Browsers and the vision model can use these directly; TIFF originals are a last resort
+WEB_IMAGE_FORMATS = {"jpg", "jpeg", "png", "gif", "webp"}
+
+def parse_renditions(urls: List[str]) -> Dict[str, str]:
+    """Map size class -> URL from asset URLs named like ...~medium.jpg"""
+    renditions: Dict[str, str] = {}
+    for url in urls:
+        if not isinstance(url, str):
+            continue
+        match = RENDITION_PATTERN.search(url.split("?")[0])
+        if not match:
+            continue
+        size, extension = match.group(1).lower(), match.group(2).lower()
+        if url.startswith("http://images-assets.nasa.gov/"):
+            url = "https://" + url[len("http://"):]
+        existing = renditions.get(size)
+        if existing is None or (extension in WEB_IMAGE_FORMATS and RENDITION_PATTERN.search(existing.split("?")[0]).group(2).lower() not in WEB_IMAGE_FORMATS):
+            renditions[size] = url
+    return renditions
+
+def pick_rendition(renditions: Dict[str, str], size: str) -> Optional[str]:
+    """The requested size if present, else the next larger one, else the largest smaller one"""
+    if not renditions or size not in RENDITION_SIZES:
+        return None
+    index = RENDITION_SIZES.index(size)
+    for candidate in RENDITION_SIZES[index:] + RENDITION_SIZES[:index][::-1]:
+        if candidate in renditions:
+            return renditions[candidate]
+    return None
+
+async def fetch_manifest(manifest_url: str) -> List[str]:
+    with timed("nasa_manifest", upstream=True):
+        response = await http_client.get(manifest_url)
+        response.raise_for_status()
+    DOWNLOADED_BYTES.inc(len(response.content), source="nasa_manifest")
+    return response.json()
+
+# Manifest fetches share one bounded pool, whether a search scheduled them or a reader is waiting
+manifest_semaphore: Optional[asyncio.Semaphore] = None
+rendition_tasks: set = set()
+
+def rendition_pending(image: Dict) -> bool:
+    return bool(image.get("manifest_url")) and not image.get("renditions_resolved_at")
+
+async def resolve_image_renditions(images: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """Fetch the manifests of stored images, store their full rendition sets and return them by image id
+
+    Images whose manifest cannot be fetched keep their preview renditions and are retried next time.
+    """
+    global manifest_semaphore
+    if manifest_semaphore is None:
+        manifest_semaphore = asyncio.Semaphore(ASSET_MANIFEST_CONCURRENCY)
+    
+    async def resolve(image: Dict) -> Optional[Dict[str, str]]:
+        manifest_url = image["manifest_url"]
+        try:
+            async with manifest_semaphore:
+                urls = await manifest_cache.get_or_load(manifest_url, lambda: fetch_manifest(manifest_url))
+        except Exception as e:
+            logging.error(f"Error fetching asset manifest {manifest_url}: {e}")
+            return None
+        return {**(image.get("renditions") or {}), **parse_renditions(urls)}
+    
+    resolved = dict(zip(
+        [image["id"] for image in images],
+        await asyncio.gather(*(resolve(image) for image in images))
+    ))
+    resolved = {image_id: renditions for image_id, renditions in resolved.items() if renditions is not None}
+    if resolved:
+        now = datetime.now(timezone.utc)
+        await db.nasa_images.bulk_write([
+            UpdateOne({"id": image_id}, {"$set": {"renditions": renditions, "renditions_resolved_at": now}})
+            for image_id, renditions in resolved.items()
+        ], ordered=False)
+    return resolved
+
+def schedule_rendition_resolution(images: List[Dict]):
+    """Resolve renditions after the response has gone out, so searches never wait on manifests"""
+    pending = [image for image in images if rendition_pending(image)]
+    if not ASSET_RESOLVE or not pending:
+        return
+    task = asyncio.create_task(resolve_image_renditions(pending))
+    rendition_tasks.add(task)
+    task.add_done_callback(rendition_tasks.discard)
+
+async def ensure_renditions(image: Dict) -> Dict:
+    """Resolve a stored image's renditions now if the background pass has not got to it yet"""
+    if ASSET_RESOLVE and rendition_pending(image):
+        resolved = await resolve_image_renditions([image])
+        if image["id"] in resolved:
+            image["renditions"] = resolved[image["id"]]
+    return image
+
+async def fetch_nasa_page(query: str, media_type: str, page: int) -> Dict[str, Any]:
+    key = (query.strip().lower(), media_type, page, NASA_PAGE_SIZE)
+    return await search_cache.get_or_load(key, lambda: fetch_nasa_search(query, media_type, page))
+
+async def search_nasa_results(query: str, media_type: str = "image", page: int = 1, page_size: int = NASA_PAGE_SIZE) -> tuple:
+    """Return (results, total_hits) for one client page, fetching the upstream pages it spans in parallel"""
+    start = (page - 1) * page_size
+    first = start // NASA_PAGE_SIZE + 1
+    last = (start + page_size - 1) // NASA_PAGE_SIZE + 1
+    pages = await asyncio.gather(
+        *(fetch_nasa_page(query, media_type, upstream) for upstream in range(first, last + 1)),
+        return_exceptions=True
+    )
+    
+    items, total_hits = [], 0
+    for upstream, result in zip(range(first, last + 1), pages):
+        # Stop at the first failed or short page so results stay contiguous
+        if isinstance(result, Exception):
+            # With nothing to show, fail rather than return what looks like zero hits
+            if upstream == first:
+                raise result
+            logging.error(f"Error searching NASA images (page {upstream}): {result}")
+            break
+        items.extend(result["items"])
+        total_hits = max(total_hits, result["total_hits"])
+        if len(result["items"]) < NASA_PAGE_SIZE:
+            break
+    
+    offset = start - (first - 1) * NASA_PAGE_SIZE
+    return items[offset:offset + page_size], total_hits
+
+# Speculative fetches of the page after the one a user is viewing; references are held
+# here so the tasks are not garbage collected mid-flight
+prefetch_tasks: set = set()
+
+def prefetch_next_page(request: SearchRequest, total_hits: int):
+    if request.page * request.page_size >= total_hits:
+        return
+    task = asyncio.create_task(search_nasa_results(request.query, request.media_type, request.page + 1, request.page_size))
+    prefetch_tasks.add(task)
+    task.add_done_callback(prefetch_done)
+
+def prefetch_done(task: asyncio.Task):
+    prefetch_tasks.discard(task)
+    # A failed prefetch only costs the next page its head start
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning(f"Search prefetch failed: {task.exception()}")
+
+ANALYSIS_PROMPTS = {
+    "general": "Analyze this NASA space image. Describe what you see, identify celestial bodies, spacecraft, or Earth features. Provide scientific context.",
+    "features": "Identify and describe specific features in this NASA image. Look for geological formations, atmospheric phenomena, spacecraft components, or astronomical objects.",
+    "patterns": "Look for patterns, structures, or anomalies in this NASA image. Identify recurring features, formations, or unusual elements that might be of scientific interest.",
+    "anomalies": "Examine this NASA image for any unusual features, anomalies, or unexpected elements. What stands out as potentially interesting or requiring further investigation?"
+}
+
+class ImagePayload:
+    """A downloaded image spooled to disk, with its content hash"""
+
+    def __init__(self, path: Path, content_type: str, size: int, sha256: str):
+        self.path = path
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+
+    def discard(self):
+        self.path.unlink(missing_ok=True)
+
+class Base64DataURL:
+    """Builds a base64 data URL chunk by chunk, carrying bytes that don't fill a 3-byte group"""
+
+    def __init__(self, content_type: str):
+        self._pending = b""
+        self._buffer = bytearray(f"data:{content_type};base64,".encode("ascii"))
+
+    def feed(self, chunk: bytes):
+        if self._pending:
+            chunk = self._pending + chunk
+        cut = len(chunk) - len(chunk) % 3
+        self._buffer += binascii.b2a_base64(chunk[:cut], newline=False)
+        self._pending = chunk[cut:]
+
+    def finish(self) -> str:
+        """Return the data URL as text and drop the internal buffer"""
+        if self._pending:
+            self._buffer += binascii.b2a_base64(self._pending, newline=False)
+            self._pending = b""
+        data_url = self._buffer.decode("ascii")
+        self._buffer = bytearray()
+        return data_url
+
+async def encode_file_as_data_url(path: Path, content_type: str) -> str:
+    encoder = Base64DataURL(content_type)
+    with timed("image_encode"):
+        async with aiofiles.open(path, "rb") as f:
+            while chunk := await f.read(IMAGE_CHUNK_SIZE):
+                encoder.feed(chunk)
+        return encoder.finish()
+
+async def download_image(image_url: str, max_bytes: int = IMAGE_MAX_BYTES) -> ImagePayload:
+    """Stream an image to disk through the shared HTTP client, hashing it as it arrives"""
+    IMAGE_DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    path = IMAGE_DOWNLOAD_DIR / f"{uuid.uuid4()}.part"
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with timed("image_download", upstream=True):
+            async with http_client.stream("GET", image_url) as image_response:
+                image_response.raise_for_status()
+                
+                declared_size = int(image_response.headers.get("content-length") or 0)
+                if declared_size > max_bytes:
+                    raise ValueError(f"Image is {declared_size} bytes, limit is {max_bytes}")
+                
+                content_type = image_response.headers.get("content-type", "").split(";")[0].strip()
+                async with aiofiles.open(path, "wb") as f:
+                    async for chunk in image_response.aiter_bytes(IMAGE_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise ValueError(f"Image exceeds the {max_bytes} byte limit")
+                        hasher.update(chunk)
+                        await f.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    finally:
+        DOWNLOADED_BYTES.inc(size, source="image")
+    
+    return ImagePayload(
+        path,
+        content_type if content_type.startswith("image/") else "image/jpeg",
+        size,
+        hasher.hexdigest()
+    )
+
+class ImageStore:
+    """Size-bounded on-disk LRU of downloaded images, addressed by content hash
+
+    blobs/<sha256> holds the bytes and urls/<sha256 of url>.json maps a source URL to its
+    blob, so URLs serving identical bytes share one file. Files derived from a blob, such
+    as downscaled copies, sit beside it under their own names and share the size bound.
+    Recency is kept in blob mtimes and reloaded on first use, so the LRU order survives restarts.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = root / "blobs"
+        self.url_dir = root / "urls"
+        self._blobs: Optional[OrderedDict] = None
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _index(self) -> OrderedDict:
+        if self._blobs is None:
+            self.blob_dir.mkdir(parents=True, exist_ok=True)
+            self.url_dir.mkdir(parents=True, exist_ok=True)
+            entries = sorted(
+                (stat.st_mtime, path.name, stat.st_size)
+                for path in self.blob_dir.iterdir()
+                if path.is_file() and (stat := path.stat())
+            )
+            self._blobs = OrderedDict((name, size) for _, name, size in entries)
+            self._bytes = sum(self._blobs.values())
+        return self._blobs
+
+    def _url_entry(self, url: str) -> Path:
+        return self.url_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _touch(self, sha256: str) -> bool:
+        blobs = self._index()
+        if sha256 not in blobs:
+            return False
+        try:
+            os.utime(self.blob_dir / sha256)
+        except FileNotFoundError:
+            self._bytes -= blobs.pop(sha256)
+            return False
+        blobs.move_to_end(sha256)
+        return True
+
+    def lookup(self, url: str) -> Optional[ImagePayload]:
+        """The stored image for a URL, marked as recently used, or None"""
+        entry = self._url_entry(url)
+        try:
+            meta = json.loads(entry.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if not self._touch(meta["sha256"]):
+            entry.unlink(missing_ok=True)
+            return None
+        return ImagePayload(self.blob_dir / meta["sha256"], meta["content_type"], meta["size"], meta["sha256"])
+
+    async def fetch(self, url: str) -> ImagePayload:
+        """Return the stored image for a URL, downloading it once however many callers ask at the same time
+
+        The payload belongs to the store: callers must not discard it.
+        """
+        stored = self.lookup(url)
+        if stored is not None:
+            self.hits += 1
+            return stored
+
+        inflight = self._inflight.get(url)
+        if inflight is not None:
+            self.hits += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            stored = self._add(url, await download_image(url))
+            future.set_result(stored)
+            return stored
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved so a failure nobody else waited on isn't logged
+            future.exception()
+            raise
+        finally:
+            del self._inflight[url]
+
+    def _add(self, url: str, image: ImagePayload) -> ImagePayload:
+        blobs = self._index()
+        if self._touch(image.sha256):
+            image.discard()
+        else:
+            os.replace(image.path, self.blob_dir / image.sha256)
+            blobs[image.sha256] = image.size
+            self._bytes += image.size
+
+        self._url_entry(url).write_text(json.dumps({
+            "sha256": image.sha256,
+            "content_type": image.content_type,
+            "size": image.size
+        }))
+        self._evict(keep=image.sha256)
+        return ImagePayload(self.blob_dir / image.sha256, image.content_type, image.size, image.sha256)
+
+    def lookup_derived(self, name: str) -> Optional[Path]:
+        """The path of a stored derived file, marked as recently used, or None"""
+        return self.blob_dir / name if self._touch(name) else None
+
+    def add_derived(self, name: str, path: Path) -> Path:
+        """Move a finished derived file into the store, counted and evicted like downloaded blobs"""
+        blobs = self._index()
+        if self._touch(name):
+            # Another caller made the same file first
+            path.unlink(missing_ok=True)
+        else:
+            size = path.stat().st_size
+            os.replace(path, self.blob_dir / name)
+            blobs[name] = size
+            self._bytes += size
+        self._evict(keep=name)
+        return self.blob_dir / name
+
+    def _evict(self, keep: str):
+        # URL entries pointing at evicted blobs are cleaned up lazily by lookup()
+        blobs = self._index()
+        while self._bytes > self.max_bytes and len(blobs) > 1:
+            sha256, size = next(iter(blobs.items()))
+            if sha256 == keep:
+                break
+            del blobs[sha256]
+            (self.blob_dir / sha256).unlink(missing_ok=True)
+            self._bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        blobs = self._index()
+        lookups = self.hits + self.misses
+        return {
+            "blobs": len(blobs),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+image_store = ImageStore(IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES)
+
+def resize_image(source_path: str, target_path: str, max_edge: int, image_format: str, quality: int):
+    """Decode, downscale and re-encode an image file; runs in the preprocessing process pool"""
+    with Image.open(source_path) as img:
+        # Let JPEG decode at a reduced scale instead of materializing every original pixel
+        img.draft("RGB", (max_edge, max_edge))
+        img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        partial_path = f"{target_path}.{os.getpid()}.tmp"
+        img.save(partial_path, format=image_format, quality=quality)
+    os.replace(partial_path, target_path)
+
+image_pool: Optional[ProcessPoolExecutor] = None
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global image_pool
+    if image_pool is None:
+        image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return image_pool
+
+async def prepare_image(image: ImagePayload) -> str:
+    """Return the data URL to send to the vision model, downscaled unless IMAGE_MAX_EDGE is 0"""
+    if IMAGE_MAX_EDGE <= 0:
+        return await encode_file_as_data_url(image.path, image.content_type)
+    
+    extension = IMAGE_FORMAT.lower()
+    # Kept in the image store, so copies made under an old size or quality age out like any other file
+    name = f"{image.sha256}-{IMAGE_MAX_EDGE}-q{IMAGE_QUALITY}.{extension}"
+    artifact = image_store.lookup_derived(name)
+    if artifact is None:
+        IMAGE_DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        resized = IMAGE_DOWNLOAD_DIR / f"{uuid.uuid4()}.{extension}"
+        try:
+            with timed("image_resize"):
+                await asyncio.get_running_loop().run_in_executor(
+                    get_image_pool(), resize_image,
+                    str(image.path), str(resized), IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY
+                )
+        except Exception as e:
+            resized.unlink(missing_ok=True)
+            logging.warning(f"Could not downscale image {image.sha256}, sending original: {e}")
+            return await encode_file_as_data_url(image.path, image.content_type)
+        artifact = image_store.add_derived(name, resized)
+    return await encode_file_as_data_url(artifact, f"image/{extension}")
+
+def analysis_messages(image_data_url: str, analysis_type: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": "You are an expert space imagery analyst. Analyze NASA space images with scientific precision."},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": ANALYSIS_PROMPTS[analysis_type]},
+                {"type": "image_url", "image_url": {"url": image_data_url}}
+            ]
+        }
+    ]
+
+async def complete_chat(messages: List[Dict], stage: str) -> str:
+    """Run a chat completion, recording its latency and token usage under `stage`"""
+    with timed(stage, upstream=True):
+        completion = await get_llm_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages
+        )
+    record_llm_usage(stage, completion.usage)
+    return completion.choices[0].message.content
+
+async def run_ai_analysis(image_data_url: str, analysis_type: str) -> str:
+    """Send an image to the vision model and return its analysis"""
+    return await complete_chat(analysis_messages(image_data_url, analysis_type), "llm_analysis")
+
+async def stream_completion(messages: List[Dict], stage: str = "llm_stream"):
+    """Yield text deltas from a streaming chat completion"""
+    with timed(stage, upstream=True):
+        stream = await get_llm_client().chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            stream=True,
+            # Usage arrives in a final chunk with no choices
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage is not None:
+                record_llm_usage(stage, chunk.usage)
+
+async def analysis_download_url(image_url: str) -> str:
+    """The ANALYSIS_RENDITION of a stored image, so analysis never downloads a bigger original than it needs"""
+    if not ANALYSIS_RENDITION:
+        return image_url
+    image = await db.nasa_images.find_one({"url": image_url}, {"id": 1, "renditions": 1, "manifest_url": 1, "renditions_resolved_at": 1})
+    if not image:
+        return image_url
+    await ensure_renditions(image)
+    return pick_rendition(image.get("renditions"), ANALYSIS_RENDITION) or image_url
+
+async def resolve_analysis_input(image_url: str, analysis_type: str, force_refresh: bool):
+    """Return (cached analysis, image hash, data URL); the image is only fetched and prepared on a cache miss"""
+    # Known URL: answer straight from the cache without touching the network
+    if not force_refresh:
+        cached = await analysis_cache.lookup_url(image_url, analysis_type, OPENAI_MODEL)
+        if cached is not None:
+            return cached, None, None
+    
+    # Shared with the /raw proxy, so an image a browser has viewed is not downloaded again
+    image = await image_store.fetch(await analysis_download_url(image_url))
+    
+    # Same bytes under a different URL
+    if not force_refresh:
+        cached = await analysis_cache.lookup_content(image.sha256, image_url, analysis_type, OPENAI_MODEL)
+        if cached is not None:
+            return cached, image.sha256, None
+    
+    return None, image.sha256, await prepare_image(image)
+
+async def stale_analysis(image_url: str, analysis_type: str, error: Exception) -> str:
+    """The last analysis of an image, served when a new one can't be made; re-raises `error` if there is none"""
+    stale = await analysis_cache.lookup_stale(image_url, analysis_type, OPENAI_MODEL)
+    if stale is None:
+        raise error
+    logging.warning(f"Serving stale analysis for {image_url}: {error}")
+    return stale
+
+async def analyze_image_url(image_url: str, analysis_type: str = "general", force_refresh: bool = False) -> str:
+    """Analyze an image by URL, reusing cached results for the same image bytes
+
+    If the image or the model is unreachable, the last analysis of the image is returned
+    instead; raises when there is none.
+    """
+    if analysis_type not in ANALYSIS_PROMPTS:
+        analysis_type = "general"
+    
+    try:
+        cached, image_hash, image_data_url = await resolve_analysis_input(image_url, analysis_type, force_refresh)
+        if cached is not None:
+            return cached
+        analysis = await run_ai_analysis(image_data_url, analysis_type)
+    except Exception as e:
+        return await stale_analysis(image_url, analysis_type, e)
+    
+    await analysis_cache.store(image_hash, image_url, analysis_type, OPENAI_MODEL, analysis)
+    return analysis
+
+async def stream_image_analysis(image_url: str, analysis_type: str = "general", force_refresh: bool = False):
+    """Yield analysis text as the model generates it, caching and saving the assembled text at the end"""
+    if analysis_type not in ANALYSIS_PROMPTS:
+        analysis_type = "general"
+    
+    try:
+        cached, image_hash, image_data_url = await resolve_analysis_input(image_url, analysis_type, force_refresh)
+    except Exception as e:
+        cached = await stale_analysis(image_url, analysis_type, e)
+    if cached is not None:
+        yield cached
+        await save_image_analysis(image_url, cached)
+        return
+    
+    parts = []
+    try:
+        async for delta in stream_completion(analysis_messages(image_data_url, analysis_type), "llm_analysis_stream"):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        # Text already sent can't be taken back, so only a failure before the first token falls back
+        if parts:
+            raise
+        yield await stale_analysis(image_url, analysis_type, e)
+        return
+    
+    analysis = "".join(parts)
+    await analysis_cache.store(image_hash, image_url, analysis_type, OPENAI_MODEL, analysis)
+    await save_image_analysis(image_url, analysis)
+
+# Pattern Discovery
+DISCOVERY_SYSTEM_PROMPT = "You are a pattern discovery expert for space imagery. Analyze labeled features across multiple images to find patterns, correlations, and interesting discoveries."
+DISCOVERY_MAP_PROMPT = "Summarize the recurring features, correlations and anomalies in this batch of labeled NASA images. Be concise; your summary will be merged with summaries of other batches.\n\n{data}"
+DISCOVERY_REDUCE_PROMPT = "Merge these partial pattern summaries, each covering a different batch of labeled NASA images, into one concise summary that keeps every distinct pattern:\n\n{data}"
+DISCOVERY_FINAL_PROMPT = "Analyze these labeled NASA images and discover patterns:\n\n{data}\n\nLabel statistics across all images:\n{stats}\n\nIdentify recurring features, interesting correlations, and potential scientific discoveries."
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to fit max_tokens by estimate_tokens"""
+    max_chars = max(max_tokens - 1, 1) * 4
+    return text if len(text) <= max_chars else text[:max_chars]
+
+async def labeled_image_lines():
+    """Yield (image_id, compact text line) for every labeled image, ordered by image_id"""
+    async def flush(batch: List[tuple]):
+        titles = {
+            img["id"]: img.get("title", "")
+            async for img in db.nasa_images.find({"id": {"$in": [image_id for image_id, _ in batch]}}, {"id": 1, "title": 1})
         }
+        return [
+            (image_id, f"{titles.get(image_id, '')}: {'; '.join(labels)}")
+            for image_id, labels in batch
+        ]
+    
+    batch: List[tuple] = []
+    current_id, current_labels = None, []
+    labels = db.image_labels.find({}, {"_id": 0, "image_id": 1, "label": 1, "description": 1}).sort([("image_id", 1), ("created_at", 1)])
+    async for label in labels:
+        if label["image_id"] != current_id:
+            if current_id is not None:
+                batch.append((current_id, current_labels))
+            current_id, current_labels = label["image_id"], []
+        current_labels.append(f"{label['label']} ({label['description']})" if label.get("description") else label["label"])
+        if len(batch) >= 500:
+            for line in await flush(batch):
+                yield line
+            batch = []
+    if current_id is not None:
+        batch.append((current_id, current_labels))
+    if batch:
+        for line in await flush(batch):
+            yield line
+
+def is_chunk_boundary(image_id: str) -> bool:
+    # Content-defined boundaries: a chunk may end after roughly one image in eight, chosen by
+    # id, so editing one image's labels does not shift every later chunk and void its summary
+    return hashlib.sha256(image_id.encode()).digest()[0] % 8 == 0
+
+async def discovery_chunks() -> List[str]:
+    """Group labeled image lines into chunks of at most DISCOVERY_CHUNK_TOKENS"""
+    chunks, lines, tokens = [], [], 0
+    async for image_id, image_line in labeled_image_lines():
+        # An image with more labels than one chunk holds is split across chunks
+        while image_line:
+            line = truncate_tokens(image_line, DISCOVERY_CHUNK_TOKENS)
+            image_line = image_line[len(line):]
+            line_tokens = estimate_tokens(line)
+            if lines and tokens + line_tokens > DISCOVERY_CHUNK_TOKENS:
+                chunks.append("\n".join(lines))
+                lines, tokens = [], 0
+            lines.append(line)
+            tokens += line_tokens
+        if tokens >= DISCOVERY_CHUNK_TOKENS // 2 and is_chunk_boundary(image_id):
+            chunks.append("\n".join(lines))
+            lines, tokens = [], 0
+    if lines:
+        chunks.append("\n".join(lines))
+    return chunks
+
+async def summarize_cached(prompt: str, data: str, semaphore: asyncio.Semaphore) -> str:
+    key = hashlib.sha256(f"{OPENAI_MODEL}\n{prompt}\n{data}".encode()).hexdigest()
+    
+    async def summarize():
+        async with semaphore:
+            return await complete_chat([
+                {"role": "system", "content": DISCOVERY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt.format(data=data)}
+            ], "llm_discovery_summary")
+    
+    return await discovery_cache.get_or_load(key, summarize)
+
+async def build_discovery_messages() -> Optional[List[Dict]]:
+    """Build the pattern discovery prompt from all labeled images, or None if nothing is labeled
+
+    Labeled images are split into token-budgeted chunks that are summarized concurrently,
+    then the summaries are merged DISCOVERY_REDUCE_FANIN at a time until they fit in one
+    prompt. Every summary is cached by its input, so a re-run only calls the model for
+    chunks whose images' labels changed (and the merges above them).
+    """
+    with timed("discovery_chunks"):
+        chunks = await discovery_chunks()
+    if not chunks:
+        return None
+    
+    semaphore = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+    parts = chunks
+    if len(chunks) > 1:
+        parts = list(await asyncio.gather(*(summarize_cached(DISCOVERY_MAP_PROMPT, chunk, semaphore) for chunk in chunks)))
+        while len(parts) > 1 and (len(parts) > DISCOVERY_REDUCE_FANIN or estimate_tokens("\n\n".join(parts)) > DISCOVERY_CHUNK_TOKENS):
+            groups = [parts[i:i + DISCOVERY_REDUCE_FANIN] for i in range(0, len(parts), DISCOVERY_REDUCE_FANIN)]
+            # Summaries are model output of no fixed length, so each gets an equal share of the budget
+            parts = list(await asyncio.gather(*(
+                summarize_cached(
+                    DISCOVERY_REDUCE_PROMPT,
+                    "\n\n---\n\n".join(truncate_tokens(part, DISCOVERY_CHUNK_TOKENS // len(group)) for part in group),
+                    semaphore
+                )
+                for group in groups
+            )))
+    
+    return [
+        {"role": "system", "content": DISCOVERY_SYSTEM_PROMPT},
+        {"role": "user", "content": DISCOVERY_FINAL_PROMPT.format(
+            data=truncate_tokens("\n\n".join(parts), DISCOVERY_CHUNK_TOKENS),
+            stats=format_label_statistics(await get_label_statistics(10))
+        )}
+    ]
+
+# Response Helpers
+def json_default(value):
+    """json.dumps fallback for the BSON types stored in our documents"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dump_json(value) -> bytes:
+    return orjson.dumps(value, default=json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+def json_response(content, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serialize data we wrote ourselves straight to JSON, skipping response_model validation"""
+    return Response(content=dump_json(content), media_type="application/json", headers=headers)
+
+def image_document(doc: Dict) -> Dict:
+    """A stored image in NASAImage's shape without validating it again
+
+    Stored images were written from NASAImage, so only fields added since then can be
+    missing; they get the model's defaults. Unknown fields like _id are dropped.
+    """
+    return {
+        name: doc[name] if name in doc else field.get_default(call_default_factory=True)
+        for name, field in NASAImage.model_fields.items()
+    }
+
+# Response compression, negotiated from Accept-Encoding; brotli is preferred when installed
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+# Low levels: on image lists br 1 and gzip 1 compress ~4x at a fifth of the CPU of gzip's default 6
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '1'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '1'))
+# Bodies at least this large are compressed on a thread so the event loop keeps serving
+COMPRESSION_THREAD_BYTES = int(os.environ.get('COMPRESSION_THREAD_BYTES', str(256 * 1024)))
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """The best of br and gzip the client accepts, honouring q-values; None for identity"""
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    """Compresses complete JSON and text responses with br or gzip, whichever the client prefers
+
+    Only responses with a Content-Length are buffered and compressed; streamed ones (SSE,
+    NDJSON batches, label exports) and images pass straight through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
         
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+        encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                encoding = negotiate_encoding(value.decode("latin-1"))
+        start = None
+        chunks: List[bytes] = []
         
-        data = response.json()
-        images = []
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                compressible = headers.get(b"content-type", b"").decode("latin-1").startswith(COMPRESSIBLE_TYPES)
+                if compressible:
+                    vary = headers.get(b"vary", b"")
+                    if b"accept-encoding" not in vary.lower():
+                        message = {**message, "headers": [
+                            (name, value) for name, value in message["headers"] if name.lower() != b"vary"
+                        ] + [(b"vary", vary + b", Accept-Encoding" if vary else b"Accept-Encoding")]}
+                if (
+                    encoding is None
+                    or not compressible
+                    or b"content-encoding" in headers
+                    or int(headers.get(b"content-length", b"0")) < COMPRESSION_MIN_BYTES
+                ):
+                    await send(message)
+                    return
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            if len(body) >= COMPRESSION_THREAD_BYTES:
+                compressed = await asyncio.to_thread(compress_body, body, encoding)
+            else:
+                compressed = compress_body(body, encoding)
+            headers = [(name, value) for name, value in start["headers"] if name.lower() != b"content-length"]
+            if len(compressed) < len(body):
+                body = compressed
+                headers.append((b"content-encoding", encoding.encode()))
+            headers.append((b"content-length", str(len(body)).encode()))
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
         
-        for item in data.get("collection", {}).get("items", []):
-            try:
-                nasa_data = item.get("data", [{}])[0]
-                links = item.get("links", [])
-                
-                # Get the largest image URL
-                image_url = None
-                thumbnail_url = None
-                for link in links:
-                    if link.get("render") == "image":
-                        if "thumb" in link.get("href", ""):
-                            thumbnail_url = link["href"]
-                        else:
-                            image_url = link["href"]
-                
-                if not image_url and thumbnail_url:
-                    image_url = thumbnail_url
-                
-                if image_url:
-                    images.append({
-                        "nasa_id": nasa_data.get("nasa_id", ""),
-                        "title": nasa_data.get("title", ""),
-                        "description": nasa_data.get("description", ""),
-                        "url": image_url,
-                        "thumbnail_url": thumbnail_url,
-                        "date_created": nasa_data.get("date_created", ""),
-                        "media_type": nasa_data.get("media_type", "image"),
-                        "keywords": nasa_data.get("keywords", [])
-                    })
-            except Exception as e:
-                logging.error(f"Error processing NASA item: {e}")
-                continue
-                
-        return images
+        await self.app(scope, receive, send_compressed)
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def stream_text_events(deltas, result_key: str):
+    """Wrap a text delta generator as SSE token events followed by a done (or error) event"""
+    parts = []
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            yield sse_event("token", {"text": delta})
+        yield sse_event("done", {result_key: "".join(parts)})
     except Exception as e:
-        logging.error(f"Error searching NASA images: {e}")
+        logging.error(f"Error while streaming {result_key}: {e}")
+        yield sse_event("error", {"detail": str(e)})
+
+def upstream_http_error(error: Exception) -> HTTPException:
+    """503 with Retry-After for an upstream refused locally, 502 for an upstream failure, 500 otherwise"""
+    unavailable = find_upstream_unavailable(error)
+    if unavailable is not None:
+        return HTTPException(
+            status_code=503,
+            detail=str(unavailable),
+            headers={"Retry-After": str(math.ceil(unavailable.retry_after))}
+        )
+    if isinstance(error, httpx.HTTPError) or is_llm_api_error(error):
+        return HTTPException(status_code=502, detail=f"Upstream error: {error}")
+    return HTTPException(status_code=500, detail=str(error))
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison, so W/ prefixes are ignored"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple]:
+    """Return the inclusive (start, end) of a single bytes range, or None to send the whole body
+
+    Malformed and multi-range headers are ignored as RFC 9110 allows; unsatisfiable ranges raise 416.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the final N bytes (N=0 selects nothing)
+            length = int(last)
+            start, end = (max(size - length, 0) if length > 0 else size), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+async def read_file_range(path: Path, start: int, end: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(IMAGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# Persistence Functions
+async def dedupe_nasa_images() -> int:
+    """Merge images stored more than once under one nasa_id into the oldest copy; returns copies removed
+
+    Searches used to insert without checking for an existing copy, so older databases can hold
+    duplicates that would stop the unique nasa_id index from building.
+    """
+    duplicates = db.nasa_images.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$nasa_id", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+    
+    removed = 0
+    async for group in duplicates:
+        keep, *dropped = group["ids"]
+        # Labels follow the kept copy, whether already in image_labels or still embedded
+        await db.image_labels.update_many({"image_id": {"$in": dropped}}, {"$set": {"image_id": keep}})
+        embedded = [
+            label
+            async for image in db.nasa_images.find({"id": {"$in": dropped}, "labels.0": {"$exists": True}}, {"labels": 1})
+            for label in image["labels"]
+        ]
+        label_count = await db.image_labels.count_documents({"image_id": keep})
+        update: Dict[str, Any] = {"$set": {"label_count": label_count}}
+        if embedded:
+            update["$push"] = {"labels": {"$each": embedded}}
+        await db.nasa_images.update_one({"id": keep}, update)
+        await db.image_embeddings.delete_many({"image_id": {"$in": dropped}})
+        removed += (await db.nasa_images.delete_many({"id": {"$in": dropped}})).deleted_count
+    
+    if removed:
+        # Counters were kept per stored copy; rebuild them over the merged images
+        await db.migrations.delete_one({"_id": "label_stats_v2"})
+        logging.warning(f"Removed {removed} duplicate images stored under an existing nasa_id")
+    return removed
+
+async def create_image_indexes():
+    await dedupe_nasa_images()
+    await db.nasa_images.create_index("nasa_id", unique=True)
+
+async def save_search_results(results: List[Dict]) -> List[Dict]:
+    """Upsert NASA search results in one batch and return the stored images, as NASAImage dicts, in result order"""
+    nasa_ids = list(dict.fromkeys(result["nasa_id"] for result in results))
+    if not nasa_ids:
         return []
+    
+    # One lookup for everything we already know about
+    stored = {
+        doc["nasa_id"]: doc
+        async for doc in db.nasa_images.find({"nasa_id": {"$in": nasa_ids}})
+    }
+    
+    # One unordered bulk upsert for the rest; $setOnInsert keeps a concurrent winner intact
+    new_images = {}
+    for result in results:
+        if result["nasa_id"] not in stored and result["nasa_id"] not in new_images:
+            new_images[result["nasa_id"]] = NASAImage(**result).dict()
+    
+    if new_images:
+        operations = [
+            UpdateOne({"nasa_id": nasa_id}, {"$setOnInsert": image}, upsert=True)
+            for nasa_id, image in new_images.items()
+        ]
+        upserted = set()
+        try:
+            write_result = await db.nasa_images.bulk_write(operations, ordered=False)
+            upserted = set(write_result.upserted_ids)
+        except BulkWriteError as e:
+            # Duplicate key errors mean another search inserted the same image first
+            upserted = {item["index"] for item in e.details.get("upserted", [])}
+            logging.info(f"Concurrent insert detected for {len(e.details.get('writeErrors', []))} images")
+        
+        # Anything we did not insert ourselves was written by someone else; use their copy
+        lost = [nasa_id for index, nasa_id in enumerate(new_images) if index not in upserted]
+        if lost:
+            async for doc in db.nasa_images.find({"nasa_id": {"$in": lost}}):
+                stored[doc["nasa_id"]] = doc
+                new_images.pop(doc["nasa_id"], None)
+    
+    # Images stored before renditions existed pick up the manifest link from fresh results
+    backfill = {
+        result["nasa_id"]: result
+        for result in results
+        if result.get("manifest_url") and result["nasa_id"] in stored and "manifest_url" not in stored[result["nasa_id"]]
+    }
+    if backfill:
+        await db.nasa_images.bulk_write([
+            UpdateOne({"nasa_id": nasa_id}, {"$set": {"manifest_url": result["manifest_url"], "renditions": result["renditions"]}})
+            for nasa_id, result in backfill.items()
+        ], ordered=False)
+        for nasa_id, result in backfill.items():
+            stored[nasa_id].update(manifest_url=result["manifest_url"], renditions=result["renditions"])
+    
+    schedule_rendition_resolution(list(new_images.values()) + list(stored.values()))
+    
+    images = []
+    for result in results:
+        nasa_id = result["nasa_id"]
+        if nasa_id in new_images:
+            images.append(new_images[nasa_id])
+        elif nasa_id in stored:
+            images.append(image_document(stored[nasa_id]))
+    return images
 
-async def get_ai_analysis(image_url: str, analysis_type: str = "general") -> str:
-    """Get AI analysis of NASA image"""
-    try:
-        # Initialize LLM chat
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=str(uuid.uuid4()),
-            system_message="You are an expert space imagery analyst. Analyze NASA space images with scientific precision."
-        ).with_model("openai", "gpt-4o")
-        
-        # Define prompts based on analysis type
-        prompts = {
-            "general": "Analyze this NASA space image. Describe what you see, identify celestial bodies, spacecraft, or Earth features. Provide scientific context.",
-            "features": "Identify and describe specific features in this NASA image. Look for geological formations, atmospheric phenomena, spacecraft components, or astronomical objects.",
-            "patterns": "Look for patterns, structures, or anomalies in this NASA image. Identify recurring features, formations, or unusual elements that might be of scientific interest.",
-            "anomalies": "Examine this NASA image for any unusual features, anomalies, or unexpected elements. What stands out as potentially interesting or requiring further investigation?"
-        }
+async def save_image_analysis(image_url: str, analysis: str):
+    await db.nasa_images.update_one(
+        {"url": image_url},
+        {"$set": {"ai_analysis": analysis}}
+    )
+    # The analysis is part of the embedded text, so re-embed; similarity is best-effort
+    try:
+        await embed_images(await db.nasa_images.find({"url": image_url}, EMBEDDING_SOURCE_FIELDS).to_list(10))
+    except Exception as e:
+        logging.error(f"Error embedding analysed image {image_url}: {e}")
+
+# Local Search
+async def create_search_indexes():
+    await db.nasa_images.create_index(
+        [("title", "text"), ("keywords", "text"), ("description", "text"), ("ai_analysis", "text")],
+        weights={"title": 10, "keywords": 5, "description": 2, "ai_analysis": 1},
+        name="nasa_images_text"
+    )
+    await db.nasa_images.create_index("keywords")
+    await db.nasa_images.create_index("label_count")
+    # Analyzed images are the minority, so analyzed=true walks only them, newest first;
+    # a plain ai_analysis index would hold every analysis text as a key
+    await db.nasa_images.create_index(
+        [("_id", -1)],
+        partialFilterExpression={"ai_analysis": {"$type": "string"}},
+        name="nasa_images_analyzed"
+    )
+
+def local_search_query(
+    q: Optional[str],
+    keywords: List[str],
+    labeled: Optional[bool],
+    analyzed: Optional[bool]
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if q:
+        query["$text"] = {"$search": q}
+    if keywords:
+        query["keywords"] = {"$all": keywords}
+    if labeled is not None:
+        query["label_count"] = {"$gt": 0} if labeled else {"$in": [0, None]}
+    if analyzed is not None:
+        query["ai_analysis"] = {"$type": "string"} if analyzed else None
+    return query
+
+async def search_local_images(
+    q: Optional[str],
+    keywords: List[str],
+    labeled: Optional[bool],
+    analyzed: Optional[bool],
+    limit: int
+) -> Dict[str, Any]:
+    """Ranked matches plus keyword facets from one aggregation over the text index"""
+    pipeline: List[Dict] = [{"$match": local_search_query(q, keywords, labeled, analyzed)}]
+    if q:
+        pipeline.append({"$sort": {"score": {"$meta": "textScore"}, "_id": 1}})
+    else:
+        pipeline.append({"$sort": {"_id": -1}})
+    pipeline += [
+        {"$limit": max(limit, LOCAL_SEARCH_FACET_SAMPLE)},
+        {"$facet": {
+            "results": [
+                {"$limit": limit},
+                {"$project": {"_id": 0, "labels": 0, **({"score": {"$meta": "textScore"}} if q else {})}},
+            ],
+            "keywords": [
+                {"$unwind": "$keywords"},
+                {"$group": {"_id": "$keywords", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$limit": LOCAL_SEARCH_FACET_LIMIT},
+            ],
+            "sampled": [{"$count": "count"}],
+        }},
+    ]
+    
+    page = (await db.nasa_images.aggregate(pipeline).to_list(1))[0]
+    return {
+        "results": page["results"],
+        "facets": {"keywords": [{"keyword": row["_id"], "count": row["count"]} for row in page["keywords"]]},
+        "facet_sample": page["sampled"][0]["count"] if page["sampled"] else 0,
+    }
+
+# Embeddings & Similarity
+EMBEDDING_KEY = f"{EMBEDDING_PROVIDER}:{EMBEDDING_MODEL if EMBEDDING_PROVIDER == 'openai' else 'features'}:{EMBEDDING_DIM}"
+EMBEDDING_SOURCE_FIELDS = {"id": 1, "title": 1, "keywords": 1, "description": 1, "ai_analysis": 1}
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+async def create_embedding_indexes():
+    await db.image_embeddings.create_index("image_id", unique=True)
+    await db.image_embeddings.create_index("model")
+
+def embedding_text(image: Dict) -> str:
+    return "\n".join(filter(None, [
+        image.get("title"),
+        " ".join(image.get("keywords") or []),
+        image.get("description"),
+        image.get("ai_analysis"),
+    ]))
+
+def embedding_source_hash(text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_KEY}\n{text}".encode()).hexdigest()
+
+def hash_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Signed feature hashing of words and word pairs into a unit float32 vector"""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+        digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        vector[digest % dim] += 1.0 if digest >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts into an (n, EMBEDDING_DIM) float32 matrix of unit vectors"""
+    if EMBEDDING_PROVIDER == "openai":
+        with timed("llm_embedding", upstream=True):
+            response = await get_llm_client().embeddings.create(model=EMBEDDING_MODEL, input=texts, dimensions=EMBEDDING_DIM)
+        record_llm_usage("llm_embedding", response.usage)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return np.stack([hash_embedding(text) for text in texts]) if texts else np.zeros((0, EMBEDDING_DIM), np.float32)
+
+class VectorIndex:
+    """Float32 matrix of unit vectors with exact top-k and an optional IVF approximate search"""
+
+    def __init__(self, image_ids: List[str], vectors: np.ndarray):
+        self.image_ids = list(image_ids)
+        self.positions = {image_id: row for row, image_id in enumerate(self.image_ids)}
+        # Copied because frombuffer arrays are read-only and upserts write rows in place;
+        # vectors is a view of the first len(self) rows of buffer
+        self.buffer = np.array(vectors, dtype=np.float32).reshape(len(self.image_ids), EMBEDDING_DIM)
+        self.vectors = self.buffer
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        if VECTOR_IVF_MIN_SIZE and len(self.image_ids) >= VECTOR_IVF_MIN_SIZE:
+            self.build_ivf()
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def build_ivf(self, iterations: int = 8, sample_size: int = 50000, seed: int = 0):
+        """Cluster vectors with spherical k-means into ~sqrt(n) inverted lists"""
+        rng = np.random.default_rng(seed)
+        nlist = max(1, int(len(self) ** 0.5))
+        sample = self.vectors[rng.choice(len(self), min(sample_size, len(self)), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
         
-        prompt = prompts.get(analysis_type, prompts["general"])
+        self.centroids = centroids.astype(np.float32)
+        assignment = np.concatenate([
+            np.argmax(self.vectors[start:start + 10000] @ self.centroids.T, axis=1)
+            for start in range(0, len(self), 10000)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+
+    def upsert_many(self, image_ids: List[str], vectors: List[np.ndarray]):
+        """Insert or replace a batch of vectors with one write into the matrix"""
+        updates = dict(zip(image_ids, vectors))
+        size = len(self.image_ids)
+        rows = []
+        for image_id in updates:
+            row = self.positions.get(image_id)
+            if row is None:
+                row = len(self.image_ids)
+                self.image_ids.append(image_id)
+                self.positions[image_id] = row
+            rows.append(row)
+        rows = np.array(rows, dtype=np.int64)
+        batch = np.array(list(updates.values()), dtype=np.float32).reshape(len(rows), EMBEDDING_DIM)
         
-        # Download image and convert to base64
-        image_response = requests.get(image_url, timeout=30)
-        image_response.raise_for_status()
-        image_base64 = base64.b64encode(image_response.content).decode('utf-8')
+        if len(self.image_ids) > len(self.buffer):
+            # Capacity doubles, so appending image by image costs amortized O(batch), not a matrix copy each
+            grown = np.empty((max(len(self.image_ids), 2 * len(self.buffer)), EMBEDDING_DIM), dtype=np.float32)
+            grown[:size] = self.vectors
+            self.buffer = grown
+        self.vectors = self.buffer[:len(self.image_ids)]
+        self.vectors[rows] = batch
         
-        # Create image content from base64
-        image_content = ImageContent(image_base64=image_base64)
+        if self.centroids is not None:
+            replaced = rows[rows < size]
+            if len(replaced):
+                self.lists = [members[~np.isin(members, replaced)] for members in self.lists]
+            clusters = np.argmax(batch @ self.centroids.T, axis=1)
+            for cluster in np.unique(clusters):
+                self.lists[cluster] = np.concatenate([self.lists[cluster], rows[clusters == cluster]])
+
+    def search(self, query: np.ndarray, k: int, exclude: Optional[str] = None, exact: bool = False) -> List[tuple]:
+        """Return up to k (image_id, cosine score) pairs, best first"""
+        if self.centroids is None or exact:
+            candidates = None
+            scores = self.vectors @ query
+        else:
+            probes = np.argpartition(-(self.centroids @ query), min(VECTOR_IVF_NPROBE, len(self.lists)) - 1)[:VECTOR_IVF_NPROBE]
+            candidates = np.concatenate([self.lists[probe] for probe in probes])
+            scores = self.vectors[candidates] @ query
         
-        # Send message with image
-        user_message = UserMessage(
-            text=prompt,
-            file_contents=[image_content]
+        excluded = self.positions.get(exclude) if exclude else None
+        wanted = min(k + (excluded is not None), len(scores))
+        if wanted <= 0:
+            return []
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(self.image_ids[row], float(scores[index])) for row, index in zip(rows, top) if row != excluded][:k]
+
+# Other replicas' embeddings are picked up when the index expires after VECTOR_INDEX_TTL
+vector_index_cache = AsyncTTLCache("vector_index", maxsize=1, ttl=VECTOR_INDEX_TTL)
+
+async def load_vector_index() -> VectorIndex:
+    image_ids, blobs = [], []
+    async for doc in db.image_embeddings.find({"model": EMBEDDING_KEY}, {"_id": 0, "image_id": 1, "vector": 1}):
+        image_ids.append(doc["image_id"])
+        blobs.append(bytes(doc["vector"]))
+    # Stored as raw float32 bytes, so loading is one frombuffer over the joined blobs
+    vectors = np.frombuffer(b"".join(blobs), dtype=np.float32)
+    return await asyncio.to_thread(VectorIndex, image_ids, vectors)
+
+async def get_vector_index() -> VectorIndex:
+    return await vector_index_cache.get_or_load(EMBEDDING_KEY, load_vector_index)
+
+async def embed_images(images: List[Dict]) -> Dict[str, np.ndarray]:
+    """Embed images whose text changed since their stored embedding; returns every image's vector"""
+    texts = {image["id"]: embedding_text(image) for image in images}
+    hashes = {image_id: embedding_source_hash(text) for image_id, text in texts.items()}
+    vectors: Dict[str, np.ndarray] = {}
+    async for doc in db.image_embeddings.find({"image_id": {"$in": list(texts)}, "model": EMBEDDING_KEY}):
+        if doc["source_hash"] == hashes[doc["image_id"]]:
+            vectors[doc["image_id"]] = np.frombuffer(bytes(doc["vector"]), dtype=np.float32)
+    
+    stale = [image_id for image_id in texts if image_id not in vectors]
+    for start in range(0, len(stale), EMBEDDING_BATCH_SIZE):
+        batch = stale[start:start + EMBEDDING_BATCH_SIZE]
+        embedded = await embed_texts([texts[image_id] for image_id in batch])
+        now = datetime.now(timezone.utc)
+        await db.image_embeddings.bulk_write([
+            UpdateOne(
+                {"image_id": image_id},
+                {"$set": {
+                    "model": EMBEDDING_KEY,
+                    "vector": vector.astype(np.float32).tobytes(),
+                    "source_hash": hashes[image_id],
+                    "updated_at": now
+                }},
+                upsert=True
+            )
+            for image_id, vector in zip(batch, embedded)
+        ], ordered=False)
+        vectors.update(zip(batch, embedded))
+        found, index = vector_index_cache.get(EMBEDDING_KEY)
+        if found:
+            index.upsert_many(batch, embedded)
+    return vectors
+
+async def refresh_embeddings() -> Dict[str, int]:
+    """Embed every stored image that is missing an up-to-date embedding"""
+    scanned = 0
+    embedded_before = await db.image_embeddings.count_documents({"model": EMBEDDING_KEY})
+    batch = []
+    async for image in db.nasa_images.find({}, EMBEDDING_SOURCE_FIELDS):
+        batch.append(image)
+        scanned += 1
+        if len(batch) >= EMBEDDING_BATCH_SIZE:
+            await embed_images(batch)
+            batch = []
+    if batch:
+        await embed_images(batch)
+    embedded_after = await db.image_embeddings.count_documents({"model": EMBEDDING_KEY})
+    return {"scanned": scanned, "new": embedded_after - embedded_before, "total": embedded_after}
+
+async def find_similar_images(image_id: str, k: int, exact: bool) -> Optional[List[Dict]]:
+    image = await db.nasa_images.find_one({"id": image_id}, EMBEDDING_SOURCE_FIELDS)
+    if not image:
+        return None
+    query = (await embed_images([image]))[image_id]
+    matches = (await get_vector_index()).search(query, k, exclude=image_id, exact=exact)
+    
+    images = {
+        doc["id"]: doc
+        async for doc in db.nasa_images.find({"id": {"$in": [match_id for match_id, _ in matches]}}, {"_id": 0, "labels": 0})
+    }
+    return [{"score": round(score, 6), "image": images[match_id]} for match_id, score in matches if match_id in images]
+
+# Labels
+# Labels live in image_labels (one document per label, keyed by image_id) rather than
+# in an embedded array, so label writes stay O(1) and cross-image queries use indexes.
+async def create_label_indexes():
+    await db.image_labels.create_index("id", unique=True)
+    await db.image_labels.create_index([("image_id", 1), ("created_at", 1)])
+    await db.image_labels.create_index([("category", 1), ("label", 1)])
+    await db.image_labels.create_index("label")
+    await db.image_labels.create_index([("category", 1), ("x", 1), ("y", 1)])
+    await db.image_labels.create_index([("x", 1), ("y", 1)])  # bbox-only region queries
+
+async def find_image_labels(image_id: str) -> List[ImageLabel]:
+    labels = db.image_labels.find({"image_id": image_id}, {"_id": 0, "image_id": 0}).sort("created_at", 1)
+    return [ImageLabel(**label) async for label in labels]
+
+async def migrate_embedded_labels():
+    """One-time move of labels embedded in nasa_images into image_labels; safe to re-run"""
+    if await db.migrations.find_one({"_id": "image_labels"}):
+        return
+    
+    migrated_images = 0
+    async for image in db.nasa_images.find({"labels.0": {"$exists": True}}, {"id": 1, "labels": 1}):
+        await db.image_labels.bulk_write([
+            UpdateOne({"id": label["id"]}, {"$setOnInsert": {**label, "image_id": image["id"]}}, upsert=True)
+            for label in image["labels"]
+        ], ordered=False)
+        label_count = await db.image_labels.count_documents({"image_id": image["id"]})
+        await db.nasa_images.update_one(
+            {"id": image["id"]},
+            {"$set": {"labels": [], "label_count": label_count}}
+        )
+        migrated_images += 1
+    
+    await db.migrations.update_one(
+        {"_id": "image_labels"},
+        {"$set": {"completed_at": datetime.now(timezone.utc), "images": migrated_images}},
+        upsert=True
+    )
+    logging.info(f"Moved embedded labels of {migrated_images} images into image_labels")
+
+# Label Statistics
+# Materialized counters in label_stats, one document per counter, kept current by
+# update_label_stats on every label write so the stats endpoint never scans labels.
+# image_label_values counts each image's labels per name and per category, which tells
+# us when a name or category first appears on (or disappears from) an image. Category
+# counts share one document per image so a write sees the exact set it changed.
+LABEL_DENSITY_BUCKETS = [(1, 1), (2, 5), (6, 20), (21, 100), (101, 1000), (1001, None)]
+
+def stats_key(kind: str, *parts) -> str:
+    return json.dumps([kind, *parts])
+
+def density_bucket(label_count: int) -> Optional[str]:
+    for low, high in LABEL_DENSITY_BUCKETS:
+        if label_count >= low and (high is None or label_count <= high):
+            return f"{low}+" if high is None else (str(low) if low == high else f"{low}-{high}")
+    return None
+
+async def create_label_stats_indexes():
+    await db.label_stats.create_index([("kind", 1), ("count", -1)])
+    await db.image_label_values.create_index([("image_id", 1), ("field", 1), ("value", 1)], unique=True)
+
+async def presence_changes(image_id: str, field: str, deltas: Dict[Any, int]) -> List[Any]:
+    """Apply per-value count deltas for one image and return values that appeared or disappeared"""
+    async def apply(value, amount: int):
+        doc = await db.image_label_values.find_one_and_update(
+            {"image_id": image_id, "field": field, "value": value},
+            {"$inc": {"count": amount}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        if doc["count"] <= 0:
+            await db.image_label_values.delete_one({"_id": doc["_id"], "count": {"$lte": 0}})
+        return value if (doc["count"] - amount > 0) != (doc["count"] > 0) else None
+    
+    changed = await asyncio.gather(*(apply(value, amount) for value, amount in deltas.items()))
+    return [value for value in changed if value is not None]
+
+async def category_presence(image_id: str, deltas: Dict[str, int]) -> tuple:
+    """Apply category count deltas for one image in a single update
+
+    Returns the categories that appeared or disappeared and the categories present after
+    the write. Both come from the same atomic update, so two concurrent writers can't
+    each see the other's new category and count the pair twice.
+    """
+    keys = {category: hashlib.sha1(category.encode()).hexdigest() for category in deltas}
+    doc = await db.image_label_values.find_one_and_update(
+        {"image_id": image_id, "field": "categories", "value": None},
+        {
+            "$inc": {f"counts.{keys[category]}": amount for category, amount in deltas.items()},
+            "$set": {f"names.{keys[category]}": category for category in deltas}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    counts = doc["counts"]
+    present = {doc["names"][key] for key, count in counts.items() if count > 0}
+    changed = [
+        category for category, amount in deltas.items()
+        if (counts[keys[category]] - amount > 0) != (counts[keys[category]] > 0)
+    ]
+    
+    gone = [keys[category] for category in deltas if counts[keys[category]] <= 0]
+    if gone:
+        for key in gone:
+            await db.image_label_values.update_one(
+                {"_id": doc["_id"], f"counts.{key}": {"$lte": 0}},
+                {"$unset": {f"counts.{key}": "", f"names.{key}": ""}}
+            )
+        await db.image_label_values.delete_one({"_id": doc["_id"], "counts": {}})
+    return changed, present
+
+async def collect_label_stats(image: Dict, labels: List[Dict], delta: int, counters: Dict[str, tuple]):
+    """Add the counter changes for delta (+1 added, -1 removed) labels on one image to counters
+
+    image holds the image's id, keywords and label_count after the write.
+    """
+    def bump(kind: str, fields: Dict, amount: int = delta):
+        key = stats_key(kind, *fields.values())
+        previous = counters.get(key, (fields, 0))[1]
+        counters[key] = (fields, previous + amount)
+    
+    names: Dict[str, int] = {}
+    categories: Dict[str, int] = {}
+    for label in labels:
+        bump("label", {"category": label.get("category"), "label": label["label"]})
+        bump("category", {"category": label.get("category")})
+        names[label["label"]] = names.get(label["label"], 0) + delta
+        if label.get("category"):
+            categories[label["category"]] = categories.get(label["category"], 0) + delta
+    bump("labels", {}, delta * len(labels))
+    
+    for name in await presence_changes(image["id"], "label", names):
+        bump("label_images", {"label": name})
+        for keyword in image.get("keywords") or []:
+            bump("keyword_label", {"keyword": keyword, "label": name})
+    
+    # Co-occurrence is tracked between categories: label names are free text, so
+    # name pairs would grow with the square of the distinct names on an image
+    changed, present = await category_presence(image["id"], categories) if categories else ([], set())
+    if changed:
+        changed_set = set(changed)
+        for category in changed:
+            bump("category_images", {"category": category})
+            # Pairs of two changed categories are counted once, from the smaller one
+            for other in (present | changed_set) if delta < 0 else present:
+                if other != category and (other not in changed_set or category < other):
+                    a, b = sorted((category, other))
+                    bump("category_pair", {"a": a, "b": b})
+    
+    new_count = image.get("label_count", 0)
+    old_count = new_count - delta * len(labels)
+    if (old_count > 0) != (new_count > 0):
+        became_labeled = 1 if new_count > 0 else -1
+        bump("labeled_images", {}, became_labeled)
+        for keyword in image.get("keywords") or []:
+            bump("keyword", {"keyword": keyword}, became_labeled)
+    if density_bucket(old_count) != density_bucket(new_count):
+        if density_bucket(old_count):
+            bump("density", {"bucket": density_bucket(old_count)}, -1)
+        if density_bucket(new_count):
+            bump("density", {"bucket": density_bucket(new_count)}, 1)
+
+async def write_label_stats(counters: Dict[str, tuple]):
+    updates = [
+        UpdateOne({"_id": key}, {"$set": {"kind": json.loads(key)[0], **fields}, "$inc": {"count": amount}}, upsert=True)
+        for key, (fields, amount) in counters.items()
+        if amount
+    ]
+    if updates:
+        await db.label_stats.bulk_write(updates, ordered=False)
+
+async def update_label_stats(image: Dict, labels: List[Dict], delta: int):
+    """Apply one image's label write to the materialized counters"""
+    counters: Dict[str, tuple] = {}
+    await collect_label_stats(image, labels, delta, counters)
+    await write_label_stats(counters)
+
+async def rebuild_label_stats():
+    """One-time backfill of the counters from existing labels; later writes keep them current"""
+    if await db.migrations.find_one({"_id": "label_stats_v2"}):
+        return
+    
+    await db.label_stats.delete_many({})
+    await db.image_label_values.delete_many({})
+    images = 0
+    async for image in db.nasa_images.find({"label_count": {"$gt": 0}}, {"id": 1, "keywords": 1, "label_count": 1}):
+        labels = await db.image_labels.find({"image_id": image["id"]}, {"_id": 0, "label": 1, "category": 1}).to_list(None)
+        await update_label_stats({**image, "label_count": len(labels)}, labels, 1)
+        images += 1
+    
+    await db.migrations.update_one(
+        {"_id": "label_stats_v2"},
+        {"$set": {"completed_at": datetime.now(timezone.utc), "images": images}},
+        upsert=True
+    )
+    logging.info(f"Built label statistics for {images} images")
+
+async def top_label_stats(kind: str, limit: int) -> List[Dict]:
+    return await db.label_stats.find({"kind": kind, "count": {"$gt": 0}}, {"_id": 0, "kind": 0}).sort("count", -1).limit(limit).to_list(limit)
+
+async def get_label_statistics(top: int) -> Dict[str, Any]:
+    """Read the materialized counters; cost depends on top, not on how many labels exist"""
+    totals = {
+        doc["kind"]: doc["count"]
+        async for doc in db.label_stats.find({"_id": {"$in": [stats_key("labels"), stats_key("labeled_images")]}})
+    }
+    labels = totals.get("labels", 0)
+    labeled_images = totals.get("labeled_images", 0)
+    
+    density = {doc["bucket"]: doc["count"] async for doc in db.label_stats.find({"kind": "density"})}
+    
+    # Co-occurrence matrix over the categories found on the most images; the diagonal
+    # holds each category's own image count
+    category_images = await top_label_stats("category_images", min(top, 50))
+    categories = [doc["category"] for doc in category_images]
+    counts = {(doc["category"], doc["category"]): doc["count"] for doc in category_images}
+    async for doc in db.label_stats.find({"_id": {"$in": [
+        stats_key("category_pair", *sorted((a, b))) for i, a in enumerate(categories) for b in categories[i + 1:]
+    ]}}):
+        counts[(doc["a"], doc["b"])] = counts[(doc["b"], doc["a"])] = doc["count"]
+    matrix = [[counts.get((a, b), 0) for b in categories] for a in categories]
+    
+    # Lift > 1 means images with the keyword carry the label more often than labeled images overall
+    keyword_labels = await top_label_stats("keyword_label", top)
+    keyword_counts = {
+        doc["keyword"]: doc["count"]
+        async for doc in db.label_stats.find({"_id": {"$in": [stats_key("keyword", doc["keyword"]) for doc in keyword_labels]}})
+    }
+    label_image_counts = {
+        doc["label"]: doc["count"]
+        async for doc in db.label_stats.find({"_id": {"$in": [stats_key("label_images", doc["label"]) for doc in keyword_labels]}})
+    }
+    correlations = []
+    for doc in keyword_labels:
+        expected = keyword_counts.get(doc["keyword"], 0) * label_image_counts.get(doc["label"], 0)
+        correlations.append({
+            "keyword": doc["keyword"],
+            "label": doc["label"],
+            "images": doc["count"],
+            "lift": round(doc["count"] * labeled_images / expected, 3) if expected else None
+        })
+    
+    return {
+        "totals": {
+            "labels": labels,
+            "labeled_images": labeled_images,
+            "mean_labels_per_image": round(labels / labeled_images, 2) if labeled_images else 0.0
+        },
+        "categories": await top_label_stats("category", top),
+        "labels": await top_label_stats("label", top),
+        "density": [
+            {"bucket": bucket, "images": density[bucket]}
+            for bucket in (density_bucket(low) for low, _ in LABEL_DENSITY_BUCKETS)
+            if density.get(bucket)
+        ],
+        "co_occurrence": {"categories": categories, "matrix": matrix},
+        "keyword_correlations": correlations
+    }
+
+def format_label_statistics(stats: Dict[str, Any]) -> str:
+    """Compact plain-text digest of the label statistics for prompts"""
+    lines = [f"{stats['totals']['labels']} labels on {stats['totals']['labeled_images']} images"]
+    lines.append("Categories: " + ", ".join(f"{doc['category']} {doc['count']}" for doc in stats["categories"]))
+    lines.append("Top labels: " + ", ".join(
+        f"{doc['label']} ({doc['category']}) {doc['count']}" if doc.get("category") else f"{doc['label']} {doc['count']}"
+        for doc in stats["labels"]
+    ))
+    names, matrix = stats["co_occurrence"]["categories"], stats["co_occurrence"]["matrix"]
+    pairs = sorted(
+        ((matrix[i][j], names[i], names[j]) for i in range(len(names)) for j in range(i + 1, len(names)) if matrix[i][j]),
+        reverse=True
+    )[:10]
+    lines.append("Categories co-occurring on images: " + ", ".join(f"{a} + {b} {count}" for count, a, b in pairs))
+    lines.append("Keyword correlations: " + ", ".join(
+        f"{doc['keyword']} -> {doc['label']} (lift {doc['lift']})" for doc in stats["keyword_correlations"][:10]
+    ))
+    return "\n".join(lines)
+
+# Label Regions
+def parse_bbox(bbox: str) -> tuple:
+    """Parse "x_min,y_min,x_max,y_max" into floats"""
+    try:
+        x_min, y_min, x_max, y_max = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bbox must be x_min,y_min,x_max,y_max")
+    if not all(math.isfinite(value) for value in (x_min, y_min, x_max, y_max)):
+        raise HTTPException(status_code=422, detail="bbox values must be finite numbers")
+    if x_min > x_max or y_min > y_max:
+        raise HTTPException(status_code=422, detail="bbox minimum exceeds maximum")
+    return x_min, y_min, x_max, y_max
+
+def label_overlaps(label: ImageLabel, bbox: tuple) -> bool:
+    # Edges count as overlap so zero-size point labels on the boundary match
+    x_min, y_min, x_max, y_max = bbox
+    return label.x <= x_max and label.x + label.width >= x_min and label.y <= y_max and label.y + label.height >= y_min
+
+class LabelGridIndex:
+    """Uniform grid over one image's label boxes; a box is listed in every cell it touches"""
+
+    def __init__(self, labels: List[ImageLabel]):
+        self.labels = labels
+        self.cells: Dict[tuple, List[int]] = {}
+        if not labels:
+            self.cell_size = 1.0
+            return
         
-        response = await chat.send_message(user_message)
-        return response
+        # About one label per cell, but never smaller than a typical box so boxes span few cells.
+        # Sized from the data alone: labels may be in pixels or in normalized 0..1 coordinates.
+        span_x = max(label.x + label.width for label in labels) - min(label.x for label in labels)
+        span_y = max(label.y + label.height for label in labels) - min(label.y for label in labels)
+        mean_edge = sum(max(label.width, label.height) for label in labels) / len(labels)
+        self.cell_size = max(mean_edge, ((span_x * span_y) / len(labels)) ** 0.5)
+        if self.cell_size <= 0:
+            # Labels along a line, or all at one point
+            self.cell_size = max(span_x, span_y) / len(labels) or 1.0
         
+        for index, label in enumerate(labels):
+            for cell in self._cells(label.x, label.y, label.x + label.width, label.y + label.height):
+                self.cells.setdefault(cell, []).append(index)
+
+    def _cells(self, x_min: float, y_min: float, x_max: float, y_max: float):
+        size = self.cell_size
+        for cx in range(int(x_min // size), int(x_max // size) + 1):
+            for cy in range(int(y_min // size), int(y_max // size) + 1):
+                yield cx, cy
+
+    def query(self, bbox: tuple) -> List[ImageLabel]:
+        """Labels overlapping bbox, in creation order"""
+        x_min, y_min, x_max, y_max = bbox
+        size = self.cell_size
+        cell_count = (int(x_max // size) - int(x_min // size) + 1) * (int(y_max // size) - int(y_min // size) + 1)
+        if cell_count >= len(self.cells):
+            candidates = range(len(self.labels))
+        else:
+            candidates = sorted({
+                index
+                for cell in self._cells(*bbox)
+                for index in self.cells.get(cell, ())
+            })
+        return [self.labels[index] for index in candidates if label_overlaps(self.labels[index], bbox)]
+
+async def get_label_index(image_id: str) -> LabelGridIndex:
+    async def load():
+        return LabelGridIndex(await find_image_labels(image_id))
+    return await label_index_cache.get_or_load(image_id, load)
+
+async def find_region_labels(bbox: Optional[tuple], category: Optional[str], limit: int) -> List[RegionLabel]:
+    """Labels across all images overlapping bbox, optionally of one category"""
+    query: Dict[str, Any] = {}
+    if category:
+        query["category"] = category
+    if bbox:
+        # Box origins are indexed, so Mongo prunes on the far edges; the near edges need x + width
+        query["x"] = {"$lte": bbox[2]}
+        query["y"] = {"$lte": bbox[3]}
+    
+    labels = []
+    async for doc in db.image_labels.find(query, {"_id": 0}):
+        label = RegionLabel(**doc)
+        if bbox is None or label_overlaps(label, bbox):
+            labels.append(label)
+            if len(labels) >= limit:
+                break
+    return labels
+
+# Label Import/Export
+class LabelImportResult:
+    """Running totals for a bulk label import"""
+
+    def __init__(self):
+        self.imported = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+
+    def error(self, item: Any, detail: Any):
+        self.error_count += 1
+        if len(self.errors) < LABEL_IMPORT_MAX_ERRORS:
+            if isinstance(detail, ValidationError):
+                detail = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in detail.errors())
+            self.errors.append({"item": item, "detail": str(detail)})
+
+    def to_dict(self) -> Dict:
+        return {
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "error_count": self.error_count,
+            "errors": self.errors
+        }
+
+def parse_label_record(record: Any) -> Dict:
+    """Validate one imported label and return the document to store"""
+    if not isinstance(record, dict):
+        raise ValueError(f"expected a JSON object, got {type(record).__name__}")
+    image_id = record.get("image_id")
+    if not isinstance(image_id, str) or not image_id:
+        raise ValueError("image_id is required")
+    label = ImageLabel(**{key: value for key, value in record.items() if key != "image_id"})
+    return {**label.dict(), "image_id": image_id}
+
+async def write_label_batch(batch: List[tuple], result: LabelImportResult):
+    """Insert a batch of (item, label document) pairs with one unordered bulk write"""
+    image_ids = list({doc["image_id"] for _, doc in batch})
+    known = {img["id"] async for img in db.nasa_images.find({"id": {"$in": image_ids}}, {"id": 1})}
+    
+    docs = []
+    for item, doc in batch:
+        if doc["image_id"] in known:
+            docs.append(doc)
+        else:
+            result.error(item, f"Image {doc['image_id']} not found")
+    if not docs:
+        return
+    
+    # Re-importing a label id is a duplicate, not an error
+    failed = set()
+    try:
+        await db.image_labels.bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get("writeErrors", []):
+            failed.add(write_error["index"])
+            if write_error.get("code") == 11000:
+                result.duplicates += 1
+            else:
+                result.error(docs[write_error["index"]]["id"], write_error.get("errmsg", "write failed"))
+    
+    inserted_per_image: Dict[str, List[Dict]] = {}
+    for index, doc in enumerate(docs):
+        if index not in failed:
+            inserted_per_image.setdefault(doc["image_id"], []).append(doc)
+    for image_id in inserted_per_image:
+        label_index_cache.invalidate(image_id)
+    if inserted_per_image:
+        await db.nasa_images.bulk_write([
+            UpdateOne({"id": image_id}, {"$inc": {"label_count": len(inserted)}})
+            for image_id, inserted in inserted_per_image.items()
+        ], ordered=False)
+        # One counter write for the whole batch, however many images it touched
+        counters: Dict[str, tuple] = {}
+        async for image in db.nasa_images.find({"id": {"$in": list(inserted_per_image)}}, {"id": 1, "keywords": 1, "label_count": 1}):
+            await collect_label_stats(image, inserted_per_image[image["id"]], 1, counters)
+        await write_label_stats(counters)
+    result.imported += sum(len(inserted) for inserted in inserted_per_image.values())
+
+async def import_ndjson_labels(chunks) -> LabelImportResult:
+    """Import labels from an NDJSON byte stream, validating and writing as lines arrive"""
+    result = LabelImportResult()
+    batch = []
+    buffer = b""
+    line_number = 0
+    
+    async def handle_line(line: bytes):
+        nonlocal line_number
+        line_number += 1
+        if not line.strip():
+            return
+        try:
+            batch.append((line_number, parse_label_record(json.loads(line))))
+        except (ValueError, ValidationError) as e:
+            result.error(line_number, e)
+        if len(batch) >= LABEL_IMPORT_BATCH_SIZE:
+            await write_label_batch(batch, result)
+            batch.clear()
+    
+    async def line_too_long():
+        if batch:
+            await write_label_batch(batch, result)
+        return HTTPException(
+            status_code=413,
+            detail=f"NDJSON line {line_number + 1} exceeds {LABEL_IMPORT_MAX_LINE_BYTES} bytes; {result.imported} labels imported before it"
+        )
+    
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if len(line) > LABEL_IMPORT_MAX_LINE_BYTES:
+                raise await line_too_long()
+            await handle_line(line)
+        # Only the current line is held in memory, so it can't grow without bound
+        if len(buffer) > LABEL_IMPORT_MAX_LINE_BYTES:
+            raise await line_too_long()
+    await handle_line(buffer)
+    if batch:
+        await write_label_batch(batch, result)
+    return result
+
+async def import_coco_labels(chunks) -> LabelImportResult:
+    """Import labels from a COCO annotation file
+
+    COCO images are matched to stored images by a zoomage_id field, a nasa_id field,
+    or a file_name whose stem is the nasa_id. Annotation bbox becomes x, y, width, height.
+    """
+    body = bytearray()
+    async for chunk in chunks:
+        body += chunk
+        if len(body) > LABEL_IMPORT_MAX_COCO_BYTES:
+            raise HTTPException(status_code=413, detail=f"COCO file exceeds {LABEL_IMPORT_MAX_COCO_BYTES} bytes")
+    try:
+        coco = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid COCO JSON: {e}")
+    del body
+    if not isinstance(coco, dict):
+        raise HTTPException(status_code=400, detail="Invalid COCO JSON: expected an object")
+    
+    result = LabelImportResult()
+    
+    # Resolve COCO image entries to stored image ids
+    coco_images = coco.get("images", [])
+    by_nasa_id = {}
+    image_ids = {}
+    for index, entry in enumerate(coco_images):
+        if not isinstance(entry, dict) or "id" not in entry:
+            result.error(f"images[{index}]", "expected an object with an id")
+            continue
+        if entry.get("zoomage_id"):
+            image_ids[entry["id"]] = entry["zoomage_id"]
+        else:
+            nasa_id = entry.get("nasa_id") or Path(entry.get("file_name", "")).stem
+            by_nasa_id[nasa_id] = entry["id"]
+    for offset in range(0, len(by_nasa_id), LABEL_IMPORT_BATCH_SIZE):
+        nasa_ids = list(by_nasa_id)[offset:offset + LABEL_IMPORT_BATCH_SIZE]
+        async for img in db.nasa_images.find({"nasa_id": {"$in": nasa_ids}}, {"id": 1, "nasa_id": 1}):
+            image_ids[by_nasa_id[img["nasa_id"]]] = img["id"]
+    categories = {}
+    for index, category in enumerate(coco.get("categories", [])):
+        if not isinstance(category, dict) or "id" not in category:
+            result.error(f"categories[{index}]", "expected an object with an id")
+            continue
+        categories[category["id"]] = category.get("name", str(category["id"]))
+    
+    batch = []
+    for annotation in coco.get("annotations", []):
+        try:
+            x, y, width, height = annotation["bbox"]
+            category_name = categories.get(annotation.get("category_id"))
+            record = {
+                "image_id": image_ids.get(annotation.get("image_id"), f"coco:{annotation.get('image_id')}"),
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "label": annotation.get("label") or category_name or "unlabeled",
+                "category": annotation.get("category", category_name),
+                "description": annotation.get("description"),
+                "created_by": annotation.get("created_by", "import")
+            }
+            if annotation.get("zoomage_label_id"):
+                record["id"] = annotation["zoomage_label_id"]
+            batch.append((annotation.get("id"), parse_label_record(record)))
+        except (KeyError, TypeError, ValueError, ValidationError) as e:
+            result.error(annotation.get("id") if isinstance(annotation, dict) else None, e)
+        if len(batch) >= LABEL_IMPORT_BATCH_SIZE:
+            await write_label_batch(batch, result)
+            batch.clear()
+    if batch:
+        await write_label_batch(batch, result)
+    return result
+
+def export_label_query(image_id: Optional[str]) -> Dict:
+    return {"image_id": image_id} if image_id else {}
+
+async def export_ndjson_labels(image_id: Optional[str]):
+    """Yield every label as NDJSON, a few hundred lines per chunk"""
+    lines = []
+    async for label in db.image_labels.find(export_label_query(image_id), {"_id": 0}).sort("_id", 1):
+        lines.append(json.dumps(label, default=json_default))
+        if len(lines) >= LABEL_EXPORT_CHUNK_LINES:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+async def export_coco_labels(image_id: Optional[str]):
+    """Yield a COCO annotation file; only image and category ids are held in memory"""
+    coco_image_ids: Dict[str, int] = {}
+    coco_category_ids: Dict[str, int] = {}
+    
+    yield '{"annotations":['
+    separator = ""
+    chunk = []
+    annotation_number = 0
+    async for label in db.image_labels.find(export_label_query(image_id), {"_id": 0}).sort("_id", 1):
+        annotation_number += 1
+        image_number = coco_image_ids.setdefault(label["image_id"], len(coco_image_ids) + 1)
+        category_name = label.get("category") or label["label"]
+        category_number = coco_category_ids.setdefault(category_name, len(coco_category_ids) + 1)
+        chunk.append(separator + json.dumps({
+            "id": annotation_number,
+            "image_id": image_number,
+            "category_id": category_number,
+            "bbox": [label["x"], label["y"], label.get("width", 0.0), label.get("height", 0.0)],
+            "area": label.get("width", 0.0) * label.get("height", 0.0),
+            "iscrowd": 0,
+            "zoomage_label_id": label["id"],
+            "label": label["label"],
+            "category": label.get("category"),
+            "description": label.get("description"),
+            "created_by": label.get("created_by")
+        }))
+        separator = ","
+        if len(chunk) >= LABEL_EXPORT_CHUNK_LINES:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+    
+    yield '],"images":['
+    separator = ""
+    image_ids = list(coco_image_ids)
+    for offset in range(0, len(image_ids), LABEL_IMPORT_BATCH_SIZE):
+        batch = image_ids[offset:offset + LABEL_IMPORT_BATCH_SIZE]
+        async for img in db.nasa_images.find({"id": {"$in": batch}}, {"id": 1, "nasa_id": 1, "url": 1}):
+            yield separator + json.dumps({
+                "id": coco_image_ids[img["id"]],
+                "zoomage_id": img["id"],
+                "nasa_id": img.get("nasa_id"),
+                "file_name": f"{img.get('nasa_id')}.jpg",
+                "coco_url": img.get("url")
+            })
+            separator = ","
+    
+    yield '],"categories":' + json.dumps([
+        {"id": number, "name": name} for name, number in coco_category_ids.items()
+    ]) + "}"
+
+# Batch Analysis
+async def stream_batch_analysis(items: List[Dict], force_refresh: bool, concurrency: int):
+    """Run batch items concurrently and yield NDJSON lines in completion order"""
+    semaphore = asyncio.Semaphore(concurrency)
+    total = len(items)
+    
+    async def run_item(item: Dict) -> Dict:
+        if item.get("error"):
+            return {**item, "status": "failed"}
+        async with semaphore:
+            try:
+                analysis = await analyze_image_url(item["image_url"], item["analysis_type"], force_refresh)
+                await save_image_analysis(item["image_url"], analysis)
+                return {**item, "status": "completed", "analysis": analysis}
+            except Exception as e:
+                logging.error(f"Batch analysis of {item['image_url']} failed: {e}")
+                return {**item, "status": "failed", "error": str(e)}
+    
+    yield json.dumps({"type": "start", "total": total}) + "\n"
+    
+    tasks = [asyncio.create_task(run_item(item)) for item in items]
+    succeeded = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if result["status"] == "completed":
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps({
+                "type": "result",
+                **result,
+                "completed": succeeded + failed,
+                "total": total
+            }) + "\n"
+    finally:
+        # Client went away or we finished: never leave analyses running unobserved
+        for task in tasks:
+            task.cancel()
+    
+    yield json.dumps({"type": "done", "total": total, "succeeded": succeeded, "failed": failed}) + "\n"
+
+# Analysis Job Queue
+# Jobs live in Mongo so they survive restarts; any replica's workers may claim them.
+# A running job whose lease expires (its worker died) is claimed again.
+analysis_job_event = asyncio.Event()
+analysis_workers: List[asyncio.Task] = []
+WORKER_ID = f"{os.uname().nodename}-{os.getpid()}"
+
+async def create_analysis_job_indexes():
+    await db.analysis_jobs.create_index("id", unique=True)
+    await db.analysis_jobs.create_index([("status", 1), ("created_at", 1)])
+    await db.analysis_jobs.create_index("expires_at", expireAfterSeconds=0)
+
+async def enqueue_analysis_job(request: AIAnalysisRequest) -> AnalysisJob:
+    queued = await db.analysis_jobs.count_documents({"status": "queued"})
+    if queued >= ANALYSIS_QUEUE_MAX:
+        raise HTTPException(status_code=429, detail="Analysis queue is full, retry later")
+    
+    job = AnalysisJob(
+        image_url=request.image_url,
+        analysis_type=request.analysis_type,
+        force_refresh=request.force_refresh
+    )
+    await db.analysis_jobs.insert_one(job.dict())
+    analysis_job_event.set()
+    return job
+
+async def claim_analysis_job() -> Optional[Dict]:
+    """Atomically take the oldest queued job, or a running job whose lease has expired"""
+    now = datetime.now(timezone.utc)
+    return await db.analysis_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_expires_at": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": WORKER_ID,
+                "started_at": now,
+                "lease_expires_at": now + timedelta(seconds=ANALYSIS_JOB_LEASE)
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def finish_analysis_job(job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None):
+    now = datetime.now(timezone.utc)
+    await db.analysis_jobs.update_one(
+        {"id": job_id},
+        {"$set": {
+            "status": status,
+            "result": result,
+            "error": error,
+            "finished_at": now,
+            "expires_at": now + timedelta(seconds=ANALYSIS_JOB_TTL)
+        }}
+    )
+
+async def run_analysis_job(job: Dict):
+    try:
+        analysis = await analyze_image_url(job["image_url"], job["analysis_type"], job.get("force_refresh", False))
+        await save_image_analysis(job["image_url"], analysis)
+        await finish_analysis_job(job["id"], "completed", result=analysis)
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so another worker picks it up
+        await db.analysis_jobs.update_one(
+            {"id": job["id"], "worker_id": WORKER_ID},
+            {"$set": {"status": "queued"}, "$unset": {"lease_expires_at": ""}}
+        )
+        raise
     except Exception as e:
-        logging.error(f"Error in AI analysis: {e}")
-        return f"AI analysis unavailable: {str(e)}"
+        unavailable = find_upstream_unavailable(e)
+        if unavailable is not None:
+            # The upstream is refusing calls for now: requeue rather than fail, and back off this worker
+            logging.warning(f"Requeueing analysis job {job['id']}: {unavailable}")
+            await db.analysis_jobs.update_one(
+                {"id": job["id"], "worker_id": WORKER_ID},
+                {"$set": {"status": "queued"}, "$unset": {"lease_expires_at": ""}}
+            )
+            await asyncio.sleep(unavailable.retry_after)
+            return
+        logging.error(f"Analysis job {job['id']} failed: {e}")
+        await finish_analysis_job(job["id"], "failed", error=str(e))
+
+async def analysis_worker():
+    while True:
+        try:
+            job = await claim_analysis_job()
+        except Exception as e:
+            logging.error(f"Error claiming analysis job: {e}")
+            job = None
+        
+        if job is not None:
+            await run_analysis_job(job)
+            continue
+        
+        # Idle: wake on a local enqueue, or poll for work queued by other replicas
+        analysis_job_event.clear()
+        try:
+            await asyncio.wait_for(analysis_job_event.wait(), timeout=ANALYSIS_JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
 
 # API Routes
 @api_router.get("/")
@@ -230,34 +3168,126 @@ async def root():
 
 @api_router.post("/search", response_model=List[NASAImage])
 async def search_images(request: SearchRequest):
-    """Search NASA images"""
+    """Search NASA images, one page at a time; X-Total-Count holds NASA's total hit count"""
     try:
-        nasa_results = await search_nasa_images(request.query, request.media_type)
+        nasa_results, total_hits = await search_nasa_results(request.query, request.media_type, request.page, request.page_size)
         
-        images = []
-        for result in nasa_results:
-            # Check if image already exists in DB
-            existing = await db.nasa_images.find_one({"nasa_id": result["nasa_id"]})
-            
-            if existing:
-                images.append(NASAImage(**existing))
-            else:
-                # Create new image entry
-                nasa_image = NASAImage(**result)
-                await db.nasa_images.insert_one(nasa_image.dict())
-                images.append(nasa_image)
+        images = await save_search_results(nasa_results)
         
-        return images
+        if SEARCH_PREFETCH:
+            prefetch_next_page(request, total_hits)
+        return json_response(images, headers={"X-Total-Count": str(total_hits)})
     except Exception as e:
         logging.error(f"Error in search: {e}")
+        raise upstream_http_error(e)
+
+@api_router.get("/search/local")
+async def search_saved_images(
+    q: Optional[str] = None,
+    keywords: List[str] = Query([]),
+    labeled: Optional[bool] = None,
+    analyzed: Optional[bool] = None,
+    limit: int = Query(20, ge=1, le=LOCAL_SEARCH_MAX_RESULTS)
+):
+    """Search stored images by text, keywords and labeled/analyzed status without calling NASA
+
+    Text matches are ranked by the weighted text index (title, keywords, description,
+    AI analysis). Keyword facets are counted over the top LOCAL_SEARCH_FACET_SAMPLE matches.
+    """
+    try:
+        result = await search_local_images(q, keywords, labeled, analyzed, limit)
+        return json_response(result)
+    except Exception as e:
+        logging.error(f"Error searching stored images: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/images/{image_id}/similar")
+async def get_similar_images(
+    image_id: str,
+    k: int = Query(10, ge=1, le=100),
+    exact: bool = Query(False, description="Scan every vector instead of the approximate IVF index")
+):
+    """Find the k stored images whose embedded text is most similar to this image's"""
+    try:
+        matches = await find_similar_images(image_id, k, exact)
+        if matches is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return json_response(matches)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error finding similar images: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/embeddings/refresh")
+async def refresh_image_embeddings():
+    """Embed every stored image whose embedding is missing or out of date"""
+    try:
+        return await refresh_embeddings()
+    except Exception as e:
+        logging.error(f"Error refreshing embeddings: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    """Get hit/miss/eviction counters for the response caches"""
+    return {
+        "search": search_cache.stats(),
+        "analysis": analysis_cache.stats(),
+        "discovery": discovery_cache.stats(),
+        "manifest": manifest_cache.stats(),
+        "label_index": label_index_cache.stats(),
+        "vector_index": vector_index_cache.stats(),
+        "image_store": image_store.stats(),
+    }
+
+@api_router.get("/upstreams")
+async def get_upstream_stats():
+    """Get rate limit, queue and circuit breaker state for each upstream"""
+    return {name: guard.stats() for name, guard in upstream_guards.items()}
+
 @api_router.get("/images", response_model=List[NASAImage])
-async def get_saved_images():
-    """Get all saved NASA images"""
+async def get_saved_images(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated NASAImage fields, e.g. id,title,thumbnail_url")
+):
+    """Get saved NASA images, one keyset page at a time
+
+    Pages are ordered by _id (ObjectIds increase with insertion time). When more images
+    remain, the X-Next-Cursor response header holds the cursor for the next page.
+    """
     try:
-        images = await db.nasa_images.find().to_list(100)
-        return [NASAImage(**img) for img in images]
+        query = {}
+        if cursor:
+            try:
+                query["_id"] = {"$gt": ObjectId(cursor)}
+            except InvalidId:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        
+        projection = None
+        if fields:
+            requested = {name.strip() for name in fields.split(",") if name.strip()} | {"id"}
+            unknown = requested - set(NASAImage.model_fields)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+            projection = dict.fromkeys(requested, 1)
+        
+        # Fetch one extra document to learn whether another page exists
+        images = await db.nasa_images.find(query, projection).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+        
+        headers = {}
+        if len(images) > limit:
+            images = images[:limit]
+            headers["X-Next-Cursor"] = str(images[-1]["_id"])
+        
+        # Same shape as the full model; a fields request gets only the fields it asked for
+        images = [image_document(img) for img in images]
+        if fields:
+            images = [{name: value for name, value in img.items() if name in requested} for img in images]
+        return json_response(images, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -268,27 +3298,157 @@ async def get_image_details(image_id: str):
         image = await db.nasa_images.find_one({"id": image_id})
         if not image:
             raise HTTPException(status_code=404, detail="Image not found")
-        return NASAImage(**image)
+        await ensure_renditions(image)
+        image = image_document(image)
+        image["labels"] = [label.dict() for label in await find_image_labels(image_id)]
+        return json_response(image)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/images/{image_id}/raw")
+async def get_image_raw(
+    image_id: str,
+    request: Request,
+    size: Optional[str] = Query(None, description="Rendition: thumb, small, medium, large or orig; defaults to the search preview")
+):
+    """Serve an image's bytes from the local store, downloading them at most once
+
+    Responses carry the content hash as a strong ETag and honour If-None-Match and
+    single-range Range requests. Full bodies go out as file responses, which servers
+    supporting the ASGI pathsend extension hand to the kernel without copying.
+    """
+    if size is not None and size not in RENDITION_SIZES:
+        raise HTTPException(status_code=422, detail=f"size must be one of {', '.join(RENDITION_SIZES)}")
+    try:
+        image = await db.nasa_images.find_one(
+            {"id": image_id},
+            {"id": 1, "url": 1, "renditions": 1, "manifest_url": 1, "renditions_resolved_at": 1}
+        )
+        if not image:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        url = image["url"]
+        if size:
+            if size not in (image.get("renditions") or {}):
+                await ensure_renditions(image)
+            url = pick_rendition(image.get("renditions"), size) or url
+        stored = await image_store.fetch(url)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching image {image_id}: {e}")
+        raise upstream_http_error(e)
+
+    etag = f'"{stored.sha256}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={IMAGE_BROWSER_MAX_AGE}",
+        "Accept-Ranges": "bytes"
+    }
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        byte_range = parse_byte_range(range_header, stored.size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                read_file_range(stored.path, start, end),
+                status_code=206,
+                media_type=stored.content_type,
+                headers=headers
+            )
+
+    return FileResponse(stored.path, media_type=stored.content_type, headers=headers)
+
 @api_router.post("/analyze")
 async def analyze_image_with_ai(request: AIAnalysisRequest):
     """Analyze image with AI"""
     try:
-        analysis = await get_ai_analysis(request.image_url, request.analysis_type)
+        analysis = await analyze_image_url(request.image_url, request.analysis_type, request.force_refresh)
         
         # Update image with AI analysis
-        await db.nasa_images.update_one(
-            {"url": request.image_url},
-            {"$set": {"ai_analysis": analysis}}
-        )
+        await save_image_analysis(request.image_url, analysis)
         
         return {"analysis": analysis}
     except Exception as e:
         logging.error(f"Error in AI analysis: {e}")
+        raise upstream_http_error(e)
+
+@api_router.post("/analyze/stream")
+async def analyze_image_stream(request: AIAnalysisRequest):
+    """Analyze image with AI, streaming model tokens over SSE"""
+    return sse_response(stream_text_events(
+        stream_image_analysis(request.image_url, request.analysis_type, request.force_refresh),
+        "analysis"
+    ))
+
+@api_router.post("/analyze/batch")
+async def analyze_images_batch(request: BatchAnalysisRequest):
+    """Analyze many images concurrently, streaming per-item results as NDJSON"""
+    try:
+        analysis_types = request.analysis_types or ["general"]
+        total = (len(request.image_ids) + len(request.image_urls)) * len(analysis_types)
+        if total == 0:
+            raise HTTPException(status_code=400, detail="No images to analyze")
+        if total > BATCH_ANALYSIS_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Batch has {total} items, limit is {BATCH_ANALYSIS_MAX_ITEMS}")
+        
+        # Resolve image ids to URLs in one query; unknown ids become failed items
+        urls_by_id = {}
+        if request.image_ids:
+            async for img in db.nasa_images.find({"id": {"$in": request.image_ids}}, {"id": 1, "url": 1}):
+                urls_by_id[img["id"]] = img["url"]
+        
+        targets = [{"image_id": image_id, "image_url": urls_by_id.get(image_id)} for image_id in request.image_ids]
+        targets += [{"image_id": None, "image_url": image_url} for image_url in request.image_urls]
+        
+        items = []
+        for target in targets:
+            for analysis_type in analysis_types:
+                item = {"index": len(items), **target, "analysis_type": analysis_type}
+                if not target["image_url"]:
+                    item["error"] = "Image not found"
+                items.append(item)
+        
+        concurrency = min(request.concurrency or BATCH_ANALYSIS_CONCURRENCY, BATCH_ANALYSIS_CONCURRENCY)
+        return StreamingResponse(
+            stream_batch_analysis(items, request.force_refresh, max(concurrency, 1)),
+            media_type="application/x-ndjson"
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error in batch analysis: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/analyze/jobs", response_model=AnalysisJob, status_code=202)
+async def submit_analysis_job(request: AIAnalysisRequest):
+    """Queue an AI analysis and return its job immediately"""
+    try:
+        return await enqueue_analysis_job(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error queueing AI analysis: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/analyze/jobs/{job_id}", response_model=AnalysisJob)
+async def get_analysis_job(job_id: str):
+    """Get the status and result of a queued AI analysis"""
+    try:
+        job = await db.analysis_jobs.find_one({"id": job_id})
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return AnalysisJob(**job)
+    except HTTPException:
+        raise
+    except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/images/{image_id}/labels", response_model=ImageLabel)
@@ -296,15 +3456,20 @@ async def add_label_to_image(image_id: str, label: ImageLabel):
     """Add a label to an image"""
     try:
         # Check if image exists
-        image = await db.nasa_images.find_one({"id": image_id})
+        image = await db.nasa_images.find_one({"id": image_id}, {"_id": 1})
         if not image:
             raise HTTPException(status_code=404, detail="Image not found")
         
-        # Add label to image
-        await db.nasa_images.update_one(
+        # Labels are their own documents, so a write never rewrites the image
+        await db.image_labels.insert_one({**label.dict(), "image_id": image_id})
+        image = await db.nasa_images.find_one_and_update(
             {"id": image_id},
-            {"$push": {"labels": label.dict()}}
+            {"$inc": {"label_count": 1}},
+            projection={"id": 1, "keywords": 1, "label_count": 1},
+            return_document=ReturnDocument.AFTER
         )
+        label_index_cache.invalidate(image_id)
+        await update_label_stats(image, [label.dict()], 1)
         
         return label
     except HTTPException:
@@ -313,15 +3478,21 @@ async def add_label_to_image(image_id: str, label: ImageLabel):
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/images/{image_id}/labels", response_model=List[ImageLabel])
-async def get_image_labels(image_id: str):
-    """Get all labels for an image"""
+async def get_image_labels(image_id: str, bbox: Optional[str] = None, category: Optional[str] = None):
+    """Get an image's labels, optionally only those overlapping bbox=x_min,y_min,x_max,y_max"""
     try:
-        image = await db.nasa_images.find_one({"id": image_id})
+        region = parse_bbox(bbox) if bbox else None
+        image = await db.nasa_images.find_one({"id": image_id}, {"_id": 1})
         if not image:
             raise HTTPException(status_code=404, detail="Image not found")
         
-        labels = image.get("labels", [])
-        return [ImageLabel(**label) for label in labels]
+        if region is None:
+            labels = await find_image_labels(image_id)
+        else:
+            labels = (await get_label_index(image_id)).query(region)
+        if category:
+            labels = [label for label in labels if label.category == category]
+        return labels
     except HTTPException:
         raise
     except Exception as e:
@@ -331,49 +3502,101 @@ async def get_image_labels(image_id: str):
 async def delete_label(image_id: str, label_id: str):
     """Delete a label from an image"""
     try:
-        await db.nasa_images.update_one(
-            {"id": image_id},
-            {"$pull": {"labels": {"id": label_id}}}
-        )
+        label = await db.image_labels.find_one_and_delete({"id": label_id, "image_id": image_id}, {"label": 1, "category": 1})
+        if label:
+            image = await db.nasa_images.find_one_and_update(
+                {"id": image_id},
+                {"$inc": {"label_count": -1}},
+                projection={"id": 1, "keywords": 1, "label_count": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            label_index_cache.invalidate(image_id)
+            if image:
+                await update_label_stats(image, [label], -1)
         return {"message": "Label deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/labels/stats")
+async def get_label_stats(top: int = Query(20, ge=1, le=200)):
+    """Label frequencies, co-occurrence, per-image density and keyword correlations"""
+    try:
+        return await get_label_statistics(top)
+    except Exception as e:
+        logging.error(f"Error reading label statistics: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/labels/region", response_model=List[RegionLabel])
+async def get_region_labels(
+    bbox: Optional[str] = None,
+    category: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=LABEL_REGION_MAX_RESULTS)
+):
+    """Find labels across all images overlapping bbox, optionally of one category"""
+    try:
+        region = parse_bbox(bbox) if bbox else None
+        if region is None and not category:
+            raise HTTPException(status_code=422, detail="bbox or category is required")
+        return await find_region_labels(region, category, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error finding region labels: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/labels/import")
+async def import_labels(request: Request, format: str = Query("ndjson", pattern="^(ndjson|coco)$")):
+    """Bulk import labels from an NDJSON stream or a COCO annotation file"""
+    try:
+        if format == "coco":
+            result = await import_coco_labels(request.stream())
+        else:
+            result = await import_ndjson_labels(request.stream())
+        return result.to_dict()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error importing labels: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/labels/export")
+async def export_labels(format: str = Query("ndjson", pattern="^(ndjson|coco)$"), image_id: Optional[str] = None):
+    """Stream every label (or one image's labels) as NDJSON or COCO JSON"""
+    if format == "coco":
+        return StreamingResponse(export_coco_labels(image_id), media_type="application/json")
+    return StreamingResponse(export_ndjson_labels(image_id), media_type="application/x-ndjson")
+
 @api_router.get("/discover")
 async def discover_patterns():
     """Discover patterns across multiple images using AI"""
     try:
-        # Get images with labels
-        images = await db.nasa_images.find({"labels": {"$ne": []}}).to_list(20)
-        
-        if not images:
+        messages = await build_discovery_messages()
+        if messages is None:
             return {"patterns": "No labeled images found for pattern discovery"}
         
-        # Prepare data for AI analysis
-        pattern_data = []
-        for img in images:
-            labels = [f"{label['label']}: {label.get('description', '')}" for label in img.get('labels', [])]
-            pattern_data.append({
-                "title": img.get('title', ''),
-                "labels": labels
-            })
-        
         # Use AI to discover patterns
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=str(uuid.uuid4()),
-            system_message="You are a pattern discovery expert for space imagery. Analyze labeled features across multiple images to find patterns, correlations, and interesting discoveries."
-        ).with_model("openai", "gpt-4o")
-        
-        prompt = f"Analyze these labeled NASA images and discover patterns:\n\n{json.dumps(pattern_data, indent=2)}\n\nIdentify recurring features, interesting correlations, and potential scientific discoveries."
-        
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        return {"patterns": response}
+        return {"patterns": await complete_chat(messages, "llm_discovery")}
     except Exception as e:
         logging.error(f"Error in pattern discovery: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise upstream_http_error(e)
+
+@api_router.get("/discover/stream")
+async def discover_patterns_stream():
+    """Discover patterns across labeled images, streaming model tokens over SSE"""
+    async def deltas():
+        messages = await build_discovery_messages()
+        if messages is None:
+            yield "No labeled images found for pattern discovery"
+            return
+        async for delta in stream_completion(messages, "llm_discovery_stream"):
+            yield delta
+    
+    return sse_response(stream_text_events(deltas(), "patterns"))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -384,15 +3607,109 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Trace-Id"],
 )
 
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# Outermost, so its timings include the other middleware
+if METRICS_ENABLED or LOG_TRACE_IDS:
+    app.add_middleware(RequestMetricsMiddleware)
+
 # Configure logging
+if LOG_TRACE_IDS:
+    _base_record_factory = logging.getLogRecordFactory()
+
+    def record_with_trace_id(*args, **kwargs):
+        record = _base_record_factory(*args, **kwargs)
+        record.trace_id = trace_id_var.get()
+        return record
+
+    logging.setLogRecordFactory(record_with_trace_id)
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s' if LOG_TRACE_IDS
+    else '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_clients():
+    global http_client, manifest_semaphore
+    if db is None:
+        connect_db()
+    http_client = create_http_client()
+    manifest_semaphore = asyncio.Semaphore(ASSET_MANIFEST_CONCURRENCY)
+
+@app.on_event("startup")
+async def create_db_indexes():
+    index_builders = [
+        ("nasa_images url", lambda: db.nasa_images.create_index("url")),
+        ("manifest_cache", manifest_cache.create_indexes),
+        ("nasa_images search", create_search_indexes),
+        ("image_embeddings", create_embedding_indexes),
+        ("search_cache", search_cache.create_indexes),
+        ("analysis_cache", analysis_cache.create_indexes),
+        ("discovery_cache", discovery_cache.create_indexes),
+        ("analysis_jobs", create_analysis_job_indexes),
+        ("image_labels", create_label_indexes),
+        ("label_stats", create_label_stats_indexes),
+    ]
+    
+    async def build(name, create):
+        try:
+            await create()
+        except Exception as e:
+            logging.error(f"Error creating {name} indexes: {e}")
+    
+    # save_search_results relies on the unique nasa_id index to keep copies out, so a
+    # failure here stops startup rather than being logged like the others
+    await create_image_indexes()
+    # Concurrently, so a restart waits for one round trip rather than one per collection
+    await asyncio.gather(*(build(name, create) for name, create in index_builders))
+
+@app.on_event("startup")
+async def run_migrations():
+    try:
+        await migrate_embedded_labels()
+    except Exception as e:
+        logging.error(f"Error migrating embedded labels: {e}")
+    try:
+        await rebuild_label_stats()
+    except Exception as e:
+        logging.error(f"Error building label statistics: {e}")
+
+@app.on_event("startup")
+async def start_analysis_workers():
+    # A fresh event per start, bound to the loop the workers run on
+    global analysis_job_event
+    analysis_job_event = asyncio.Event()
+    for _ in range(ANALYSIS_WORKERS):
+        analysis_workers.append(asyncio.create_task(analysis_worker()))
+
+@app.on_event("shutdown")
+async def stop_analysis_workers():
+    for worker in analysis_workers:
+        worker.cancel()
+    await asyncio.gather(*analysis_workers, return_exceptions=True)
+    analysis_workers.clear()
+
+@app.on_event("shutdown")
+async def cancel_background_fetches():
+    tasks = list(prefetch_tasks) + list(rendition_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    global llm_client, image_pool
+    if client is not None:
+        client.close()
+    await http_client.aclose()
+    llm_client = None
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+        image_pool = None
@@ -0,0 +1,1568 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmarks for Zoomage NASA Image Explorer
+Runs the FastAPI app in-process against local stub upstreams and reports throughput.
+
+NASA and OpenAI are replaced by local fakes with configurable latency (BENCH_STUB_LATENCY,
+BENCH_LLM_LATENCY) and Mongo by mongomock, or a real mongod given BENCH_MONGO_URL.
+
+    python backend_bench.py                                   # everything
+    python backend_bench.py route_load --output runs/a.json   # every route, saved as JSON
+    python backend_bench.py route_load --compare runs/a.json  # exits 1 on p95/throughput regressions
+    python backend_bench.py cold_start                        # exits 1 when startup misses its targets
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Any
+from urllib.parse import urlparse, parse_qs
+
+import httpx
+import numpy as np
+import uvicorn
+from bson import ObjectId
+from PIL import Image
+from pydantic import TypeAdapter
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+# Configuration
+STUB_LATENCY = float(os.environ.get("BENCH_STUB_LATENCY", "0.2"))
+LLM_LATENCY = float(os.environ.get("BENCH_LLM_LATENCY", "1.0"))
+STUB_TOTAL_HITS = 500
+# Rendition sizes the stub's collection.json manifests advertise (longest edge in pixels)
+STUB_RENDITIONS = {"thumb": 150, "small": 320, "medium": 1000, "large": 1600, "orig": 3000}
+CONCURRENCY_LEVELS = [1, 4, 16, 32]
+IMAGE_SIZES_PX = [1000, 3000, 6000]  # noise JPEGs of roughly 1, 8 and 32 MB
+LISTING_CORPUS_SIZES = [int(n) for n in os.environ.get("BENCH_LISTING_SIZES", "10000,100000").split(",")]
+# Use a real mongod for latency numbers that reflect production; mongomock scans every document
+BENCH_MONGO_URL = os.environ.get("BENCH_MONGO_URL")
+# mongomock checks unique indexes by scanning, so bulk inserts are quadratic there
+LABEL_REGION_SIZE = int(os.environ.get("BENCH_LABEL_REGION_SIZE", "5000" if BENCH_MONGO_URL else "2000"))
+LOCAL_SEARCH_SIZE = int(os.environ.get("BENCH_LOCAL_SEARCH_SIZE", "1000000"))
+VECTOR_BENCH_SIZE = int(os.environ.get("BENCH_VECTOR_SIZE", "100000"))
+DISCOVERY_IMAGES = int(os.environ.get("BENCH_DISCOVERY_IMAGES", "200"))
+LABEL_IMPORT_SIZE = int(os.environ.get("BENCH_LABEL_IMPORT_SIZE", "100000" if BENCH_MONGO_URL else "2000"))
+REQUESTS_PER_LEVEL = 32
+# Route load test: every api_router route at each concurrency level
+LOAD_CONCURRENCY = [int(n) for n in os.environ.get("BENCH_LOAD_CONCURRENCY", "1,8,32").split(",")]
+LOAD_REQUESTS = int(os.environ.get("BENCH_LOAD_REQUESTS", "64"))
+# --compare flags a route whose p95 grew, or whose throughput fell, by more than this
+REGRESSION_PCT = float(os.environ.get("BENCH_REGRESSION_PCT", "20"))
+# Cold start: `import server` under -X importtime, and process spawn to the first 200 from /api/
+COLD_START_RUNS = int(os.environ.get("BENCH_COLD_START_RUNS", "5"))
+IMPORT_TARGET_MS = float(os.environ.get("BENCH_IMPORT_TARGET_MS", "500"))
+FIRST_200_TARGET_MS = float(os.environ.get("BENCH_FIRST_200_TARGET_MS", "750"))
+
+# Serves the app the way `uvicorn server:app` would; without BENCH_MONGO_URL the database is
+# swapped for mongomock before startup, so the first 200 also pays for importing mongomock
+COLD_START_SCRIPT = """
+import sys
+import uvicorn
+sys.path.insert(0, {backend!r})
+import server
+if {mongomock!r}:
+    from mongomock_motor import AsyncMongoMockClient
+    server.db = AsyncMongoMockClient()["zoomage_cold_start"]
+uvicorn.run(server.app, host="127.0.0.1", port={port}, log_level="warning")
+"""
+
+
+def make_nasa_item(base_url: str, query: str, index: int) -> Dict[str, Any]:
+    """Build a search result item shaped like images-api.nasa.gov output"""
+    nasa_id = f"{query}-{index:04d}"
+    return {
+        "href": f"{base_url}/images/{nasa_id}/collection.json",
+        "data": [{
+            "nasa_id": nasa_id,
+            "title": f"{query.title()} image {index}",
+            "description": f"Stub description for {nasa_id}. " * 8,
+            "date_created": "2020-01-01T00:00:00Z",
+            "media_type": "image",
+            "keywords": [query, "stub", f"kw{index % 5}"],
+        }],
+        "links": [
+            {"href": f"{base_url}/images/{nasa_id}~thumb.jpg?px=150", "render": "image"},
+            {"href": f"{base_url}/images/{nasa_id}~medium.jpg?px=1000", "render": "image"},
+        ],
+    }
+
+
+# Words for generated prose; drawing from a fixed vocabulary compresses about as well as English text
+PROSE_WORDS = (
+    "the a of and in on with from this image shows near crater ridge plume dust storm surface orbit "
+    "spacecraft rover lander mars moon earth jupiter saturn nebula galaxy star cluster infrared "
+    "visible light camera instrument captured during mission sol region northern southern polar "
+    "cap ice layered deposits sediment basin volcanic flow channel valley dune field wind erosion "
+    "impact ejecta bright dark feature scientists study evidence water ancient atmosphere cloud "
+    "band vortex ring shadow horizon telescope hubble webb astronaut station module solar array"
+).split()
+
+
+def make_prose(rng: random.Random, chars: int) -> str:
+    words, length = [], 0
+    while length < chars:
+        words.append(rng.choice(PROSE_WORDS))
+        length += len(words[-1]) + 1
+    return " ".join(words).capitalize() + "."
+
+
+def make_stored_image(rng: random.Random, index: int) -> Dict[str, Any]:
+    """A nasa_images document with production-like field sizes: long NASA descriptions and AI analyses"""
+    nasa_id = f"PIA{20000 + index:05d}"
+    assets = f"https://images-assets.nasa.gov/image/{nasa_id}"
+    return {
+        "_id": ObjectId(),
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "nasa_id": nasa_id,
+        "title": make_prose(rng, 60),
+        "description": make_prose(rng, 1500),
+        "url": f"{assets}/{nasa_id}~orig.jpg",
+        "thumbnail_url": f"{assets}/{nasa_id}~thumb.jpg",
+        "date_created": "2021-02-18T00:00:00Z",
+        "media_type": "image",
+        "renditions": {size: f"{assets}/{nasa_id}~{size}.jpg" for size in STUB_RENDITIONS},
+        "renditions_resolved_at": datetime.now(timezone.utc),
+        "manifest_url": f"{assets}/collection.json",
+        "labels": [],
+        "label_count": rng.randint(0, 12),
+        "ai_analysis": make_prose(rng, 3000),
+        "keywords": rng.sample(PROSE_WORDS, 8),
+    }
+
+
+_jpeg_cache: Dict[int, bytes] = {}
+
+
+def make_noise_jpeg(px: int) -> bytes:
+    """Square noise JPEG; noise defeats compression so file size tracks pixel count"""
+    if px not in _jpeg_cache:
+        pixels = np.random.default_rng(px).integers(0, 256, (px, px, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+        _jpeg_cache[px] = buffer.getvalue()
+    return _jpeg_cache[px]
+
+
+class StubNASAHandler(BaseHTTPRequestHandler):
+    """Minimal images-api.nasa.gov stand-in with a fixed per-request latency"""
+
+    latency = STUB_LATENCY
+    request_count = 0
+    # Fault injection: fail every request with fail_status, or a random fail_rate share of them with a 503
+    fail_status = None
+    fail_rate = 0.0
+    fail_random = random.Random(7)
+
+    def do_GET(self):
+        type(self).request_count += 1
+        time.sleep(self.latency)
+        if self.fail_status or (self.fail_rate and self.fail_random.random() < self.fail_rate):
+            body = b"upstream unavailable"
+            self.send_response(self.fail_status or 503)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        # Assets come from a different host name, like images-assets.nasa.gov, so they get their own host limit
+        asset_url = f"http://localhost:{self.server.server_port}"
+        if parsed.path.endswith("/collection.json"):
+            nasa_id = parsed.path.split("/")[2]
+            body = json.dumps([
+                f"{asset_url}/images/{nasa_id}~{size}.jpg?px={px}" for size, px in STUB_RENDITIONS.items()
+            ] + [f"{asset_url}/images/{nasa_id}~orig.tif", f"{asset_url}/images/{nasa_id}/metadata.json"]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+        elif parsed.path.startswith("/images/"):
+            if "px" in params:
+                body = make_noise_jpeg(int(params["px"][0]))
+            else:
+                # Deterministic pseudo-image bytes; ?bytes= controls the size
+                size = int(params.get("bytes", [str(256 * 1024)])[0])
+                seed = parsed.path.encode()
+                body = (seed * (size // len(seed) + 1))[:size]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+        elif parsed.path == "/search":
+            query = params.get("q", ["stub"])[0]
+            page = int(params.get("page", ["1"])[0])
+            page_size = int(params.get("page_size", ["20"])[0])
+            start = (page - 1) * page_size
+            body = json.dumps({
+                "collection": {
+                    "items": [make_nasa_item(asset_url, query, i) for i in range(start, min(start + page_size, STUB_TOTAL_HITS))],
+                    "metadata": {"total_hits": STUB_TOTAL_HITS},
+                }
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+        else:
+            body = b"not found"
+            self.send_response(404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Background fetches cancelled at shutdown hang up mid-response
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat completions endpoint with configurable latency"""
+
+    latency = LLM_LATENCY
+    request_count = 0
+    prompt_chars = 0
+    # Streams sent to the end, and streams the client hung up on part way
+    streams_completed = 0
+    streams_aborted = 0
+
+    content = "Fake analysis: craters, ridges and a dust plume."
+
+    def do_POST(self):
+        type(self).request_count += 1
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).prompt_chars += sum(len(message.get("content") or "") for message in payload.get("messages", []) if isinstance(message.get("content"), str))
+        if payload.get("stream"):
+            self._stream_completion(payload)
+            return
+        time.sleep(self.latency)
+        body = json.dumps({
+            "id": f"chatcmpl-{type(self).request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 12, "total_tokens": 112},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_completion(self, payload: Dict[str, Any]):
+        """Emit the same content as SSE chunks, spreading the latency across tokens"""
+        words = self.content.split(" ")
+        tokens = words[:1] + [" " + word for word in words[1:]]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            self._write_stream(payload, tokens)
+        except (BrokenPipeError, ConnectionResetError):
+            type(self).streams_aborted += 1
+            return
+        type(self).streams_completed += 1
+
+    def _write_stream(self, payload: Dict[str, Any], tokens: List[str]):
+        for token in tokens:
+            time.sleep(self.latency / len(tokens))
+            chunk = {
+                "id": f"chatcmpl-{type(self).request_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            usage = {
+                "id": f"chatcmpl-{type(self).request_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(tokens), "total_tokens": 100 + len(tokens)},
+            }
+            self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler) -> ThreadingHTTPServer:
+    """Serve a stub handler on an ephemeral localhost port in a daemon thread"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class CountingCollection:
+    """Collection proxy that counts every database call issued through it"""
+
+    def __init__(self, collection, counter: Dict[str, int]):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._counter[name] = self._counter.get(name, 0) + 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """Database proxy handing out CountingCollection wrappers"""
+
+    def __init__(self, database):
+        self._database = database
+        self.counter: Dict[str, int] = {}
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._database, name), self.counter)
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+
+def current_rss_bytes() -> int:
+    """Resident set size now; falls back to the lifetime peak where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class PeakMemorySampler:
+    """Tracks peak RSS from a background thread; tracemalloc would slow the code under test"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2), "max_ms": round(max(latencies) * 1000, 2)}
+
+
+class LoadScenario:
+    """One route to drive: `build(i)` returns the url and httpx keyword arguments for request i"""
+
+    def __init__(self, method: str, route: str, build, skip: str = None):
+        self.method = method
+        self.route = route
+        self.build = build
+        self.skip = skip
+        self.sent = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.route}"
+
+
+class ZoomageBenchmark:
+    def __init__(self):
+        self.nasa_stub = start_stub_server(StubNASAHandler)
+        self.openai_stub = start_stub_server(FakeOpenAIHandler)
+        self.nasa_url = f"http://127.0.0.1:{self.nasa_stub.server_port}"
+        os.environ["NASA_API_URL"] = self.nasa_url
+        os.environ["NASA_ASSETS_URL"] = f"http://localhost:{self.nasa_stub.server_port}"
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{self.openai_stub.server_port}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        # The stubs are local; only bench_upstream_resilience exercises the rate limiters
+        os.environ.setdefault("NASA_RATE_LIMIT", "0")
+        os.environ.setdefault("LLM_RATE_LIMIT", "0")
+        os.environ["IMAGE_CACHE_DIR"] = tempfile.mkdtemp(prefix="zoomage-bench-")
+
+        import server
+        from mongomock_motor import AsyncMongoMockClient
+
+        self.server = server
+        if BENCH_MONGO_URL:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            self.mongo = AsyncIOMotorClient(BENCH_MONGO_URL)
+        else:
+            self.mongo = AsyncMongoMockClient()
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        self.fresh_database()
+        self.results: List[Dict[str, Any]] = []
+
+    def fresh_database(self):
+        """Point the app at an empty database; mongomock scans are O(n), so growth skews timings"""
+        self.server.db = self.mongo[f"zoomage_bench_{time.monotonic_ns()}"]
+
+    def log_result(self, name: str, **metrics):
+        """Log benchmark results"""
+        self.results.append({"benchmark": name, **metrics})
+        details = ", ".join(f"{key}={value}" for key, value in metrics.items())
+        print(f"⏱  {name}: {details}")
+
+    async def _run_concurrent(self, client: httpx.AsyncClient, concurrency: int, total: int, make_request):
+        """Issue `total` requests with at most `concurrency` in flight, returning elapsed seconds"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i: int):
+            async with semaphore:
+                response = await make_request(client, i)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return time.perf_counter() - started
+
+    async def bench_search_throughput(self, client: httpx.AsyncClient):
+        """Concurrent /api/search throughput should scale with concurrency, not serialize"""
+        baseline = None
+        for concurrency in CONCURRENCY_LEVELS:
+            self.fresh_database()
+
+            # Distinct queries per level so the search cache never answers
+            async def search(client, i, concurrency=concurrency):
+                return await client.post("/api/search", json={"query": f"mars-{concurrency}-{i}", "media_type": "image"})
+
+            elapsed = await self._run_concurrent(client, concurrency, REQUESTS_PER_LEVEL, search)
+            throughput = REQUESTS_PER_LEVEL / elapsed
+            baseline = baseline or throughput
+            self.log_result(
+                "search_throughput",
+                concurrency=concurrency,
+                requests=REQUESTS_PER_LEVEL,
+                seconds=round(elapsed, 3),
+                req_per_s=round(throughput, 2),
+                speedup=round(throughput / baseline, 2),
+            )
+
+    async def bench_search_pagination(self, client: httpx.AsyncClient):
+        """Paged search: parallel upstream fetches for big pages and prefetch for the next page"""
+        self.fresh_database()
+
+        async def page(query: str, number: int, size: int):
+            # Let earlier prefetches finish so their upstream calls are not charged to this page
+            await asyncio.gather(*self.server.prefetch_tasks)
+            upstream_before = StubNASAHandler.request_count
+            started = time.perf_counter()
+            response = await client.post("/api/search", json={"query": query, "page": number, "page_size": size})
+            response.raise_for_status()
+            elapsed = time.perf_counter() - started
+            return response, elapsed, StubNASAHandler.request_count - upstream_before
+
+        for size in (20, 100):
+            response, elapsed, upstream = await page(f"paged-{size}", 1, size)
+            self.log_result(
+                "search_pagination",
+                case=f"cold_page_size_{size}",
+                items=len(response.json()),
+                total=response.headers["X-Total-Count"],
+                upstream_pages=upstream,
+                ms=round(elapsed * 1000, 1),
+            )
+
+        # Scroll through pages, pausing as a reader would, so the prefetch has time to land
+        for number in (1, 2, 3):
+            response, elapsed, upstream = await page("paged-scroll", number, 20)
+            self.log_result(
+                "search_pagination",
+                case=f"scroll_page_{number}",
+                first_id=response.json()[0]["nasa_id"],
+                upstream_pages_on_request=upstream,
+                ms=round(elapsed * 1000, 1),
+            )
+            await asyncio.sleep(STUB_LATENCY * 2)
+
+    async def bench_asset_resolution(self, client: httpx.AsyncClient):
+        """collection.json renditions resolve in the background: search latency, resolution time, bytes per size"""
+        self.fresh_database()
+        await asyncio.gather(*self.server.prefetch_tasks)
+        upstream_before = StubNASAHandler.request_count
+        started = time.perf_counter()
+        response = await client.post("/api/search", json={"query": "renditions", "media_type": "image"})
+        response.raise_for_status()
+        search_ms = (time.perf_counter() - started) * 1000
+        await asyncio.gather(*self.server.rendition_tasks)
+        resolved_ms = (time.perf_counter() - started) * 1000
+        await asyncio.gather(*self.server.prefetch_tasks)
+
+        image = (await client.get(f"/api/images/{response.json()[0]['id']}")).json()
+        self.log_result(
+            "asset_resolution",
+            images=len(response.json()),
+            search_ms=round(search_ms, 1),
+            all_resolved_ms=round(resolved_ms, 1),
+            upstream_calls=StubNASAHandler.request_count - upstream_before,
+            renditions=len(image["renditions"]),
+        )
+
+        sizes = {}
+        for size in self.server.RENDITION_SIZES:
+            sizes[f"{size}_kb"] = round(len((await self.server.http_client.get(image["renditions"][size])).content) / 1024, 1)
+        self.log_result("asset_rendition_bytes", analysis_rendition=self.server.ANALYSIS_RENDITION, **sizes)
+
+    async def bench_image_proxy(self, client: httpx.AsyncClient):
+        """/raw serves a stored copy after the first view; revisits, ranges and analysis skip the upstream"""
+        self.fresh_database()
+        response = await client.post("/api/search", json={"query": "proxy", "media_type": "image"})
+        response.raise_for_status()
+        await asyncio.gather(*self.server.rendition_tasks)
+        await asyncio.gather(*self.server.prefetch_tasks)
+        image = response.json()[0]
+        raw_url = f"/api/images/{image['id']}/raw?size=large"
+
+        etag = None
+        for attempt, headers in (
+            ("cold", {}),
+            ("warm", {}),
+            ("revalidate", None),
+            ("range", {"Range": "bytes=0-65535"}),
+        ):
+            if headers is None:
+                headers = {"If-None-Match": etag} if etag else {}
+            upstream_before = StubNASAHandler.request_count
+            started = time.perf_counter()
+            raw = await client.get(raw_url, headers=headers)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            etag = raw.headers.get("etag", etag)
+            self.log_result(
+                "image_proxy",
+                attempt=attempt,
+                status=raw.status_code,
+                kb=round(len(raw.content) / 1024, 1),
+                ms=round(elapsed_ms, 2),
+                upstream_calls=StubNASAHandler.request_count - upstream_before,
+            )
+
+        # The analysis rendition is the one the viewer just fetched, so analysis reuses its bytes
+        upstream_before = StubNASAHandler.request_count
+        started = time.perf_counter()
+        analysis = await client.post("/api/analyze", json={"image_url": image["url"], "analysis_type": "patterns"})
+        analysis.raise_for_status()
+        self.log_result(
+            "image_proxy_analysis",
+            ms=round((time.perf_counter() - started) * 1000, 1),
+            upstream_calls=StubNASAHandler.request_count - upstream_before,
+            store=self.server.image_store.stats(),
+        )
+
+    async def bench_metrics_overhead(self, client: httpx.AsyncClient, iterations: int = 20000):
+        """Per-request cost of the metrics middleware and stage timers, against a cached search"""
+        async def bare_app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "method": "GET", "path": "/bench", "headers": []}
+        wrapped = self.server.RequestMetricsMiddleware(bare_app)
+        timings = {}
+        for name, app in (("bare", bare_app), ("middleware", wrapped)):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                await app(dict(scope), receive, send)
+            timings[name] = (time.perf_counter() - started) / iterations
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            with self.server.timed("bench"):
+                pass
+        stage_us = (time.perf_counter() - started) / iterations * 1e6
+
+        # A cache-hit search is the cheapest real request, so it bounds the relative overhead from above
+        await client.post("/api/search", json={"query": "metrics", "media_type": "image"})
+        await asyncio.gather(*self.server.rendition_tasks, *self.server.prefetch_tasks)
+        latencies = []
+        for _ in range(200):
+            started = time.perf_counter()
+            await client.post("/api/search", json={"query": "metrics", "media_type": "image"})
+            latencies.append(time.perf_counter() - started)
+        middleware_us = (timings["middleware"] - timings["bare"]) * 1e6
+        search_us = float(np.median(latencies)) * 1e6
+        self.log_result(
+            "metrics_overhead",
+            middleware_us=round(middleware_us, 2),
+            stage_timer_us=round(stage_us, 2),
+            cached_search_us=round(search_us, 1),
+            overhead_pct=round(100 * middleware_us / search_us, 3),
+        )
+
+    async def bench_upstream_resilience(self, client: httpx.AsyncClient, concurrency: int = 8, total: int = 64):
+        """Retries absorb a flaky upstream; during an outage the breaker fails fast and cached searches go stale, not 5xx"""
+        self.fresh_database()
+        guard = self.server.upstream_guards["nasa"]
+        breaker = guard.breaker
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(phase: str, query: str):
+            upstream_before, retries_before = StubNASAHandler.request_count, guard.retries
+            latencies, statuses = [], {}
+
+            async def one(i: int):
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/api/search", json={"query": query.format(i=i), "media_type": "image"})
+                    latencies.append(time.perf_counter() - started)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            await asyncio.gather(*(one(i) for i in range(total)))
+            await asyncio.gather(*self.server.prefetch_tasks)
+            self.log_result(
+                "upstream_resilience",
+                phase=phase,
+                requests=total,
+                ok=statuses.get(200, 0),
+                unavailable=statuses.get(503, 0),
+                other_errors=sum(count for status, count in statuses.items() if status not in (200, 503)),
+                upstream_calls=StubNASAHandler.request_count - upstream_before,
+                retries=guard.retries - retries_before,
+                circuit=breaker.state,
+                **latency_summary(latencies),
+            )
+
+        # One upstream call in five fails; retries should hide nearly all of them
+        StubNASAHandler.fail_rate = 0.2
+        try:
+            await run("flaky", "flaky-{i}")
+        finally:
+            StubNASAHandler.fail_rate = 0.0
+
+        # Warm a query, age it past its TTL, then take the upstream down
+        (await client.post("/api/search", json={"query": "stale", "media_type": "image"})).raise_for_status()
+        await asyncio.gather(*self.server.prefetch_tasks)
+        cache = self.server.search_cache
+        for key, (expires_at, value) in list(cache._entries.items()):
+            cache._entries[key] = (time.monotonic() - 1, value)
+        if cache.persist:
+            await cache.collection.update_many({}, {"$set": {"fresh_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+
+        reset_timeout = breaker.reset_timeout
+        StubNASAHandler.fail_status = 503
+        try:
+            await run("outage_uncached", "outage-{i}")
+            await run("outage_stale", "stale")
+            # Let the breaker half-open; a single probe closes it, then traffic flows again
+            StubNASAHandler.fail_status = None
+            breaker.reset_timeout = 0.2
+            await asyncio.sleep(0.3)
+            (await client.post("/api/search", json={"query": "probe", "media_type": "image"})).raise_for_status()
+            await run("recovered", "recovered-{i}")
+        finally:
+            # The asset host shares the stub, so its breaker opened during the outage too
+            StubNASAHandler.fail_status = None
+            breaker.reset_timeout = reset_timeout
+            for upstream in self.server.upstream_guards.values():
+                upstream.reset()
+
+    async def bench_search_cache(self, client: httpx.AsyncClient, concurrency: int = 16):
+        """Identical concurrent searches should coalesce into one upstream call, then hit the cache"""
+        async def search(client, i):
+            return await client.post("/api/search", json={"query": "nebula", "media_type": "image"})
+
+        upstream_before = StubNASAHandler.request_count
+        cold = await self._run_concurrent(client, concurrency, concurrency, search)
+        upstream_calls = StubNASAHandler.request_count - upstream_before
+        warm = await self._run_concurrent(client, concurrency, concurrency, search)
+        stats = self.server.search_cache.stats()
+        self.log_result(
+            "search_cache",
+            concurrency=concurrency,
+            upstream_calls=upstream_calls,
+            cold_seconds=round(cold, 3),
+            warm_seconds=round(warm, 3),
+            hits=stats["hits"],
+            coalesced=stats["coalesced"],
+            misses=stats["misses"],
+        )
+
+    async def bench_analysis_cache(self, client: httpx.AsyncClient):
+        """Repeat analyses of the same image should skip the download and the LLM call"""
+        image_url = f"{self.nasa_url}/images/cache-bench.jpg?px=1000"
+        for attempt in ("first", "repeat", "force_refresh"):
+            llm_before = FakeOpenAIHandler.request_count
+            started = time.perf_counter()
+            response = await client.post("/api/analyze", json={
+                "image_url": image_url,
+                "analysis_type": "features",
+                "force_refresh": attempt == "force_refresh",
+            })
+            response.raise_for_status()
+            self.log_result(
+                "analysis_cache",
+                attempt=attempt,
+                ms=round((time.perf_counter() - started) * 1000, 2),
+                llm_calls=FakeOpenAIHandler.request_count - llm_before,
+            )
+
+    async def _legacy_encode_image(self, image_url: str) -> str:
+        """Whole-body download and one-shot base64 encoding that get_ai_analysis used originally"""
+        response = await self.server.http_client.get(image_url)
+        response.raise_for_status()
+        image_base64 = base64.b64encode(response.content).decode("utf-8")
+        return f"data:image/png;base64,{image_base64}"
+
+    async def _pipeline_encode_image(self, image_url: str) -> str:
+        image = await self.server.download_image(image_url)
+        try:
+            return await self.server.prepare_image(image)
+        finally:
+            image.discard()
+
+    def bench_response_serialization(self, page_sizes=(20, 100, 1000)):
+        """CPU per response and bytes on the wire for image lists, old response_model path vs orjson and compression"""
+        server = self.server
+        adapter = TypeAdapter(List[server.NASAImage])
+        rng = random.Random(25)
+        encodings = ["gzip"] + (["br"] if server.brotli is not None else [])
+
+        def cpu_us(work, repeats: int) -> float:
+            started = time.process_time()
+            for _ in range(repeats):
+                work()
+            return (time.process_time() - started) / repeats * 1e6
+
+        for page_size in page_sizes:
+            docs = [make_stored_image(rng, i) for i in range(page_size)]
+            repeats = max(5, 4000 // page_size)
+
+            def pydantic_json():
+                # What FastAPI did: a model per document, response_model validation, then JSONResponse's json.dumps
+                models = adapter.validate_python([server.NASAImage(**doc) for doc in docs])
+                return json.dumps(
+                    adapter.dump_python(models, mode="json"),
+                    ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+                ).encode()
+
+            def orjson_direct():
+                return server.dump_json([server.image_document(doc) for doc in docs])
+
+            baseline_us = cpu_us(pydantic_json, repeats)
+            body = orjson_direct()
+            assert json.loads(body) == json.loads(pydantic_json())
+            direct_us = cpu_us(orjson_direct, repeats)
+            self.log_result("response_serialization", page_size=page_size, path="pydantic_json", cpu_us=round(baseline_us, 1), kb=round(len(pydantic_json()) / 1024, 1))
+            self.log_result(
+                "response_serialization", page_size=page_size, path="orjson_direct", cpu_us=round(direct_us, 1),
+                kb=round(len(body) / 1024, 1), speedup=round(baseline_us / direct_us, 2),
+            )
+            for encoding in encodings:
+                compress_us = cpu_us(lambda: server.compress_body(body, encoding), repeats)
+                compressed = server.compress_body(body, encoding)
+                self.log_result(
+                    "response_serialization", page_size=page_size, path=f"orjson_direct+{encoding}",
+                    cpu_us=round(direct_us + compress_us, 1), compress_us=round(compress_us, 1),
+                    kb=round(len(compressed) / 1024, 1), ratio=round(len(body) / len(compressed), 2),
+                )
+
+    def bench_cold_start(self):
+        """Fresh-process startup: import time of server.py and time from spawn to the first 200 on /api/"""
+        backend = str(ROOT_DIR / "backend")
+        env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+        if BENCH_MONGO_URL:
+            env.update(MONGO_URL=BENCH_MONGO_URL, DB_NAME="zoomage_cold_start")
+
+        import_ms, modules = [], {}
+        for _ in range(COLD_START_RUNS):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", "import server"],
+                cwd=backend, env=env, capture_output=True, text=True, check=True,
+            )
+            # Lines read "import time: self | cumulative | name", nested imports indented under their importer
+            for line in result.stderr.splitlines():
+                if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+                    continue
+                _, cumulative, name = line.split("|")
+                if name.strip() == "server":
+                    import_ms.append(int(cumulative) / 1000)
+                elif name.startswith("   ") and not name.startswith("    "):
+                    modules.setdefault(name.strip(), []).append(int(cumulative) / 1000)
+        slowest = sorted(modules.items(), key=lambda item: -statistics.median(item[1]))[:5]
+        median = statistics.median(import_ms)
+        self.log_result(
+            "cold_start",
+            phase="import",
+            runs=COLD_START_RUNS,
+            median_ms=round(median, 1),
+            min_ms=round(min(import_ms), 1),
+            target_ms=IMPORT_TARGET_MS,
+            within_target=median <= IMPORT_TARGET_MS,
+            slowest_imports=", ".join(f"{name}={statistics.median(times):.0f}ms" for name, times in slowest),
+        )
+
+        first_200_ms = []
+        for _ in range(COLD_START_RUNS):
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                port = sock.getsockname()[1]
+            script = COLD_START_SCRIPT.format(backend=backend, mongomock=not BENCH_MONGO_URL, port=port)
+            # One client for all polls; building one per attempt would load certificates every time
+            poller = httpx.Client(timeout=1)
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, "-c", script], cwd=backend, env=env)
+            try:
+                while time.perf_counter() - started < 60:
+                    try:
+                        if poller.get(f"http://127.0.0.1:{port}/api/").status_code == 200:
+                            first_200_ms.append((time.perf_counter() - started) * 1000)
+                            break
+                    except httpx.TransportError:
+                        pass
+                    if process.poll() is not None:
+                        raise RuntimeError(f"server exited with {process.returncode} before answering")
+                    time.sleep(0.005)
+                else:
+                    raise RuntimeError("server did not answer within 60s")
+            finally:
+                process.terminate()
+                process.wait()
+                poller.close()
+        median = statistics.median(first_200_ms)
+        self.log_result(
+            "cold_start",
+            phase="first_200",
+            runs=COLD_START_RUNS,
+            median_ms=round(median, 1),
+            min_ms=round(min(first_200_ms), 1),
+            target_ms=FIRST_200_TARGET_MS,
+            within_target=median <= FIRST_200_TARGET_MS,
+            mongo="mongod" if BENCH_MONGO_URL else "mongomock",
+        )
+
+    async def bench_image_memory(self):
+        """Peak main-process heap while turning an image URL into a vision-model data URL"""
+        for px in IMAGE_SIZES_PX:
+            image_url = f"{self.nasa_url}/images/memory-{px}.jpg?px={px}"
+            image_mb = len(make_noise_jpeg(px)) / 1024 / 1024
+            for label, encode in (("legacy", self._legacy_encode_image), ("pipeline", self._pipeline_encode_image)):
+                tracemalloc.start()
+                data_url = await encode(image_url)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                del data_url
+                self.log_result(
+                    "image_memory",
+                    path=label,
+                    image_mb=round(image_mb, 1),
+                    peak_mb=round(peak / 1024 / 1024, 1),
+                )
+
+    async def bench_image_preprocessing(self, px: int = 3000):
+        """Bytes sent to the vision model and preparation latency, original vs downscaled"""
+        image_url = f"{self.nasa_url}/images/preprocess-{px}.jpg?px={px}"
+        max_edge = self.server.IMAGE_MAX_EDGE
+        try:
+            for edge, attempts in ((0, ("original",)), (max_edge, ("cold", "warm"))):
+                self.server.IMAGE_MAX_EDGE = edge
+                for attempt in attempts:
+                    started = time.perf_counter()
+                    data_url = await self._pipeline_encode_image(image_url)
+                    self.log_result(
+                        "image_preprocessing",
+                        max_edge=edge,
+                        attempt=attempt,
+                        bytes_sent=len(data_url),
+                        ms=round((time.perf_counter() - started) * 1000, 1),
+                    )
+        finally:
+            self.server.IMAGE_MAX_EDGE = max_edge
+
+    async def bench_streaming_analysis(self):
+        """Time-to-first-token over SSE vs the blocking route, checked against the fake streaming server
+
+        Runs behind a real uvicorn socket because httpx's ASGI transport buffers whole responses.
+        """
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        config = uvicorn.Config(self.server.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning")
+        api = uvicorn.Server(config)
+        serving = asyncio.create_task(api.serve())
+        while not api.started:
+            await asyncio.sleep(0.01)
+
+        image_url = f"{self.nasa_url}/images/stream-bench.jpg?px=1000"
+        await self.server.db.nasa_images.insert_one(
+            self.server.NASAImage(nasa_id="stream-bench", title="Stream bench", url=image_url).dict()
+        )
+        body = {"image_url": image_url, "analysis_type": "general", "force_refresh": True}
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+                started = time.perf_counter()
+                response = await client.post("/api/analyze", json=body)
+                response.raise_for_status()
+                blocking = time.perf_counter() - started
+
+                started = time.perf_counter()
+                first_token = None
+                tokens, final = [], None
+                async with client.stream("POST", "/api/analyze/stream", json=body) as response:
+                    response.raise_for_status()
+                    event = None
+                    async for line in response.aiter_lines():
+                        if line.startswith("event: "):
+                            event = line[len("event: "):]
+                        elif line.startswith("data: "):
+                            data = json.loads(line[len("data: "):])
+                            if event == "token":
+                                first_token = first_token or time.perf_counter() - started
+                                tokens.append(data["text"])
+                            elif event == "done":
+                                final = data["analysis"]
+                            elif event == "error":
+                                raise RuntimeError(data["detail"])
+                streamed = time.perf_counter() - started
+        finally:
+            api.should_exit = True
+            await serving
+
+        stored = await self.server.db.nasa_images.find_one({"nasa_id": "stream-bench"})
+        assert final == FakeOpenAIHandler.content, f"assembled text mismatch: {final!r}"
+        assert "".join(tokens) == final, "token events do not add up to the final text"
+        assert len(tokens) > 1, "analysis arrived as a single chunk"
+        assert first_token < streamed / 2, "first token was not sent ahead of the rest"
+        assert stored["ai_analysis"] == final, "streamed analysis was not saved to the image"
+        self.log_result(
+            "streaming_analysis",
+            blocking_ms=round(blocking * 1000, 1),
+            first_token_ms=round(first_token * 1000, 1),
+            stream_total_ms=round(streamed * 1000, 1),
+            tokens=len(tokens),
+        )
+
+    def _legacy_listing_app(self):
+        """The original GET /api/images: first 100 documents, validated into NASAImage twice"""
+        from fastapi import FastAPI
+
+        server = self.server
+        legacy = FastAPI()
+
+        @legacy.get("/api/images", response_model=List[server.NASAImage])
+        async def get_saved_images():
+            # mongomock-motor ignores to_list's length, so cap explicitly as motor would
+            images = await server.db.nasa_images.find().limit(100).to_list(100)
+            return [server.NASAImage(**img) for img in images]
+
+        return legacy
+
+    def _stored_image(self, index: int) -> Dict[str, Any]:
+        """A stored image with realistic description, analysis and label payloads"""
+        image = self.server.NASAImage(
+            nasa_id=f"listing-{index:06d}",
+            title=f"Listing image {index}",
+            description="Apollo era photograph of the lunar surface near the terminator. " * 16,
+            url=f"https://images-assets.nasa.gov/image/listing-{index:06d}/listing~orig.jpg",
+            thumbnail_url=f"https://images-assets.nasa.gov/image/listing-{index:06d}/listing~thumb.jpg",
+            date_created="1969-07-20T00:00:00Z",
+            keywords=["moon", "apollo", "surface"],
+            ai_analysis="The image shows heavily cratered highlands with ejecta rays and a sinuous rille. " * 40,
+            labels=[self.server.ImageLabel(x=i * 10.0, y=i * 5.0, width=20, height=20, label=f"crater {i}", category="crater") for i in range(5)],
+        )
+        return image.dict()
+
+    async def bench_image_listing(self):
+        """GET /api/images latency and payload size: legacy vs keyset page vs gallery projection"""
+        legacy_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self._legacy_listing_app()), base_url="http://legacy")
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.server.app), base_url="http://bench")
+        try:
+            for corpus in LISTING_CORPUS_SIZES:
+                self.fresh_database()
+                batch = [self._stored_image(i) for i in range(1000)]
+                for offset in range(0, corpus, len(batch)):
+                    for doc in batch:
+                        doc.pop("_id", None)
+                    await self.server.db.nasa_images.insert_many(batch)
+                middle = await self.server.db.nasa_images.find({}, {"_id": 1}).sort("_id", 1).skip(corpus // 2).limit(1).to_list(1)
+
+                cases = [
+                    ("legacy", legacy_client, "/api/images"),
+                    ("first_page", client, "/api/images?limit=100"),
+                    ("middle_page", client, f"/api/images?limit=100&cursor={middle[0]['_id']}"),
+                    ("gallery_fields", client, "/api/images?limit=100&fields=id,title,thumbnail_url"),
+                ]
+                for label, http, path in cases:
+                    started = time.perf_counter()
+                    response = await http.get(path)
+                    response.raise_for_status()
+                    self.log_result(
+                        "image_listing",
+                        corpus=corpus,
+                        path=label,
+                        items=len(response.json()),
+                        kb=round(len(response.content) / 1024, 1),
+                        ms=round((time.perf_counter() - started) * 1000, 1),
+                    )
+
+                # Serialization alone, isolating the skipped Pydantic round-trips from database time
+                docs = await self.server.db.nasa_images.find().limit(100).to_list(100)
+                adapter = TypeAdapter(List[self.server.NASAImage])
+                started = time.perf_counter()
+                # What FastAPI did: build models, re-validate via response_model, dump to JSON-able, json.dumps
+                models = adapter.validate_python([self.server.NASAImage(**doc) for doc in docs])
+                json.dumps(adapter.dump_python(models, mode="json"))
+                pydantic_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                self.server.dump_json([self.server.image_document(doc) for doc in docs])
+                direct_ms = (time.perf_counter() - started) * 1000
+                self.log_result("image_listing_serialize", corpus=corpus, pydantic_ms=round(pydantic_ms, 2), direct_ms=round(direct_ms, 2))
+        finally:
+            await legacy_client.aclose()
+            await client.aclose()
+
+    async def bench_label_import(self, client: httpx.AsyncClient):
+        """Bulk NDJSON label import and streaming export throughput"""
+        self.fresh_database()
+        await self.server.create_label_indexes()
+        images = (await client.post("/api/search", json={"query": "label-import", "media_type": "image"})).json()
+        body = "\n".join(
+            json.dumps({
+                "image_id": images[i % len(images)]["id"],
+                "x": float(i % 4000), "y": float(i % 3000), "width": 12.0, "height": 12.0,
+                "label": ("crater", "ridge", "dune", "rille", "plume", "ejecta")[i % 6],
+                "description": f"feature {i}", "category": ("geology", "atmosphere")[i % 2],
+            })
+            for i in range(LABEL_IMPORT_SIZE)
+        ).encode()
+
+        started = time.perf_counter()
+        response = await client.post("/api/labels/import", content=body)
+        response.raise_for_status()
+        imported = time.perf_counter() - started
+        result = response.json()
+
+        started = time.perf_counter()
+        response = await client.get("/api/labels/export")
+        response.raise_for_status()
+        exported = time.perf_counter() - started
+
+        self.log_result(
+            "label_import",
+            labels=LABEL_IMPORT_SIZE,
+            imported=result["imported"],
+            import_seconds=round(imported, 2),
+            import_per_s=round(result["imported"] / imported),
+            export_seconds=round(exported, 2),
+            export_mb=round(len(response.content) / 1024 / 1024, 1),
+        )
+
+    async def bench_label_regions(self, client: httpx.AsyncClient):
+        """Region queries over one densely labelled image: full fetch + client filter vs bbox index"""
+        self.fresh_database()
+        await self.server.create_label_indexes()
+        self.server.label_index_cache.clear()
+        image = (await client.post("/api/search", json={"query": "label-regions", "media_type": "image"})).json()[0]
+        rng = random.Random(13)
+        body = "\n".join(
+            json.dumps({
+                "image_id": image["id"],
+                "x": rng.uniform(0, 4000), "y": rng.uniform(0, 3000),
+                "width": rng.uniform(5, 60), "height": rng.uniform(5, 60),
+                "label": f"crater {i}", "category": "crater" if i % 3 else "ridge",
+            })
+            for i in range(LABEL_REGION_SIZE)
+        ).encode()
+        (await client.post("/api/labels/import", content=body)).raise_for_status()
+
+        regions = []
+        for _ in range(50):
+            x, y = rng.uniform(0, 3600), rng.uniform(0, 2600)
+            regions.append((x, y, x + 400, y + 400))
+
+        started = time.perf_counter()
+        client_side = []
+        for region in regions:
+            labels = (await client.get(f"/api/images/{image['id']}/labels")).json()
+            client_side.append(sorted(
+                label["id"] for label in labels
+                if label["x"] <= region[2] and label["x"] + label["width"] >= region[0]
+                and label["y"] <= region[3] and label["y"] + label["height"] >= region[1]
+            ))
+        client_ms = (time.perf_counter() - started) * 1000 / len(regions)
+
+        started = time.perf_counter()
+        indexed = []
+        for region in regions:
+            bbox = ",".join(str(value) for value in region)
+            labels = (await client.get(f"/api/images/{image['id']}/labels", params={"bbox": bbox})).json()
+            indexed.append(sorted(label["id"] for label in labels))
+        indexed_ms = (time.perf_counter() - started) * 1000 / len(regions)
+        assert indexed == client_side, "bbox query disagrees with client-side filtering"
+
+        started = time.perf_counter()
+        for region in regions[:10]:
+            bbox = ",".join(str(value) for value in region)
+            (await client.get("/api/labels/region", params={"bbox": bbox, "category": "ridge"})).raise_for_status()
+        cross_ms = (time.perf_counter() - started) * 1000 / 10
+
+        self.log_result(
+            "label_regions",
+            labels=LABEL_REGION_SIZE,
+            mean_matches=round(sum(map(len, indexed)) / len(indexed), 1),
+            client_filter_ms=round(client_ms, 2),
+            bbox_index_ms=round(indexed_ms, 2),
+            speedup=round(client_ms / indexed_ms, 1),
+            cross_image_ms=round(cross_ms, 2),
+        )
+
+    async def bench_local_search(self, client: httpx.AsyncClient):
+        """GET /api/search/local latency over a large stored corpus (needs a real mongod for $text)"""
+        if not BENCH_MONGO_URL:
+            self.log_result("local_search", skipped="mongomock has no $text; set BENCH_MONGO_URL")
+            return
+        self.fresh_database()
+        rng = random.Random(14)
+        vocabulary = [
+            "crater", "rille", "ridge", "dune", "plume", "ejecta", "basalt", "highlands", "mare", "canyon",
+            "glacier", "aurora", "nebula", "cluster", "galaxy", "comet", "orbit", "module", "astronaut", "launch",
+        ]
+        for offset in range(0, LOCAL_SEARCH_SIZE, 5000):
+            await self.server.db.nasa_images.insert_many([
+                {
+                    "id": f"local-{index}",
+                    "nasa_id": f"local-{index:07d}",
+                    "title": " ".join(rng.sample(vocabulary, 3)).title(),
+                    "description": " ".join(rng.choices(vocabulary, k=30)),
+                    "url": f"https://images-assets.nasa.gov/image/local-{index}/orig.jpg",
+                    "keywords": rng.sample(vocabulary, 4),
+                    "label_count": rng.choice([0, 0, 0, 3]),
+                    "ai_analysis": " ".join(rng.choices(vocabulary, k=20)) if index % 10 == 0 else None,
+                    "media_type": "image",
+                }
+                for index in range(offset, min(offset + 5000, LOCAL_SEARCH_SIZE))
+            ])
+        await self.server.create_search_indexes()
+
+        cases = [
+            ("text", {"q": "crater rille"}),
+            ("text_keyword", {"q": "plume", "keywords": "comet"}),
+            ("text_labeled_analyzed", {"q": "basalt", "labeled": "true", "analyzed": "true"}),
+            ("filters_only", {"keywords": ["nebula", "galaxy"], "labeled": "true"}),
+            ("analyzed_only", {"analyzed": "true"}),
+            ("labeled_analyzed", {"labeled": "true", "analyzed": "true"}),
+        ]
+        for name, params in cases:
+            timings = []
+            for _ in range(20):
+                started = time.perf_counter()
+                response = await client.get("/api/search/local", params=params)
+                response.raise_for_status()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.log_result(
+                "local_search",
+                corpus=LOCAL_SEARCH_SIZE,
+                case=name,
+                results=len(response.json()["results"]),
+                p50_ms=round(timings[len(timings) // 2], 1),
+                p95_ms=round(timings[int(len(timings) * 0.95) - 1], 1),
+            )
+
+    def bench_vector_search(self):
+        """k-NN over VECTOR_BENCH_SIZE clustered unit vectors: exact scan vs IVF latency and recall@10"""
+        rng = np.random.default_rng(15)
+        dim = self.server.EMBEDDING_DIM
+        # Overlapping topic clusters, so neighbours often sit in adjacent IVF lists
+        centers = rng.normal(size=(2000, dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), VECTOR_BENCH_SIZE)] + 1.2 * rng.normal(size=(VECTOR_BENCH_SIZE, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        image_ids = [f"vec-{i}" for i in range(VECTOR_BENCH_SIZE)]
+
+        started = time.perf_counter()
+        index = self.server.VectorIndex(image_ids, vectors)
+        if index.centroids is None:
+            index.build_ivf()
+        build_seconds = time.perf_counter() - started
+        queries = rng.choice(VECTOR_BENCH_SIZE, 200, replace=False)
+
+        def run(exact: bool):
+            timings, found = [], []
+            for row in queries:
+                started = time.perf_counter()
+                matches = index.search(vectors[row], 10, exclude=image_ids[row], exact=exact)
+                timings.append((time.perf_counter() - started) * 1000)
+                found.append({image_id for image_id, _ in matches})
+            timings.sort()
+            return timings, found
+
+        def log(mode: str, timings: List[float], recall: float, nprobe=None):
+            self.log_result(
+                "vector_search",
+                vectors=VECTOR_BENCH_SIZE,
+                dim=dim,
+                mode=mode,
+                nprobe=nprobe,
+                p50_ms=round(timings[len(timings) // 2], 2),
+                p95_ms=round(timings[int(len(timings) * 0.95) - 1], 2),
+                recall_at_10=round(recall, 3),
+            )
+
+        exact_timings, truth = run(exact=True)
+        log("exact", exact_timings, 1.0)
+        default_nprobe = self.server.VECTOR_IVF_NPROBE
+        try:
+            for nprobe in (4, 8, 16, 32, 48, 64, 96):
+                self.server.VECTOR_IVF_NPROBE = nprobe
+                timings, found = run(exact=False)
+                recall = sum(len(a & b) for a, b in zip(found, truth)) / (10 * len(queries))
+                log("ivf", timings, recall, nprobe)
+        finally:
+            self.server.VECTOR_IVF_NPROBE = default_nprobe
+        self.log_result(
+            "vector_index_build",
+            vectors=VECTOR_BENCH_SIZE,
+            ivf_lists=len(index.lists),
+            build_s=round(build_seconds, 2),
+            mb=round(index.vectors.nbytes / 1024 / 1024, 1),
+        )
+
+    async def bench_discovery(self, client: httpx.AsyncClient):
+        """GET /api/discover coverage and model calls: cold, fully cached, and after one image changes"""
+        self.fresh_database()
+        await self.server.create_label_indexes()
+        self.server.discovery_cache.clear()
+        images = []
+        for batch in range(DISCOVERY_IMAGES // 20):
+            images += (await client.post("/api/search", json={"query": f"discovery{batch}", "media_type": "image"})).json()
+        rng = random.Random(16)
+        features = ["crater", "ridge", "dune field", "dust plume", "rille", "ejecta ray", "lava tube", "polar cap"]
+        body = "\n".join(
+            json.dumps({
+                "image_id": image["id"], "x": rng.uniform(0, 1000), "y": rng.uniform(0, 1000),
+                "label": rng.choice(features), "description": f"{rng.choice(features)} near {rng.choice(features)}",
+            })
+            for image in images for _ in range(5)
+        ).encode()
+        (await client.post("/api/labels/import", content=body)).raise_for_status()
+
+        async def run(case: str):
+            calls, chars = FakeOpenAIHandler.request_count, FakeOpenAIHandler.prompt_chars
+            started = time.perf_counter()
+            response = await client.get("/api/discover")
+            response.raise_for_status()
+            self.log_result(
+                "discovery",
+                case=case,
+                images=len(images),
+                model_calls=FakeOpenAIHandler.request_count - calls,
+                prompt_kchars=round((FakeOpenAIHandler.prompt_chars - chars) / 1000, 1),
+                seconds=round(time.perf_counter() - started, 2),
+            )
+
+        started = time.perf_counter()
+        (await client.get("/api/labels/stats")).raise_for_status()
+        self.log_result("label_stats", labels=len(images) * 5, ms=round((time.perf_counter() - started) * 1000, 1))
+
+        await run("cold")
+        await run("cached")
+        await client.post(f"/api/images/{images[len(images) // 2]['id']}/labels", json={"x": 1, "y": 1, "label": "new feature"})
+        await run("one_image_changed")
+
+    async def _legacy_save_search_results(self, results: List[Dict]) -> None:
+        """Per-item find_one + insert_one loop that /api/search used before batching"""
+        db = self.server.db
+        for result in results:
+            existing = await db.nasa_images.find_one({"nasa_id": result["nasa_id"]})
+            if not existing:
+                await db.nasa_images.insert_one(self.server.NASAImage(**result).dict())
+
+    async def bench_search_mongo_ops(self):
+        """Count Mongo round-trips per search for a cold and a warm result set"""
+        real_db = self.server.db
+        try:
+            for label, save in (("legacy", self._legacy_save_search_results), ("batched", self.server.save_search_results)):
+                results, _ = await self.server.search_nasa_results(f"opcount-{label}")
+                for phase in ("cold", "warm"):
+                    counting_db = CountingDatabase(real_db)
+                    self.server.db = counting_db
+                    await save(results)
+                    self.server.db = real_db
+                    self.log_result(
+                        "search_mongo_ops",
+                        path=label,
+                        phase=phase,
+                        results=len(results),
+                        ops=sum(counting_db.counter.values()),
+                        breakdown=counting_db.counter,
+                    )
+            # Saving schedules rendition lookups; let them finish before the next benchmark
+            await asyncio.gather(*self.server.rendition_tasks)
+        finally:
+            self.server.db = real_db
+
+    async def seed_load_data(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        """Images, labels, embeddings and a job for the route load test to read and delete"""
+        self.fresh_database()
+        await self.server.create_label_indexes()
+        response = await client.post("/api/search", json={"query": "load", "media_type": "image"})
+        response.raise_for_status()
+        images = response.json()
+        await asyncio.gather(*self.server.rendition_tasks, *self.server.prefetch_tasks)
+
+        # DELETE needs a fresh label per request, so seed one for every request it will send
+        deletable = LOAD_REQUESTS * len(LOAD_CONCURRENCY)
+        body = "\n".join(
+            json.dumps({
+                "id": f"load-label-{i}",
+                "image_id": images[i % len(images)]["id"],
+                "x": float(i % 1000), "y": float(i % 800), "width": 16.0, "height": 16.0,
+                "label": ("crater", "ridge", "dune", "plume")[i % 4],
+                "category": ("geology", "atmosphere")[i % 2],
+            })
+            for i in range(deletable + 200)
+        ).encode()
+        (await client.post("/api/labels/import", content=body)).raise_for_status()
+        (await client.post("/api/embeddings/refresh")).raise_for_status()
+        job = (await client.post("/api/analyze/jobs", json={"image_url": images[0]["url"]})).json()
+        return {"images": images, "label_ids": [f"load-label-{i}" for i in range(deletable)], "job_id": job["id"]}
+
+    def load_scenarios(self, seed: Dict[str, Any]) -> List[LoadScenario]:
+        images = seed["images"]
+
+        def image(i: int) -> Dict[str, Any]:
+            return images[i % len(images)]
+
+        def ndjson_labels(i: int) -> bytes:
+            return "\n".join(json.dumps({
+                "image_id": image(i)["id"], "x": float(n * 20), "y": float(i % 500), "label": "import", "category": "geology"
+            }) for n in range(10)).encode()
+
+        no_text_index = None if BENCH_MONGO_URL else "mongomock has no $text support; set BENCH_MONGO_URL"
+        return [
+            LoadScenario("GET", "/api/", lambda i: ("/api/", {})),
+            LoadScenario("POST", "/api/search", lambda i: ("/api/search", {"json": {"query": "load", "page": i % 5 + 1}})),
+            LoadScenario("GET", "/api/search/local", lambda i: ("/api/search/local", {"params": {"q": "load"}}), skip=no_text_index),
+            LoadScenario("GET", "/api/images/{image_id}/similar", lambda i: (f"/api/images/{image(i)['id']}/similar", {})),
+            LoadScenario("POST", "/api/embeddings/refresh", lambda i: ("/api/embeddings/refresh", {})),
+            LoadScenario("GET", "/api/cache/stats", lambda i: ("/api/cache/stats", {})),
+            LoadScenario("GET", "/api/upstreams", lambda i: ("/api/upstreams", {})),
+            LoadScenario("GET", "/api/images", lambda i: ("/api/images", {"params": {"limit": 100}})),
+            LoadScenario("GET", "/api/images/{image_id}", lambda i: (f"/api/images/{image(i)['id']}", {})),
+            LoadScenario("GET", "/api/images/{image_id}/raw", lambda i: (f"/api/images/{image(i)['id']}/raw", {"params": {"size": "large"}})),
+            LoadScenario("POST", "/api/analyze", lambda i: ("/api/analyze", {"json": {"image_url": image(i)["url"]}})),
+            LoadScenario("POST", "/api/analyze/stream", lambda i: ("/api/analyze/stream", {"json": {"image_url": image(i)["url"]}})),
+            LoadScenario("POST", "/api/analyze/batch", lambda i: ("/api/analyze/batch", {"json": {"image_ids": [image(i)["id"], image(i + 1)["id"]]}})),
+            LoadScenario("POST", "/api/analyze/jobs", lambda i: ("/api/analyze/jobs", {"json": {"image_url": image(i)["url"]}})),
+            LoadScenario("GET", "/api/analyze/jobs/{job_id}", lambda i: (f"/api/analyze/jobs/{seed['job_id']}", {})),
+            LoadScenario("POST", "/api/images/{image_id}/labels", lambda i: (
+                f"/api/images/{image(i)['id']}/labels", {"json": {"x": float(i), "y": float(i), "width": 8.0, "height": 8.0, "label": "load"}}
+            )),
+            LoadScenario("GET", "/api/images/{image_id}/labels", lambda i: (f"/api/images/{image(i)['id']}/labels", {})),
+            LoadScenario("DELETE", "/api/images/{image_id}/labels/{label_id}", lambda i: (
+                f"/api/images/{image(i)['id']}/labels/{seed['label_ids'][i]}", {}
+            )),
+            LoadScenario("GET", "/api/labels/stats", lambda i: ("/api/labels/stats", {})),
+            LoadScenario("GET", "/api/labels/region", lambda i: ("/api/labels/region", {"params": {"bbox": "0,0,400,400", "category": "geology"}})),
+            LoadScenario("POST", "/api/labels/import", lambda i: ("/api/labels/import", {"content": ndjson_labels(i)})),
+            LoadScenario("GET", "/api/labels/export", lambda i: ("/api/labels/export", {"params": {"image_id": image(i)["id"]}})),
+            LoadScenario("GET", "/api/discover", lambda i: ("/api/discover", {})),
+            LoadScenario("GET", "/api/discover/stream", lambda i: ("/api/discover/stream", {})),
+        ]
+
+    async def run_load_scenario(self, client: httpx.AsyncClient, scenario: LoadScenario, concurrency: int):
+        """Send LOAD_REQUESTS requests with `concurrency` in flight; returns latencies, errors and elapsed seconds"""
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one(i: int):
+            nonlocal errors
+            url, kwargs = scenario.build(i)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(scenario.method, url, **kwargs)
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        first = scenario.sent
+        scenario.sent += LOAD_REQUESTS
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(first, first + LOAD_REQUESTS)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def bench_route_load(self, client: httpx.AsyncClient):
+        """Every api_router route at each LOAD_CONCURRENCY level: p50/p95/p99, requests/s and peak RSS"""
+        seed = await self.seed_load_data(client)
+        scenarios = self.load_scenarios(seed)
+
+        routes = {f"{method} {route.path}" for route in self.server.api_router.routes for method in route.methods}
+        uncovered = routes - {scenario.name for scenario in scenarios}
+        if uncovered:
+            print(f"⚠️  Routes without a load scenario: {', '.join(sorted(uncovered))}")
+
+        for scenario in scenarios:
+            if scenario.skip:
+                self.log_result("route_load", route=scenario.name, skipped=scenario.skip)
+                continue
+            for concurrency in LOAD_CONCURRENCY:
+                with PeakMemorySampler() as memory:
+                    latencies, errors, elapsed = await self.run_load_scenario(client, scenario, concurrency)
+                self.log_result(
+                    "route_load",
+                    route=scenario.name,
+                    concurrency=concurrency,
+                    requests=len(latencies),
+                    errors=errors,
+                    rps=round(len(latencies) / elapsed, 1),
+                    **latency_summary(latencies),
+                    peak_rss_mb=round(memory.peak / 1024 / 1024, 1),
+                )
+        # Let queued analysis jobs finish so they don't bleed into later benchmarks
+        while await self.server.db.analysis_jobs.count_documents({"status": {"$in": ["queued", "running"]}}):
+            await asyncio.sleep(0.1)
+
+    def save_results(self, path: str):
+        """Write every logged result, with the settings that shaped it, as JSON"""
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo": "mongod" if BENCH_MONGO_URL else "mongomock",
+            "config": {
+                "stub_latency": STUB_LATENCY,
+                "llm_latency": LLM_LATENCY,
+                "load_concurrency": LOAD_CONCURRENCY,
+                "load_requests": LOAD_REQUESTS,
+            },
+            "results": self.results,
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(report, indent=2, default=str))
+        print(f"💾 Saved {len(self.results)} results to {path}")
+
+    # Benchmarks that drive the app through an in-process HTTP client, then ones that call it directly
+    CLIENT_BENCHMARKS = [
+        "search_throughput", "search_cache", "upstream_resilience", "metrics_overhead", "search_pagination", "asset_resolution",
+        "image_proxy", "analysis_cache", "label_import", "label_regions", "local_search", "discovery", "route_load",
+    ]
+    DIRECT_BENCHMARKS = [
+        "cold_start", "response_serialization", "streaming_analysis", "image_memory", "image_preprocessing", "search_mongo_ops", "image_listing", "vector_search",
+    ]
+
+    async def run_all(self, only: List[str] = None):
+        """Run every benchmark, or just the named ones"""
+        selected = set(only or self.CLIENT_BENCHMARKS + self.DIRECT_BENCHMARKS)
+        app = self.server.app
+        await app.router.startup()
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                for name in self.CLIENT_BENCHMARKS:
+                    if name in selected:
+                        await getattr(self, f"bench_{name}")(client)
+            for name in self.DIRECT_BENCHMARKS:
+                if name in selected:
+                    result = getattr(self, f"bench_{name}")()
+                    if asyncio.iscoroutine(result):
+                        await result
+        finally:
+            await app.router.shutdown()
+            self.nasa_stub.shutdown()
+            self.openai_stub.shutdown()
+
+
+def result_key(result: Dict[str, Any]) -> tuple:
+    """Identify a result across runs by its benchmark and non-measurement fields"""
+    dimensions = ("route", "concurrency", "attempt", "case", "path", "phase", "corpus", "page_size", "px", "level")
+    return (result["benchmark"],) + tuple((name, result[name]) for name in dimensions if name in result)
+
+
+def compare_results(baseline_path: str, results: List[Dict[str, Any]]) -> int:
+    """Print p95 and throughput changes against a saved run; returns the number of regressions"""
+    baseline = {result_key(result): result for result in json.loads(Path(baseline_path).read_text())["results"]}
+    regressions = 0
+    print(f"📊 Compared with {baseline_path} (regression threshold {REGRESSION_PCT:g}%)")
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        for metric, higher_is_worse in (("p95_ms", True), ("median_ms", True), ("rps", False)):
+            if not before.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            regressed = change > REGRESSION_PCT if higher_is_worse else change < -REGRESSION_PCT
+            regressions += regressed
+            label = ", ".join(f"{value}" for _, value in result_key(result)[1:])
+            print(f"{'❌' if regressed else '  '} {result['benchmark']} [{label}] {metric}: {before[metric]} -> {result[metric]} ({change:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run (default: all): {', '.join(ZoomageBenchmark.CLIENT_BENCHMARKS + ZoomageBenchmark.DIRECT_BENCHMARKS)}")
+    parser.add_argument("--output", help="save results as JSON to this path")
+    parser.add_argument("--compare", help="JSON results of an earlier run; exits non-zero on regressions")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(ZoomageBenchmark.CLIENT_BENCHMARKS + ZoomageBenchmark.DIRECT_BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    print("🚀 Starting Zoomage Backend Benchmarks")
+    print(f"Stub upstream latency: {STUB_LATENCY}s, fake LLM latency: {LLM_LATENCY}s")
+    print("=" * 60)
+    bench = ZoomageBenchmark()
+    asyncio.run(bench.run_all(args.benchmarks))
+    print("=" * 60)
+    if args.output:
+        bench.save_results(args.output)
+    missed = [result for result in bench.results if result.get("within_target") is False]
+    for result in missed:
+        print(f"❌ {result['benchmark']} [{result.get('phase')}] {result['median_ms']}ms is over its {result['target_ms']:g}ms target")
+    regressions = compare_results(args.compare, bench.results) if args.compare else 0
+    if missed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
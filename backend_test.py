@@ -5,10 +5,9 @@ Tests all core functionality including NASA API integration, AI analysis, and la
 """
 
 import requests
-import json
 import time
 import sys
-from typing import Dict, List, Any
+from typing import Any
 
 # Configuration
 BASE_URL = "https://zoomage-explore.preview.emergentagent.com/api"
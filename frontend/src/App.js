@@ -12,6 +12,9 @@ function App() {
   const [selectedImage, setSelectedImage] = useState(null);
   const [labels, setLabels] = useState([]);
   const [isSearching, setIsSearching] = useState(false);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  // Where the next page of the gallery comes from: a NASA search page or a saved-images cursor
+  const [nextPage, setNextPage] = useState(null);
   const [isAnalyzing, setIsAnalyzing] = useState(false);
   const [aiAnalysis, setAiAnalysis] = useState('');
   const [showAnalysis, setShowAnalysis] = useState(false);
@@ -31,17 +34,29 @@ function App() {
   const viewerRef = useRef(null);
   const osdViewerRef = useRef(null);
 
+  const SEARCH_PAGE_SIZE = 20;
+
+  const searchPage = (query, page) => axios.post(`${API}/search`, {
+    query,
+    media_type: 'image',
+    page,
+    page_size: SEARCH_PAGE_SIZE
+  });
+
+  const nextSearchPage = (query, page, response) => {
+    const total = Number(response.headers['x-total-count'] || 0);
+    return page * SEARCH_PAGE_SIZE < total ? { query, page: page + 1 } : null;
+  };
+
   // Search NASA images
   const searchImages = async () => {
     if (!searchQuery.trim()) return;
     
     setIsSearching(true);
     try {
-      const response = await axios.post(`${API}/search`, {
-        query: searchQuery,
-        media_type: 'image'
-      });
+      const response = await searchPage(searchQuery, 1);
       setImages(response.data);
+      setNextPage(nextSearchPage(searchQuery, 1, response));
     } catch (error) {
       console.error('Error searching images:', error);
       alert('Error searching images');
@@ -57,6 +72,8 @@ function App() {
         const response = await axios.get(`${API}/images`);
         if (response.data.length > 0) {
           setImages(response.data);
+          const cursor = response.headers['x-next-cursor'];
+          setNextPage(cursor ? { cursor } : null);
         }
       } catch (error) {
         console.error('Error loading saved images:', error);
@@ -65,6 +82,41 @@ function App() {
     loadSavedImages();
   }, []);
 
+  // Append the next page when the gallery is scrolled near its end (infinite scroll)
+  const loadMoreImages = async () => {
+    if (!nextPage || isLoadingMore || isSearching) return;
+    
+    setIsLoadingMore(true);
+    try {
+      let response;
+      let following;
+      if (nextPage.cursor) {
+        response = await axios.get(`${API}/images`, { params: { cursor: nextPage.cursor } });
+        const cursor = response.headers['x-next-cursor'];
+        following = cursor ? { cursor } : null;
+      } else {
+        response = await searchPage(nextPage.query, nextPage.page);
+        following = nextSearchPage(nextPage.query, nextPage.page, response);
+      }
+      setImages((current) => {
+        const seen = new Set(current.map((image) => image.id));
+        return [...current, ...response.data.filter((image) => !seen.has(image.id))];
+      });
+      setNextPage(following);
+    } catch (error) {
+      console.error('Error loading more images:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  const handleSidebarScroll = (e) => {
+    const { scrollTop, clientHeight, scrollHeight } = e.currentTarget;
+    if (scrollTop + clientHeight >= scrollHeight - 400) {
+      loadMoreImages();
+    }
+  };
+
   // Initialize OpenSeadragon viewer
   const initializeViewer = useCallback((imageUrl) => {
     if (osdViewerRef.current) {
@@ -149,12 +201,16 @@ function App() {
     setShowAnalysis(false);
   };
 
+  // Deep zoom wants the large rendition; originals can be huge TIFFs. The backend proxy
+  // picks the rendition, caches its bytes and shares them with the analysis path.
+  const viewerUrl = selectedImage ? `${API}/images/${selectedImage.id}/raw?size=large` : null;
+
   // Initialize viewer when image is selected
   useEffect(() => {
-    if (selectedImage) {
-      initializeViewer(selectedImage.url);
+    if (viewerUrl) {
+      initializeViewer(viewerUrl);
     }
-  }, [selectedImage, initializeViewer]);
+  }, [viewerUrl, initializeViewer]);
 
   // AI Analysis
   const analyzeWithAI = async (analysisType = 'general') => {
@@ -247,7 +303,7 @@ function App() {
 
       <div className="flex h-screen">
         {/* Sidebar */}
-        <div className="w-80 bg-gray-800 border-r border-gray-700 p-4 overflow-y-auto">
+        <div className="w-80 bg-gray-800 border-r border-gray-700 p-4 overflow-y-auto" onScroll={handleSidebarScroll}>
           {/* Search Section */}
           <div className="mb-6">
             <h2 className="text-xl font-semibold mb-3 text-blue-300">Search NASA Images</h2>
@@ -304,15 +360,18 @@ function App() {
                 <p className="text-sm text-gray-400 line-clamp-2">
                   {image.description?.substring(0, 100)}...
                 </p>
-                {image.labels.length > 0 && (
+                {(image.label_count ?? image.labels.length) > 0 && (
                   <div className="mt-2">
                     <span className="text-xs bg-green-600 px-2 py-1 rounded">
-                      {image.labels.length} labels
+                      {image.label_count ?? image.labels.length} labels
                     </span>
                   </div>
                 )}
               </div>
             ))}
+            {isLoadingMore && (
+              <p className="text-center text-sm text-gray-400 py-2">Loading more images...</p>
+            )}
           </div>
         </div>
 
@@ -32,7 +32,8 @@ if st.button("Search"):
         if images:
             st.write(f"Found {len(images)} images")
             for img in images:
-                st.image(img.get("url"), caption=img.get("title") or img.get("nasa_id"), use_column_width=True)
+                # The backend proxy caches image bytes, so revisits and analysis skip NASA's CDN
+                st.image(f"{BACKEND_URL}/images/{img.get('id')}/raw?size=large", caption=img.get("title") or img.get("nasa_id"), use_column_width=True)
                 if st.button(f"Analyze {img.get('nasa_id')}", key=f"analyze_{img.get('nasa_id')}"):
                     try:
                         aresp = requests.post(
@@ -0,0 +1,100 @@
+"""Shared fixtures: the app on a fresh mongomock database, with NASA and OpenAI replaced by local stubs"""
+
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+import uvicorn
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+from backend_bench import FakeOpenAIHandler, StubNASAHandler, start_stub_server  # noqa: E402
+
+# server reads its configuration at import, so the stubs have to be up first
+nasa_stub = start_stub_server(StubNASAHandler)
+openai_stub = start_stub_server(FakeOpenAIHandler)
+NASA_URL = f"http://127.0.0.1:{nasa_stub.server_port}"
+os.environ["NASA_API_URL"] = NASA_URL
+os.environ["NASA_ASSETS_URL"] = f"http://localhost:{nasa_stub.server_port}"
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_stub.server_port}/v1"
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["IMAGE_CACHE_DIR"] = tempfile.mkdtemp(prefix="zoomage-test-")
+os.environ["NASA_RATE_LIMIT"] = "0"
+os.environ["LLM_RATE_LIMIT"] = "0"
+
+import server  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+mongo = AsyncMongoMockClient()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def stub_defaults():
+    """Fast, healthy stubs; tests that inject faults or latency get them undone afterwards"""
+    StubNASAHandler.latency = 0
+    StubNASAHandler.fail_status = None
+    StubNASAHandler.fail_rate = 0.0
+    FakeOpenAIHandler.latency = 0.05
+    yield
+    StubNASAHandler.fail_status = None
+    StubNASAHandler.fail_rate = 0.0
+
+
+@pytest.fixture
+async def app(anyio_backend):
+    """The app started against an empty database, with every in-memory cache and breaker reset"""
+    server.db = mongo[f"zoomage_test_{uuid.uuid4().hex}"]
+    for cache in (server.search_cache, server.manifest_cache, server.discovery_cache, server.label_index_cache, server.vector_index_cache):
+        cache.clear()
+    for guard in server.upstream_guards.values():
+        guard.reset()
+    await server.app.router.startup()
+    try:
+        yield server.app
+    finally:
+        await server.app.router.shutdown()
+
+
+@pytest.fixture
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=30) as client:
+        yield client
+
+
+@pytest.fixture
+async def live_client(app):
+    """A client talking to the app over a real socket; the ASGI transport buffers whole responses"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    api = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    serving = asyncio.create_task(api.serve())
+    while not api.started:
+        await asyncio.sleep(0.01)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=30) as client:
+            yield client
+    finally:
+        api.should_exit = True
+        await serving
+
+
+@pytest.fixture
+async def stored_image(app):
+    """One stored image whose URL the NASA stub serves as a small JPEG"""
+    image = server.NASAImage(nasa_id="test-image", title="Test image", url=f"{NASA_URL}/images/test-image.jpg?px=200")
+    await server.db.nasa_images.insert_one(image.dict())
+    return image.dict()
@@ -0,0 +1,94 @@
+"""Mongo-backed analysis jobs: claiming, leases, requeueing and the HTTP API"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from backend_bench import FakeOpenAIHandler
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def no_workers(app):
+    """Stop the background workers so the test drives claiming itself"""
+    await server.stop_analysis_workers()
+
+
+async def enqueue(image_url: str) -> server.AnalysisJob:
+    return await server.enqueue_analysis_job(server.AIAnalysisRequest(image_url=image_url))
+
+
+async def test_jobs_are_claimed_oldest_first_and_only_once(no_workers):
+    first = await enqueue("https://example.test/1.jpg")
+    second = await enqueue("https://example.test/2.jpg")
+
+    claimed = await asyncio.gather(*(server.claim_analysis_job() for _ in range(3)))
+    assert [job["id"] if job else None for job in claimed] == [first.id, second.id, None]
+    assert all(job["status"] == "running" and job["attempts"] == 1 for job in claimed[:2])
+    assert claimed[0]["worker_id"] == server.WORKER_ID
+
+
+async def test_an_expired_lease_is_claimed_again(no_workers):
+    job = await enqueue("https://example.test/lease.jpg")
+    assert (await server.claim_analysis_job())["id"] == job.id
+    # Still leased to its worker
+    assert await server.claim_analysis_job() is None
+
+    await server.db.analysis_jobs.update_one(
+        {"id": job.id},
+        {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+    reclaimed = await server.claim_analysis_job()
+    assert reclaimed["id"] == job.id
+    assert reclaimed["attempts"] == 2
+
+
+async def test_a_cancelled_job_goes_back_to_the_queue(no_workers, stored_image):
+    FakeOpenAIHandler.latency = 1.0
+    job = await enqueue(stored_image["url"])
+    running = asyncio.create_task(server.run_analysis_job(await server.claim_analysis_job()))
+    await asyncio.sleep(0.3)
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+
+    requeued = await server.db.analysis_jobs.find_one({"id": job.id})
+    assert requeued["status"] == "queued"
+    assert "lease_expires_at" not in requeued
+
+
+async def test_an_unavailable_upstream_requeues_instead_of_failing(no_workers, stored_image):
+    job = await enqueue(stored_image["url"])
+    claimed = await server.claim_analysis_job()
+    breaker = server.upstream_guards["llm"].breaker
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    breaker.reset_timeout = 0.1
+    try:
+        await server.run_analysis_job(claimed)
+    finally:
+        breaker.reset_timeout = server.BREAKER_RESET_TIMEOUT
+
+    requeued = await server.db.analysis_jobs.find_one({"id": job.id})
+    assert requeued["status"] == "queued"
+    assert requeued["error"] is None
+
+
+async def test_submitted_jobs_complete_through_the_api(client, stored_image):
+    response = await client.post("/api/analyze/jobs", json={"image_url": stored_image["url"], "analysis_type": "general"})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    for _ in range(100):
+        job = (await client.get(f"/api/analyze/jobs/{job_id}")).json()
+        if job["status"] in ("completed", "failed"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "completed"
+    assert job["result"] == FakeOpenAIHandler.content
+    assert job["attempts"] == 1
+
+    assert (await client.get("/api/analyze/jobs/missing")).status_code == 404
@@ -0,0 +1,100 @@
+"""AsyncTTLCache: coalescing, TTL, LRU eviction and persistence"""
+
+import asyncio
+
+import pytest
+
+import server
+from backend_bench import StubNASAHandler
+
+pytestmark = pytest.mark.anyio
+
+
+class CountingLoader:
+    """A slow loader that counts its calls and can be told to fail"""
+
+    def __init__(self, value="value", delay: float = 0.05):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+        self.error = None
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.value
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = server.AsyncTTLCache("test", maxsize=8, ttl=60)
+    loader = CountingLoader()
+    values = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(10)))
+    assert values == ["value"] * 10
+    assert loader.calls == 1
+    assert (cache.misses, cache.coalesced) == (1, 9)
+
+    assert await cache.get_or_load("key", loader) == "value"
+    assert loader.calls == 1
+    assert cache.hits == 1
+
+
+async def test_failures_reach_every_waiter_and_are_not_cached():
+    cache = server.AsyncTTLCache("test", maxsize=8, ttl=60)
+    loader = CountingLoader()
+    loader.error = RuntimeError("upstream down")
+    results = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert loader.calls == 1
+
+    loader.error = None
+    assert await cache.get_or_load("key", loader) == "value"
+    assert loader.calls == 2
+
+
+async def test_a_cancelled_load_does_not_wedge_the_key():
+    cache = server.AsyncTTLCache("test", maxsize=8, ttl=60)
+    loader = CountingLoader(delay=1)
+    task = asyncio.create_task(cache.get_or_load("key", loader))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    loader.delay = 0
+    assert await cache.get_or_load("key", loader) == "value"
+    assert loader.calls == 2
+
+
+async def test_entries_expire_and_least_recently_used_are_evicted():
+    cache = server.AsyncTTLCache("test", maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.evictions == 1
+
+    await asyncio.sleep(0.06)
+    assert cache.get("a") == (False, None)
+    assert cache.get("c") == (False, None)
+
+
+async def test_persisted_entries_survive_a_cleared_memory_cache(app):
+    cache = server.AsyncTTLCache("test_persist", maxsize=8, ttl=60, persist=True)
+    loader = CountingLoader({"items": [1, 2, 3]})
+    await cache.get_or_load(("query", 1), loader)
+    cache.clear()
+    assert await cache.get_or_load(("query", 1), loader) == {"items": [1, 2, 3]}
+    assert loader.calls == 1
+    assert cache.persistent_hits == 1
+
+
+async def test_identical_searches_make_one_upstream_call(app):
+    requests_before = StubNASAHandler.request_count
+    results = await asyncio.gather(*(server.search_nasa_results("coalesce", "image", 1, 20) for _ in range(8)))
+    assert StubNASAHandler.request_count - requests_before == 1
+    assert all(result == results[0] for result in results)
+    assert len(results[0][0]) == 20
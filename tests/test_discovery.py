@@ -0,0 +1,39 @@
+"""Map-reduce pattern discovery stays within its token budget"""
+
+import pytest
+
+import server
+from backend_bench import FakeOpenAIHandler
+
+pytestmark = pytest.mark.anyio
+
+BUDGET = 200
+
+
+@pytest.fixture
+async def labeled_images(app, monkeypatch):
+    monkeypatch.setattr(server, "DISCOVERY_CHUNK_TOKENS", BUDGET)
+    images = [server.NASAImage(nasa_id=f"discover-{i}", title=f"Image {i}", url=f"https://example.test/{i}.jpg").dict() for i in range(30)]
+    await server.db.nasa_images.insert_many([dict(image) for image in images])
+    labels = [
+        {**server.ImageLabel(x=1, y=1, label=f"feature {image_index}-{i}").dict(), "image_id": image["id"]}
+        for image_index, image in enumerate(images)
+        # One image carries far more labels than a chunk holds
+        for i in range(400 if image_index == 0 else 3)
+    ]
+    await server.db.image_labels.insert_many(labels)
+    return images
+
+
+async def test_chunks_fit_the_budget_even_for_an_oversized_image(labeled_images):
+    chunks = await server.discovery_chunks()
+    assert all(server.estimate_tokens(chunk) <= BUDGET + 1 for chunk in chunks)
+    text = "\n".join(chunks)
+    assert "feature 0-399" in text and "feature 29-2" in text
+
+
+async def test_long_summaries_are_capped_before_merging_and_in_the_final_prompt(labeled_images, monkeypatch):
+    monkeypatch.setattr(FakeOpenAIHandler, "content", "a long-winded summary " * 500)
+    messages = await server.build_discovery_messages()
+    data = messages[1]["content"].split("\n\nLabel statistics")[0]
+    assert server.estimate_tokens(data) <= BUDGET + server.estimate_tokens(server.DISCOVERY_FINAL_PROMPT)
@@ -0,0 +1,54 @@
+"""Startup merges images stored more than once under one nasa_id before the unique index"""
+
+import uuid
+
+import pytest
+
+import server
+from tests.conftest import mongo
+
+pytestmark = pytest.mark.anyio
+
+
+def image(nasa_id: str, **fields) -> dict:
+    return {**server.NASAImage(nasa_id=nasa_id, title=nasa_id, url=f"https://example.test/{nasa_id}.jpg").dict(), **fields}
+
+
+def label(name: str, **fields) -> dict:
+    return {**server.ImageLabel(x=1, y=1, label=name, category="geology").dict(), **fields}
+
+
+@pytest.fixture
+async def duplicated_db(anyio_backend):
+    """A database written before searches deduplicated, with labels on every copy"""
+    server.db = mongo[f"zoomage_test_{uuid.uuid4().hex}"]
+    copies = [image("dup"), image("dup", label_count=1), image("dup", labels=[label("embedded")]), image("single")]
+    await server.db.nasa_images.insert_many([dict(copy) for copy in copies])
+    await server.db.image_labels.insert_one({**label("moved"), "image_id": copies[1]["id"]})
+    await server.db.image_embeddings.insert_one({"image_id": copies[1]["id"], "model": "test", "vector": [1.0]})
+    await server.app.router.startup()
+    try:
+        yield copies
+    finally:
+        await server.app.router.shutdown()
+
+
+async def test_duplicates_merge_into_the_oldest_copy(duplicated_db):
+    kept = duplicated_db[0]["id"]
+    assert await server.db.nasa_images.count_documents({"nasa_id": "dup"}) == 1
+    stored = await server.db.nasa_images.find_one({"nasa_id": "dup"})
+    assert stored["id"] == kept
+    assert stored["label_count"] == 2
+    labels = await server.db.image_labels.find({"image_id": kept}).to_list(None)
+    assert sorted(doc["label"] for doc in labels) == ["embedded", "moved"]
+    assert await server.db.image_embeddings.count_documents({}) == 0
+
+    index = (await server.db.nasa_images.index_information())["nasa_id_1"]
+    assert index["unique"]
+    stats = await server.get_label_stats(top=5)
+    assert stats["totals"]["labels"] == 2
+
+
+async def test_searches_no_longer_add_copies(duplicated_db):
+    await server.save_search_results([{"nasa_id": "dup", "title": "again", "url": "https://example.test/dup.jpg"}])
+    assert await server.db.nasa_images.count_documents({"nasa_id": "dup"}) == 1
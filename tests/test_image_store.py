@@ -0,0 +1,44 @@
+"""Downscaled copies for the vision model live in the image store and share its size bound"""
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def store(app, tmp_path, monkeypatch):
+    store = server.ImageStore(tmp_path / "store", max_bytes=10**9)
+    monkeypatch.setattr(server, "image_store", store)
+    monkeypatch.setattr(server, "IMAGE_MAX_EDGE", 256)
+    return store
+
+
+async def prepare(url: str) -> str:
+    return await server.prepare_image(await server.image_store.fetch(url))
+
+
+async def test_downscaled_copies_are_counted_and_reused(store):
+    url = f"{server.NASA_API_URL}/images/store-a.jpg?px=1200"
+    first = await prepare(url)
+    files = sorted(path.name for path in store.blob_dir.iterdir())
+    assert len(files) == 2 and files[1].endswith("-256-q85.jpeg")
+    assert store.stats()["bytes"] == sum(path.stat().st_size for path in store.blob_dir.iterdir())
+
+    assert await prepare(url) == first
+    assert len(list(store.blob_dir.iterdir())) == 2
+
+
+async def test_copies_from_old_settings_are_evicted(store, monkeypatch):
+    url = f"{server.NASA_API_URL}/images/store-b.jpg?px=1200"
+    await prepare(url)
+    assert store.stats()["blobs"] == 2
+
+    # Room for about the original alone: adding the 128px copy evicts the least recently used files
+    store.max_bytes = (store.blob_dir / store.lookup(url).sha256).stat().st_size
+    monkeypatch.setattr(server, "IMAGE_MAX_EDGE", 128)
+    await prepare(url)
+    assert [path.name.split("-", 1)[1] for path in store.blob_dir.iterdir()] == ["128-q85.jpeg"]
+    assert store.stats()["bytes"] <= store.max_bytes
+    assert store.evictions == 2
@@ -0,0 +1,52 @@
+"""Stored image listing: keyset pages, field subsets and a consistent document shape"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def images(app):
+    docs = [server.NASAImage(nasa_id=f"list-{i}", title=f"Image {i}", url=f"https://example.test/{i}.jpg").dict() for i in range(5)]
+    # Written before label_count existed, and carrying an internal bookkeeping field
+    del docs[0]["label_count"]
+    docs[0]["renditions_resolved_at"] = datetime.now(timezone.utc)
+    await server.db.nasa_images.insert_many([dict(doc) for doc in docs])
+    return docs
+
+
+async def test_listed_images_have_the_model_shape(client, images):
+    response = await client.get("/api/images")
+    assert response.status_code == 200
+    listed = response.json()
+    assert [image["id"] for image in listed] == [image["id"] for image in images]
+    assert all(set(image) == set(server.NASAImage.model_fields) for image in listed)
+    assert listed[0]["label_count"] == 0
+    assert "X-Next-Cursor" not in response.headers
+
+
+async def test_field_subsets_return_only_the_requested_fields(client, images):
+    listed = (await client.get("/api/images", params={"fields": "title,label_count"})).json()
+    assert listed[0] == {"id": images[0]["id"], "title": "Image 0", "label_count": 0}
+    assert all(set(image) == {"id", "title", "label_count"} for image in listed)
+
+    response = await client.get("/api/images", params={"fields": "title,renditions_resolved_at"})
+    assert response.status_code == 400
+
+
+async def test_pages_follow_the_cursor(client, images):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/api/images", params=params)
+        seen += [image["id"] for image in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [image["id"] for image in images]
+
+    assert (await client.get("/api/images", params={"cursor": "not-an-object-id"})).status_code == 400
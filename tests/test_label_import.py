@@ -0,0 +1,119 @@
+"""Bulk label import and export, NDJSON and COCO"""
+
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def ndjson(*records) -> bytes:
+    return "\n".join(record if isinstance(record, str) else json.dumps(record) for record in records).encode()
+
+
+async def test_ndjson_import_reports_bad_lines_and_keeps_the_rest(client, stored_image):
+    body = ndjson(
+        {"image_id": stored_image["id"], "x": 1, "y": 2, "width": 3, "height": 4, "label": "crater"},
+        "[1, 2]",
+        '"just a string"',
+        "{not json",
+        {"image_id": stored_image["id"], "x": 5, "y": 6, "label": "ridge", "category": "geology"},
+        {"x": 1, "y": 1, "label": "no image"},
+        {"image_id": "missing", "x": 1, "y": 1, "label": "orphan"},
+        {"image_id": stored_image["id"], "x": "left", "y": 1, "label": "bad x"},
+    )
+    response = await client.post("/api/labels/import", content=body)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["imported"] == 2
+    assert result["error_count"] == 6
+    errors = {error["item"]: error["detail"] for error in result["errors"]}
+    assert errors[2] == "expected a JSON object, got list"
+    assert errors[3] == "expected a JSON object, got str"
+    assert 4 in errors
+    assert errors[6] == "image_id is required"
+    assert errors[7] == "Image missing not found"
+    assert errors[8].startswith("x:")
+
+    labels = (await client.get(f"/api/images/{stored_image['id']}/labels")).json()
+    assert sorted(label["label"] for label in labels) == ["crater", "ridge"]
+    image = (await client.get(f"/api/images/{stored_image['id']}")).json()
+    assert image["label_count"] == 2
+
+
+async def test_ndjson_export_round_trips_and_reimport_counts_duplicates(client, stored_image):
+    body = ndjson(*({"image_id": stored_image["id"], "x": i, "y": i, "label": f"feature-{i}"} for i in range(5)))
+    assert (await client.post("/api/labels/import", content=body)).json()["imported"] == 5
+
+    exported = await client.get("/api/labels/export", params={"image_id": stored_image["id"]})
+    assert exported.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in exported.text.splitlines()]
+    assert [record["label"] for record in records] == [f"feature-{i}" for i in range(5)]
+
+    result = (await client.post("/api/labels/import", content=exported.content)).json()
+    assert result == {"imported": 0, "duplicates": 5, "error_count": 0, "errors": []}
+
+
+async def test_coco_export_reimports_onto_the_same_image(client, stored_image):
+    body = ndjson(
+        {"image_id": stored_image["id"], "x": 10, "y": 20, "width": 30, "height": 40, "label": "crater", "category": "geology"},
+        {"image_id": stored_image["id"], "x": 50, "y": 60, "label": "plume"},
+    )
+    await client.post("/api/labels/import", content=body)
+    coco = (await client.get("/api/labels/export", params={"format": "coco"})).json()
+    assert [annotation["bbox"] for annotation in coco["annotations"]] == [[10, 20, 30, 40], [50, 60, 0.0, 0.0]]
+    assert coco["images"][0]["zoomage_id"] == stored_image["id"]
+    assert sorted(category["name"] for category in coco["categories"]) == ["geology", "plume"]
+
+    # Exported label ids come back as duplicates; fresh annotations import as new labels
+    result = (await client.post("/api/labels/import", params={"format": "coco"}, content=json.dumps(coco))).json()
+    assert result["duplicates"] == 2
+    for annotation in coco["annotations"]:
+        del annotation["zoomage_label_id"]
+    result = (await client.post("/api/labels/import", params={"format": "coco"}, content=json.dumps(coco))).json()
+    assert result["imported"] == 2
+    assert len((await client.get(f"/api/images/{stored_image['id']}/labels")).json()) == 4
+
+
+async def test_coco_import_rejects_non_object_documents(client, stored_image):
+    response = await client.post("/api/labels/import", params={"format": "coco"}, content=b"[1, 2]")
+    assert response.status_code == 400
+
+    coco = {"images": ["stray"], "annotations": [1, {"id": 7, "image_id": 1}], "categories": []}
+    result = (await client.post("/api/labels/import", params={"format": "coco"}, content=json.dumps(coco))).json()
+    assert result["imported"] == 0
+    assert result["error_count"] == 3
+    assert result["errors"][0] == {"item": "images[0]", "detail": "expected an object with an id"}
+
+
+async def test_coco_entries_without_an_id_are_per_item_errors(client, stored_image):
+    coco = {
+        "images": [{"id": 1, "zoomage_id": stored_image["id"]}, {"file_name": "no-id.jpg"}],
+        "categories": [{"id": 3, "name": "geology"}, {"name": "no id"}],
+        "annotations": [{"id": 9, "image_id": 1, "category_id": 3, "bbox": [1, 2, 3, 4]}],
+    }
+    response = await client.post("/api/labels/import", params={"format": "coco"}, content=json.dumps(coco))
+    assert response.status_code == 200
+    result = response.json()
+    assert result["imported"] == 1
+    assert [error["item"] for error in result["errors"]] == ["images[1]", "categories[1]"]
+    labels = (await client.get(f"/api/images/{stored_image['id']}/labels")).json()
+    assert [(label["label"], label["category"]) for label in labels] == [("geology", "geology")]
+
+
+async def test_an_overlong_ndjson_line_is_refused(client, stored_image, monkeypatch):
+    monkeypatch.setattr(server, "LABEL_IMPORT_MAX_LINE_BYTES", 1024)
+    label = {"image_id": stored_image["id"], "x": 1, "y": 1, "label": "kept"}
+
+    async def body():
+        yield ndjson(label) + b"\n"
+        # No newline ever arrives
+        for _ in range(64):
+            yield b"x" * 256
+
+    response = await client.post("/api/labels/import", content=body())
+    assert response.status_code == 413
+    assert "line 2" in response.json()["detail"]
+    assert len((await client.get(f"/api/images/{stored_image['id']}/labels")).json()) == 1
@@ -0,0 +1,74 @@
+"""Label region queries by bounding box"""
+
+import json
+import random
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def labeled_image(client, stored_image):
+    for x, y, width, height, label in [(0, 0, 10, 10, "corner"), (50, 50, 0, 0, "point"), (90, 10, 20, 5, "edge")]:
+        response = await client.post(
+            f"/api/images/{stored_image['id']}/labels",
+            json={"x": x, "y": y, "width": width, "height": height, "label": label, "category": "test"}
+        )
+        response.raise_for_status()
+    return stored_image
+
+
+async def test_bbox_returns_overlapping_labels(client, labeled_image):
+    response = await client.get(f"/api/images/{labeled_image['id']}/labels", params={"bbox": "5,5,50,50"})
+    assert sorted(label["label"] for label in response.json()) == ["corner", "point"]
+
+    response = await client.get("/api/labels/region", params={"bbox": "100,0,200,100"})
+    assert [label["label"] for label in response.json()] == ["edge"]
+
+
+@pytest.mark.parametrize("bbox", ["0,0,inf,10", "nan,0,10,10", "-inf,-inf,inf,inf", "0,0,1e400,10", "1,2,3", "a,b,c,d", "10,0,0,10"])
+async def test_bbox_rejects_malformed_and_non_finite_values(client, labeled_image, bbox):
+    response = await client.get(f"/api/images/{labeled_image['id']}/labels", params={"bbox": bbox})
+    assert response.status_code == 422
+    response = await client.get("/api/labels/region", params={"bbox": bbox})
+    assert response.status_code == 422
+
+
+def test_grid_over_normalized_coordinates_splits_into_many_cells():
+    rng = random.Random(7)
+    labels = [server.ImageLabel(x=rng.random(), y=rng.random(), width=0.01, height=0.01, label=str(i)) for i in range(5000)]
+    index = server.LabelGridIndex(labels)
+    assert len(index.cells) > 1000
+
+    bbox = (0.2, 0.3, 0.25, 0.32)
+    expected = [label for label in labels if server.label_overlaps(label, bbox)]
+    assert expected and index.query(bbox) == expected
+
+
+def test_grid_over_labels_at_one_point():
+    labels = [server.ImageLabel(x=0.5, y=0.5, label=str(i)) for i in range(10)]
+    index = server.LabelGridIndex(labels)
+    assert index.query((0.5, 0.5, 0.5, 0.5)) == labels
+    assert index.query((0, 0, 0.4, 0.4)) == []
+
+
+@pytest.mark.parametrize("value", ["1e999", "-1e999", "NaN", "Infinity"])
+async def test_non_finite_label_coordinates_are_rejected(client, labeled_image, value):
+    image_id = labeled_image["id"]
+    body = f'{{"x": {value}, "y": 1, "label": "bad"}}'
+    response = await client.post(f"/api/images/{image_id}/labels", content=body, headers={"content-type": "application/json"})
+    assert response.status_code == 422
+
+    line = f'{{"image_id": "{image_id}", "x": 1, "y": 1, "width": {value}, "label": "bad"}}'
+    result = (await client.post("/api/labels/import", content=line)).json()
+    assert (result["imported"], result["error_count"]) == (0, 1)
+
+    coco = {"images": [{"id": 1, "zoomage_id": image_id}], "annotations": [{"id": 1, "image_id": 1, "bbox": [1, 1, float(value), 1]}]}
+    result = (await client.post("/api/labels/import", params={"format": "coco"}, content=json.dumps(coco))).json()
+    assert (result["imported"], result["error_count"]) == (0, 1)
+
+    response = await client.get(f"/api/images/{image_id}/labels", params={"bbox": "0,0,100,100"})
+    assert response.status_code == 200
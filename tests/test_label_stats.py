@@ -0,0 +1,95 @@
+"""Materialized label statistics stay equal to a rebuild from the labels themselves"""
+
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_label(client, image_id: str, label: str, category=None) -> str:
+    response = await client.post(f"/api/images/{image_id}/labels", json={"x": 1, "y": 1, "label": label, "category": category})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def unordered(stats):
+    """Stats with ties in count free to come back in any order"""
+    categories = stats["co_occurrence"]["categories"]
+    matrix = stats["co_occurrence"]["matrix"]
+    return {
+        **{key: sorted(stats[key], key=json.dumps) for key in ("categories", "labels", "density", "keyword_correlations")},
+        "totals": stats["totals"],
+        "co_occurrence": {(a, b): matrix[i][j] for i, a in enumerate(categories) for j, b in enumerate(categories)},
+    }
+
+
+async def rebuilt_stats(client):
+    await server.db.migrations.delete_one({"_id": "label_stats_v2"})
+    await server.rebuild_label_stats()
+    return (await client.get("/api/labels/stats")).json()
+
+
+@pytest.fixture
+async def images(app):
+    docs = [
+        server.NASAImage(nasa_id=f"stats-{i}", title=f"Image {i}", url=f"https://example.test/{i}.jpg", keywords=keywords).dict()
+        for i, keywords in enumerate([["mars", "crater"], ["mars"], ["moon"]])
+    ]
+    await server.db.nasa_images.insert_many([dict(doc) for doc in docs])
+    return [doc["id"] for doc in docs]
+
+
+async def test_stats_count_labels_images_and_co_occurrence(client, images):
+    first, second, _ = images
+    await add_label(client, first, "crater", "geology")
+    await add_label(client, first, "crater", "geology")
+    await add_label(client, first, "dust", "weather")
+    await add_label(client, second, "crater", "geology")
+
+    stats = (await client.get("/api/labels/stats")).json()
+    assert stats["totals"] == {"labels": 4, "labeled_images": 2, "mean_labels_per_image": 2.0}
+    assert {doc["label"]: doc["count"] for doc in stats["labels"]} == {"crater": 3, "dust": 1}
+    assert {doc["category"]: doc["count"] for doc in stats["categories"]} == {"geology": 3, "weather": 1}
+    assert stats["co_occurrence"] == {"categories": ["geology", "weather"], "matrix": [[2, 1], [1, 1]]}
+    assert {bucket["bucket"]: bucket["images"] for bucket in stats["density"]} == {"1": 1, "2-5": 1}
+    correlation = next(doc for doc in stats["keyword_correlations"] if (doc["keyword"], doc["label"]) == ("crater", "dust"))
+    assert correlation == {"keyword": "crater", "label": "dust", "images": 1, "lift": 2.0}
+
+
+async def test_concurrent_adds_and_deletes_match_a_rebuild(client, images):
+    first, second, third = images
+    ids = await asyncio.gather(*(
+        add_label(client, image_id, label, category)
+        for image_id in images
+        for label, category in [("crater", "geology"), ("crater", "geology"), ("dust", "weather"), ("plume", None)]
+    ))
+    # Take a name off an image while another copy of it is being added back
+    await asyncio.gather(
+        client.delete(f"/api/images/{first}/labels/{ids[0]}"),
+        client.delete(f"/api/images/{first}/labels/{ids[1]}"),
+        add_label(client, first, "crater", "geology"),
+        client.delete(f"/api/images/{second}/labels/{ids[6]}"),
+        add_label(client, second, "dust", "weather"),
+        *(client.delete(f"/api/images/{third}/labels/{label_id}") for label_id in ids[8:]),
+    )
+
+    stats = (await client.get("/api/labels/stats")).json()
+    assert stats["totals"]["labels"] == 7
+    assert stats["totals"]["labeled_images"] == 2
+    assert unordered(stats) == unordered(await rebuilt_stats(client))
+    assert await server.db.image_label_values.count_documents({"count": {"$lte": 0}}) == 0
+
+
+async def test_deleting_every_label_empties_the_stats(client, images):
+    ids = [await add_label(client, images[0], "crater", "geology") for _ in range(3)]
+    for label_id in ids:
+        await client.delete(f"/api/images/{images[0]}/labels/{label_id}")
+
+    stats = (await client.get("/api/labels/stats")).json()
+    assert stats["totals"] == {"labels": 0, "labeled_images": 0, "mean_labels_per_image": 0.0}
+    assert stats["labels"] == [] and stats["categories"] == [] and stats["density"] == []
+    assert await server.db.image_label_values.count_documents({}) == 0
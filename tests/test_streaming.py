@@ -0,0 +1,76 @@
+"""Server-sent analysis streams against the fake OpenAI streaming server"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from backend_bench import FakeOpenAIHandler
+
+pytestmark = pytest.mark.anyio
+
+
+def parse_sse(block: str):
+    """(event, data) for one SSE block"""
+    fields = dict(line.split(": ", 1) for line in block.strip().splitlines())
+    return fields.get("event"), json.loads(fields["data"])
+
+
+async def read_events(response):
+    """Yield (seconds since the request, event, data) as each SSE event arrives"""
+    started = time.perf_counter()
+    buffer = ""
+    async for text in response.aiter_text():
+        buffer += text
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            yield (time.perf_counter() - started, *parse_sse(block))
+
+
+async def test_first_token_arrives_before_the_full_completion(live_client, stored_image):
+    FakeOpenAIHandler.latency = 1.0
+    events = []
+    async with live_client.stream("POST", "/api/analyze/stream", json={"image_url": stored_image["url"], "analysis_type": "general"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        async for event in read_events(response):
+            events.append(event)
+
+    first_at, first_event, _ = events[0]
+    done_at, last_event, last_data = events[-1]
+    assert first_event == "token"
+    assert done_at - first_at > FakeOpenAIHandler.latency / 2
+    assert last_event == "done"
+    assert last_data["analysis"] == FakeOpenAIHandler.content
+    assert "".join(data["text"] for _, event, data in events if event == "token") == FakeOpenAIHandler.content
+
+
+async def test_client_disconnect_cancels_the_upstream_stream(live_client, stored_image):
+    FakeOpenAIHandler.latency = 2.0
+    aborted_before = FakeOpenAIHandler.streams_aborted
+    completed_before = FakeOpenAIHandler.streams_completed
+    async with live_client.stream("POST", "/api/analyze/stream", json={"image_url": stored_image["url"], "analysis_type": "general"}) as response:
+        async for _, event, _ in read_events(response):
+            assert event == "token"
+            break
+
+    # The fake server only notices once it writes to the closed connection
+    for _ in range(50):
+        if FakeOpenAIHandler.streams_aborted > aborted_before:
+            break
+        await asyncio.sleep(0.1)
+    assert FakeOpenAIHandler.streams_aborted == aborted_before + 1
+    assert FakeOpenAIHandler.streams_completed == completed_before
+
+
+async def test_cached_analysis_streams_as_one_token_and_done(live_client, stored_image):
+    request = {"image_url": stored_image["url"], "analysis_type": "general"}
+    async with live_client.stream("POST", "/api/analyze/stream", json=request) as response:
+        [event async for event in read_events(response)]
+
+    requests_before = FakeOpenAIHandler.request_count
+    async with live_client.stream("POST", "/api/analyze/stream", json=request) as response:
+        events = [(event, data) async for _, event, data in read_events(response)]
+    assert events == [("token", {"text": FakeOpenAIHandler.content}), ("done", {"analysis": FakeOpenAIHandler.content})]
+    assert FakeOpenAIHandler.request_count == requests_before
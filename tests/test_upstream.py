@@ -0,0 +1,110 @@
+"""Circuit breaker, retries and stale-while-error behaviour of upstream calls"""
+
+import asyncio
+
+import pytest
+
+import server
+from backend_bench import StubNASAHandler
+
+pytestmark = pytest.mark.anyio
+
+
+def test_breaker_opens_after_threshold_and_lets_one_probe_through():
+    breaker = server.CircuitBreaker("test", threshold=3, reset_timeout=0.05)
+    for _ in range(2):
+        assert breaker.before_call() is None
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert 0 < breaker.before_call() <= 0.05
+
+    breaker.opened_at -= 0.05
+    assert breaker.before_call() is None
+    assert breaker.state == "half_open"
+    # Only one probe at a time while half open
+    assert breaker.before_call() is not None
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opens == 2
+
+    breaker.opened_at -= 0.05
+    assert breaker.before_call() is None
+    breaker.record_success()
+    assert (breaker.state, breaker.failures) == ("closed", 0)
+
+
+def test_a_released_probe_lets_the_next_call_probe():
+    breaker = server.CircuitBreaker("test", threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    breaker.opened_at -= 0.05
+    assert breaker.before_call() is None
+    breaker.release_probe()
+    assert breaker.before_call() is None
+
+
+async def test_stale_entries_are_served_while_the_loader_fails():
+    cache = server.AsyncTTLCache("test", maxsize=8, ttl=0.01, stale_ttl=0.2)
+
+    async def load():
+        return "fresh"
+
+    async def fail():
+        raise RuntimeError("upstream down")
+
+    assert await cache.get_or_load("key", load) == "fresh"
+    await asyncio.sleep(0.02)
+    assert cache.get("key") == (False, None)
+    assert await cache.get_or_load("key", fail) == "fresh"
+    assert cache.stale_hits == 1
+
+    await asyncio.sleep(0.2)
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("key", fail)
+
+
+@pytest.fixture
+def no_retries(monkeypatch):
+    for guard in server.upstream_guards.values():
+        monkeypatch.setattr(guard, "max_retries", 0)
+
+
+async def test_outage_serves_cached_searches_stale_and_fails_fast_otherwise(client, no_retries):
+    (await client.post("/api/search", json={"query": "before outage", "media_type": "image"})).raise_for_status()
+    for key, (expires_at, value) in list(server.search_cache._entries.items()):
+        server.search_cache._entries[key] = (0, value)
+
+    StubNASAHandler.fail_status = 503
+    stale = await client.post("/api/search", json={"query": "before outage", "media_type": "image"})
+    assert stale.status_code == 200
+    assert len(stale.json()) == 20
+
+    # Prefetches of page 2 fail too, so the circuit may open before the loop ends
+    for i in range(server.BREAKER_FAILURE_THRESHOLD):
+        response = await client.post("/api/search", json={"query": f"outage {i}", "media_type": "image"})
+        assert response.status_code in (502, 503)
+    assert server.upstream_guards["nasa"].breaker.state == "open"
+
+    requests_before = StubNASAHandler.request_count
+    refused = await client.post("/api/search", json={"query": "refused", "media_type": "image"})
+    assert refused.status_code == 503
+    assert int(refused.headers["retry-after"]) > 0
+    assert StubNASAHandler.request_count == requests_before
+
+
+async def test_raw_image_returns_503_while_the_breaker_is_open(client):
+    image = server.NASAImage(nasa_id="breaker-image", title="Breaker", url=f"{server.NASA_API_URL}/images/breaker-image.jpg?px=100")
+    await server.db.nasa_images.insert_one(image.dict())
+    breaker = server.upstream_guards["nasa"].breaker
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+    response = await client.get(f"/api/images/{image.id}/raw")
+    assert response.status_code == 503
+    assert int(response.headers["retry-after"]) > 0
+
+    breaker.reset()
+    response = await client.get(f"/api/images/{image.id}/raw")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
@@ -0,0 +1,40 @@
+"""VectorIndex upserts agree with an index built from scratch"""
+
+import numpy as np
+
+import server
+
+
+def unit_vectors(rng, count: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, server.EMBEDDING_DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_upserts_match_a_rebuilt_index():
+    rng = np.random.default_rng(0)
+    index = server.VectorIndex([f"img-{i}" for i in range(400)], unit_vectors(rng, 400))
+    index.build_ivf()
+
+    # Replacements, new images one at a time, and a batch that names one image twice
+    replaced = unit_vectors(rng, 3)
+    index.upsert_many(["img-1", "img-2", "img-3"], replaced)
+    added = unit_vectors(rng, 50)
+    for i, vector in enumerate(added):
+        index.upsert_many([f"new-{i}"], [vector])
+    twice = unit_vectors(rng, 2)
+    index.upsert_many(["img-4", "img-4"], twice)
+
+    expected = {f"img-{i}": vector for i, vector in enumerate(unit_vectors(np.random.default_rng(0), 400))}
+    expected.update(zip(["img-1", "img-2", "img-3"], replaced))
+    expected.update((f"new-{i}", vector) for i, vector in enumerate(added))
+    expected["img-4"] = twice[1]
+    rebuilt = server.VectorIndex(list(expected), np.array(list(expected.values())))
+
+    assert len(index) == len(rebuilt) == 450
+    assert len(index.buffer) < 2 * len(index)
+    assert np.array_equal(index.vectors[[index.positions[image_id] for image_id in expected]], rebuilt.vectors)
+    # Every row sits in exactly one inverted list
+    assert sorted(np.concatenate(index.lists).tolist()) == list(range(450))
+
+    query = unit_vectors(rng, 1)[0]
+    assert index.search(query, 10, exact=True) == rebuilt.search(query, 10, exact=True)